@@ -56,8 +56,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Permessi delle richieste che scrivono letti dal database (core/accesso.py)
+    'core.accesso.AccessoScritturaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Conteggio query/N+1 per endpoint: attivo solo con QUERY_BUDGET_ENABLED
+    'core.query_budget.QueryBudgetMiddleware',
 ]
 
 # Configurazione REST Framework
@@ -195,6 +199,81 @@ GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')
 STATS_MAX_RESULT_ROWS = int(os.environ.get('STATS_MAX_RESULT_ROWS', 500))
 STATS_CACHE_WIDGETS_SECONDS = int(os.environ.get('STATS_CACHE_WIDGETS_SECONDS', 300))
 
+# Modelli predittivi: processi per lo scoring batch (0/1 = nessun pool, in-process)
+ML_PREDICT_WORKERS = int(os.environ.get('ML_PREDICT_WORKERS', 0))
+
+# Traiettorie varroa per apiario: worker e tipo di pool ('thread' o 'process')
+VARROA_BATCH_WORKERS = int(os.environ.get('VARROA_BATCH_WORKERS', 0))
+VARROA_BATCH_POOL = os.environ.get('VARROA_BATCH_POOL', 'thread')
+
+# Meteo giornaliero (Open-Meteo): richieste/s medie condivise tra i thread e
+# numero di download paralleli nel cron/backfill
+OPEN_METEO_MAX_RPS = float(os.environ.get('OPEN_METEO_MAX_RPS', 5))
+METEO_FETCH_WORKERS = int(os.environ.get('METEO_FETCH_WORKERS', 8))
+# Passo (gradi) della griglia su cui si agganciano gli apiari per l'Archive: uno
+# scarico per cella, condiviso dagli apiari vicini (0.25° ≈ risoluzione ERA5;
+# 0 = disattivo). Il Forecast usa sempre le coordinate esatte
+METEO_GRID_DEG = float(os.environ.get('METEO_GRID_DEG', 0.25))
+# Coordinate (celle) per singola richiesta Open-Meteo multi-località
+METEO_BATCH_LOCATIONS = int(os.environ.get('METEO_BATCH_LOCATIONS', 50))
+# Tentativi per richiesta Open-Meteo su 429/5xx e attesa iniziale (secondi,
+# raddoppia a ogni tentativo; Retry-After se indicato)
+METEO_HTTP_RETRIES = int(os.environ.get('METEO_HTTP_RETRIES', 3))
+METEO_HTTP_BACKOFF = float(os.environ.get('METEO_HTTP_BACKOFF', 2))
+
+# Sync incrementale app mobile (core/sync.py): righe per pagina (default/massimo)
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+SYNC_PAGE_SIZE_MAX = int(os.environ.get('SYNC_PAGE_SIZE_MAX', 2000))
+# Giorni di conservazione dei tombstone: cursori più vecchi ripartono da zero
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))
+# Righe lette e serializzate per blocco nella sync completa in streaming
+SYNC_STREAM_CHUNK_SIZE = int(os.environ.get('SYNC_STREAM_CHUNK_SIZE', 500))
+
+# Cache degli apiari accessibili per utente (core/accesso.py), in secondi.
+# Invalidata dai signal; usata solo se la cache è condivisa tra i processi
+# (non LocMemCache), altrimenti gli accessi si leggono dal database.
+ACCESSO_CACHE_TTL = int(os.environ.get('ACCESSO_CACHE_TTL', 300))
+
+# Budget query per endpoint (core/query_budget.py): header X-Query-Count e
+# warning su budget superati / query ripetute. Attivo di default in DEBUG;
+# STRICT trasforma il superamento del budget in eccezione (sviluppo/test).
+QUERY_BUDGET_ENABLED = os.environ.get('QUERY_BUDGET_ENABLED', str(DEBUG)).lower() in ('true', '1', 't')
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False').lower() in ('true', '1', 't')
+# Ripetizioni della stessa forma di query oltre le quali si segnala un N+1
+QUERY_BUDGET_REPEAT_THRESHOLD = int(os.environ.get('QUERY_BUDGET_REPEAT_THRESHOLD', 5))
+
+# Indice spaziale fioriture/apiari (core/geo.py): lato della cella della
+# griglia in km e secondi massimi prima di una ricostruzione
+GEO_GRID_KM = float(os.environ.get('GEO_GRID_KM', 10))
+GEO_INDEX_TTL = int(os.environ.get('GEO_INDEX_TTL', 300))
+
+# Notifiche "fioritura vicina" alla creazione di una fioritura pubblica:
+# raggio in km e righe per INSERT nei fan-out di notifiche
+FIORITURA_NOTIFICA_RAGGIO_KM = float(os.environ.get('FIORITURA_NOTIFICA_RAGGIO_KM', 10))
+NOTIFICHE_BATCH_SIZE = int(os.environ.get('NOTIFICHE_BATCH_SIZE', 500))
+# Notifiche recenti del riepilogo per utente in cache (il conteggio delle non
+# lette è in ContatoreNotifiche), valide finché non cambia la versione
+NOTIFICHE_CACHE_TTL = int(os.environ.get('NOTIFICHE_CACHE_TTL', 300))
+
+# Aggregati della dashboard web per utente (core/dashboard.py), in secondi.
+# In cache solo con una cache condivisa; invalidati dai signal per apiario a
+# ogni controllo/smielatura/arnia
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 600))
+
+# Coda lavori su database (core/jobs.py), eseguita da
+# `python manage.py esegui_lavori` (always-on task, systemd o cron).
+# ESECUZIONE_IMMEDIATA (deploy senza worker sempre attivo) avvia anche un
+# thread al commit che esegue subito il lavoro accodato, fuori dalla
+# richiesta; se fallisce resta in coda per il worker. Backoff esponenziale
+# tra i tentativi; un lavoro in corso oltre TIMEOUT torna in coda (worker
+# morto o riciclato).
+JOB_ESECUZIONE_IMMEDIATA = os.environ.get('JOB_ESECUZIONE_IMMEDIATA', 'False').lower() in ('true', '1', 't')
+JOB_CONCORRENZA = int(os.environ.get('JOB_CONCORRENZA', 2))
+JOB_BACKOFF_SECONDI = int(os.environ.get('JOB_BACKOFF_SECONDI', 30))
+JOB_BACKOFF_MAX_SECONDI = int(os.environ.get('JOB_BACKOFF_MAX_SECONDI', 3600))
+JOB_TIMEOUT_SECONDI = int(os.environ.get('JOB_TIMEOUT_SECONDI', 900))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 14))
+
 # CKEditor 5 — editor WYSIWYG per le Comunicazioni Broadcast nel pannello admin
 CKEDITOR_5_CONFIGS = {
     'broadcast': {
@@ -228,6 +307,29 @@ CACHES = {
 
 # ONNX bee detection model (esportato da best.pt con ultralytics)
 ONNX_MODEL_PATH = str(BASE_DIR / 'core' / 'ai_models' / 'best.onnx')
+# Immagini per chiamata ONNX se il modello ha batch dinamico (export con
+# dynamic=True; con batch fisso si usa quello) e massimo per richiesta batch
+ONNX_BATCH_SIZE = int(os.environ.get('ONNX_BATCH_SIZE', 8))
+ONNX_BATCH_MAX_IMAGES = int(os.environ.get('ONNX_BATCH_MAX_IMAGES', 20))
+# Pool di sessioni ONNX (core/onnx_pool.py): sessioni per processo, richieste
+# in attesa oltre le quali si risponde 503, secondi di attesa massima
+ONNX_POOL_SIZE = int(os.environ.get('ONNX_POOL_SIZE', 1))
+ONNX_POOL_MAX_WAITING = int(os.environ.get('ONNX_POOL_MAX_WAITING', 8))
+ONNX_POOL_TIMEOUT = float(os.environ.get('ONNX_POOL_TIMEOUT', 10))
+# Thread ONNX Runtime per sessione (0 = default) e ottimizzazione del grafo
+# (disable | basic | extended | all)
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 0))
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', 0))
+ONNX_GRAPH_OPTIMIZATION = os.environ.get('ONNX_GRAPH_OPTIMIZATION', 'all')
+# Pesi condivisi tra le sessioni del pool: richiede accanto al modello la sua
+# versione in formato ORT (best.ort, da python -m
+# onnxruntime.tools.convert_onnx_models_to_ort best.onnx), letta una volta per
+# processo e usata direttamente come memoria degli initializer
+ONNX_SHARED_MODEL = os.environ.get('ONNX_SHARED_MODEL', 'False').lower() in ('true', '1', 't')
+# Warm-up delle sessioni in background all'avvio del worker WSGI
+ONNX_WARMUP = os.environ.get('ONNX_WARMUP', 'False').lower() in ('true', '1', 't')
+# Lato lungo in px delle miniature delle analisi telaino (core/immagini.py)
+ANALISI_MINIATURA_PX = int(os.environ.get('ANALISI_MINIATURA_PX', 320))
 
 # Configurazione crispy forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
@@ -9,3 +9,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apiario_manager.settings')
 
 application = get_wsgi_application()
+
+# Warm-up del bee detector all'avvio del worker. Le sessioni ONNX Runtime non
+# sopravvivono a un fork: con server che caricano l'app prima di forkare i
+# worker (gunicorn --preload) lasciare ONNX_WARMUP disattivato.
+from django.conf import settings  # noqa: E402
+
+if settings.ONNX_WARMUP:
+    from core.onnx_pool import riscalda
+    riscalda(in_background=True)
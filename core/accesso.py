@@ -0,0 +1,144 @@
+"""Insieme materializzato degli apiari accessibili a un utente.
+
+Un utente vede gli apiari di cui è proprietario e quelli condivisi
+(``condiviso_con_gruppo``) con un gruppo di cui è membro. Invece di ricalcolare
+a ogni richiesta la OR ``proprietario | gruppo__in`` con ``DISTINCT``,
+:func:`accesso_utente` la calcola una volta (due query) e la tiene in cache:
+
+  * ``apiari_ids`` — tupla ordinata, da usare come ``apiario_id__in=...``;
+  * ``ruoli`` — ``{apiario_id: 'proprietario' | 'admin' | 'editor' | 'viewer'}``;
+  * ``gruppi`` — ``{gruppo_id: ruolo}`` per i gruppi di cui è membro.
+
+Invalidazione: ogni modifica a MembroGruppo o ai campi di accesso di un Apiario
+(proprietario, gruppo, condiviso_con_gruppo, creazione/eliminazione) cambia la
+generazione globale (signal in core/signals.py), così tutte le voci precedenti
+smettono di essere lette. Sono modifiche rare rispetto alle letture.
+
+La cache si usa solo se è condivisa tra i processi (core/cache_condivisa.py):
+con LocMemCache la generazione cambiata da un worker non arriva agli altri,
+che continuerebbero a concedere accessi revocati. Anche con una cache
+condivisa, le richieste che scrivono (:class:`AccessoScritturaMiddleware`)
+decidono i permessi sul database.
+
+In ogni caso il risultato è memorizzato sull'oggetto utente della richiesta
+(``user._accesso_cache``), così una richiesta lo calcola una volta sola anche
+se più viste, serializer e permessi lo chiedono. La memoria è scartata da
+:func:`invalida_accesso` nel processo che fa la modifica e non è usata dentro
+una transazione.
+"""
+
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .cache_condivisa import cache_condivisa
+from .models import Apiario, MembroGruppo
+
+_GEN_KEY = 'accesso:gen'
+# Cambia a ogni modifica degli accessi in questo processo: scarta le memorie
+# per richiesta (user._accesso_cache) calcolate prima
+_modifiche = 0
+# Vero durante una richiesta POST/PUT/PATCH/DELETE
+_scrittura = ContextVar('accesso_scrittura', default=False)
+
+
+@dataclass(frozen=True)
+class AccessoUtente:
+    apiari_ids: tuple = ()
+    ruoli: dict = field(default_factory=dict)
+    gruppi: dict = field(default_factory=dict)
+
+    @property
+    def gruppi_ids(self):
+        return tuple(self.gruppi)
+
+    @property
+    def gruppi_admin_ids(self):
+        return tuple(gid for gid, ruolo in self.gruppi.items() if ruolo == 'admin')
+
+    def ruolo(self, apiario_id):
+        """Ruolo dell'utente sull'apiario, None se non accessibile."""
+        return self.ruoli.get(apiario_id)
+
+
+def _generazione():
+    # Valore iniziale unico: se la chiave viene espulsa dalla cache non
+    # si torna a leggere voci di una generazione precedente.
+    return cache.get_or_set(_GEN_KEY, time.time_ns(), None)
+
+
+def calcola_accesso(user):
+    """AccessoUtente letto dal database, senza cache."""
+    gruppi = dict(MembroGruppo.objects.filter(utente=user).values_list('gruppo_id', 'ruolo'))
+    ruoli = {}
+    for apiario_id, proprietario_id, gruppo_id in (
+        Apiario.objects
+        .filter(Q(proprietario=user) | Q(gruppo_id__in=list(gruppi), condiviso_con_gruppo=True))
+        .values_list('id', 'proprietario_id', 'gruppo_id')
+    ):
+        ruoli[apiario_id] = 'proprietario' if proprietario_id == user.pk else gruppi[gruppo_id]
+    return AccessoUtente(apiari_ids=tuple(sorted(ruoli)), ruoli=ruoli, gruppi=gruppi)
+
+
+def accesso_utente(user):
+    """AccessoUtente dell'utente, dalla cache se la generazione è attuale.
+
+    Si legge sempre dal database senza una cache condivisa, nelle richieste
+    che scrivono e dentro una transazione: la cache non deve né mostrare né
+    conservare stati non ancora committati (o poi annullati). Fuori da una
+    transazione il risultato resta su ``user`` per il resto della richiesta.
+    """
+    if not user.is_authenticated:
+        return AccessoUtente()
+    if connection.in_atomic_block:
+        return calcola_accesso(user)
+    memoria = getattr(user, '_accesso_cache', None)
+    if memoria is not None and memoria[0] == _modifiche:
+        return memoria[1]
+    accesso = _accesso_condiviso(user)
+    user._accesso_cache = (_modifiche, accesso)
+    return accesso
+
+
+def _accesso_condiviso(user):
+    if _scrittura.get() or not cache_condivisa():
+        return calcola_accesso(user)
+    key = f'accesso:{_generazione()}:{user.pk}'
+    accesso = cache.get(key)
+    if accesso is None:
+        accesso = calcola_accesso(user)
+        cache.set(key, accesso, settings.ACCESSO_CACHE_TTL)
+    return accesso
+
+
+def apiari_accessibili_ids(user):
+    return accesso_utente(user).apiari_ids
+
+
+def invalida_accesso():
+    """Scarta le voci in cache di tutti gli utenti, al commit della modifica."""
+    global _modifiche
+    _modifiche += 1
+    transaction.on_commit(lambda: cache.set(_GEN_KEY, time.time_ns(), None))
+
+
+class AccessoScritturaMiddleware:
+    """Nelle richieste che scrivono i permessi si decidono sul database,
+    non sulla voce in cache."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return self.get_response(request)
+        token = _scrittura.set(True)
+        try:
+            return self.get_response(request)
+        finally:
+            _scrittura.reset(token)
@@ -15,7 +15,7 @@ from .models import (
     Invasettamento, Cliente, Vendita, DettaglioVendita,
     AnalisiTelaino, Nucleo, ControlloNucleo,
     Profilo, AI_TIER_LIMITS, ActivationCode,
-    AdminBroadcast, Notifica,
+    AdminBroadcast, Notifica, LavoroInCoda,
 )
 
 # CKEditor 5 widget per il pannello broadcast (import safe: se la lib non è
@@ -267,6 +267,24 @@ class NotificaAdmin(admin.ModelAdmin):
     raw_id_fields = ['utente']
 
 
+@admin.register(LavoroInCoda)
+class LavoroInCodaAdmin(admin.ModelAdmin):
+    list_display = ['tipo', 'stato', 'tentativi', 'max_tentativi',
+                    'esegui_dopo', 'data_creazione', 'data_fine', 'worker']
+    list_filter = ['stato', 'tipo']
+    search_fields = ['chiave', 'errore']
+    readonly_fields = ['data_creazione', 'data_inizio', 'data_fine', 'worker', 'errore']
+    actions = ['riaccoda']
+
+    @admin.action(description='Rimetti in coda i lavori selezionati')
+    def riaccoda(self, request, queryset):
+        from django.utils import timezone
+        n = queryset.exclude(stato='in_corso').update(
+            stato='in_attesa', tentativi=0, esegui_dopo=timezone.now(), errore='',
+        )
+        self.message_user(request, f'{n} lavori rimessi in coda.')
+
+
 # Registrazioni semplici per il resto dei model
 for model in [
     Apiario, ControlloArnia, Regina, StoriaRegine,
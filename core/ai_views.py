@@ -16,7 +16,9 @@ from django.conf import settings
 from datetime import date
 
 from .ai_services import gemini_service, increment_ai_quota, check_ai_quota
-from .models import Apiario, Arnia, ControlloArnia, AnalisiTelaino, MembroGruppo
+from .accesso import accesso_utente, apiari_accessibili_ids
+from .models import Apiario, Arnia, ControlloArnia, AnalisiTelaino
+from .onnx_pool import ModelloNonDisponibile, PoolSaturo, metriche, pool_onnx
 
 # ---------------------------------------------------------------------------
 # ONNX bee detector — modello YOLOv8-seg esportato da best.pt
@@ -34,36 +36,6 @@ _INPUT_SIZE     = 640
 _CONF_THRESHOLD = 0.25
 _IOU_THRESHOLD  = 0.45
 
-# Cache sessione ONNX
-_onnx_session    = None
-_onnx_load_error = None
-
-
-def _get_onnx_session():
-    """Carica e cachea la sessione ONNX Runtime. Ritorna (session, error_str)."""
-    global _onnx_session, _onnx_load_error
-    if _onnx_session is not None:
-        return _onnx_session, None
-    if _onnx_load_error is not None:
-        return None, _onnx_load_error
-
-    model_path = getattr(settings, 'ONNX_MODEL_PATH', '')
-    if not model_path or not os.path.exists(model_path):
-        _onnx_load_error = f'Modello ONNX non trovato: {model_path}'
-        return None, _onnx_load_error
-    try:
-        import onnxruntime as ort
-        sess = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
-        _onnx_session = sess
-        return sess, None
-    except ImportError:
-        _onnx_load_error = 'onnxruntime non installato (pip install onnxruntime)'
-        return None, _onnx_load_error
-    except Exception as e:
-        _onnx_load_error = str(e)
-        return None, _onnx_load_error
-
-
 def _letterbox_chw(pil_img, target=640):
     """
     Letterbox + resize a target×target.
@@ -91,84 +63,66 @@ def _letterbox_chw(pil_img, target=640):
     return tensor, scale, pad_x, pad_y
 
 
-def _iou(a, b):
-    x1 = max(a[0], b[0]); y1 = max(a[1], b[1])
-    x2 = min(a[2], b[2]); y2 = min(a[3], b[3])
-    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
-    union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
-    return inter / union if union > 0 else 0.0
-
-
-def _nms(detections, iou_thr):
-    detections.sort(key=lambda d: d['confidence'], reverse=True)
-    kept = []
-    suppressed = [False] * len(detections)
-    for i, di in enumerate(detections):
-        if suppressed[i]:
-            continue
-        kept.append(di)
-        for j in range(i + 1, len(detections)):
-            if suppressed[j] or detections[j]['class_idx'] != di['class_idx']:
-                continue
-            if _iou(di['bbox'], detections[j]['bbox']) > iou_thr:
-                suppressed[j] = True
-    return kept
-
-
-def _run_detection(image_data_bytes):
+def _decode(out, scale, pad_x, pad_y):
     """
-    Bee detection con ONNX Runtime.
-    Output YOLOv8-seg: [1, 4+num_cls+32, 8400] — usiamo solo bbox+cls.
-    Ritorna dict con: detections, summary, avg_confidence, annotated_image (base64 JPEG).
+    Decodifica vettoriale dell'output di una immagine ([features, anchors]):
+    argmax di classe, soglia di confidenza e box cx,cy,w,h → x1,y1,x2,y2 in
+    coordinate dell'immagine originale. Ritorna (boxes [N,4], conf [N], cls [N]).
     """
     import numpy as np
-    from PIL import Image as PILImage, ImageDraw, ImageFont
-
-    sess, err = _get_onnx_session()
-    if err:
-        return {'error': err}
-
-    pil_img = PILImage.open(io.BytesIO(image_data_bytes)).convert('RGB')
-    tensor, scale, pad_x, pad_y = _letterbox_chw(pil_img, _INPUT_SIZE)
-
-    input_name = sess.get_inputs()[0].name
-    outputs    = sess.run(None, {input_name: tensor})
-    # output[0]: [1, features, detections]  features = 4bbox + num_cls + 32masks
-    out = outputs[0][0]   # [features, detections]
-
     num_cls = len(_CLASS_NAMES)
-    _, num_det = out.shape   # features × detections
-
-    raw = []
-    for d in range(num_det):
-        cls_scores = out[4:4 + num_cls, d]
-        best_cls   = int(cls_scores.argmax())
-        max_conf   = float(cls_scores[best_cls])
-        if max_conf < _CONF_THRESHOLD:
-            continue
-
-        cx, cy, w, h = float(out[0,d]), float(out[1,d]), float(out[2,d]), float(out[3,d])
-        x1 = (cx - w/2 - pad_x) / scale
-        y1 = (cy - h/2 - pad_y) / scale
-        x2 = (cx + w/2 - pad_x) / scale
-        y2 = (cy + h/2 - pad_y) / scale
-
-        raw.append({
-            'class_idx':  best_cls,
-            'class':      _CLASS_NAMES[best_cls],
-            'confidence': round(max_conf, 3),
-            'bbox':       [x1, y1, x2, y2],
-        })
-
-    filtered   = _nms(raw, _IOU_THRESHOLD)
-    summary    = {n: 0 for n in _CLASS_NAMES}
-    total_conf = 0.0
-    for det in filtered:
-        summary[det['class']] += 1
-        total_conf += det['confidence']
-    avg_conf = total_conf / len(filtered) if filtered else 0.0
+    cls_scores = out[4:4 + num_cls]                      # [num_cls, anchors]
+    best_cls   = cls_scores.argmax(axis=0)
+    max_conf   = cls_scores[best_cls, np.arange(out.shape[1])]
+    keep       = max_conf >= _CONF_THRESHOLD
+
+    cx, cy, w, h = (out[i, keep].astype(np.float64) for i in range(4))
+    boxes = np.stack([
+        (cx - w / 2 - pad_x) / scale,
+        (cy - h / 2 - pad_y) / scale,
+        (cx + w / 2 - pad_x) / scale,
+        (cy + h / 2 - pad_y) / scale,
+    ], axis=1)
+    return boxes, max_conf[keep].astype(np.float64), best_cls[keep]
+
+
+def _nms(boxes, scores, classes, iou_thr):
+    """
+    NMS greedy per classe, vettoriale: ogni box tenuto sopprime in un colpo
+    i restanti della stessa classe con IoU > iou_thr. Ritorna gli indici
+    tenuti, per `scores` decrescente (a parità, nell'ordine originale).
+    """
+    import numpy as np
+    order = np.argsort(-scores, kind='stable')
+    area  = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    kept  = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        kept.append(i)
+        x1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+        union = area[i] + area[rest] - inter
+        iou   = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        order = rest[~((iou > iou_thr) & (classes[rest] == classes[i]))]
+    return np.asarray(kept, dtype=np.intp)
+
+
+def _batch_max(sess):
+    """Immagini per chiamata: la dimensione batch fissa del modello (export
+    statico, di solito 1) o ONNX_BATCH_SIZE se l'asse batch è dinamico."""
+    dim = sess.get_inputs()[0].shape[0]
+    if isinstance(dim, int) and dim > 0:
+        return dim
+    return max(1, settings.ONNX_BATCH_SIZE)
+
+
+def _annota(pil_img, filtered):
+    """Disegna i bounding box su `pil_img`; ritorna il JPEG in base64."""
+    from PIL import ImageDraw, ImageFont
 
-    # Bounding box annotati con PIL
     draw = ImageDraw.Draw(pil_img)
     try:
         font = ImageFont.truetype("arial.ttf", 14)
@@ -186,15 +140,86 @@ def _run_detection(image_data_bytes):
 
     buf = io.BytesIO()
     pil_img.save(buf, format='JPEG', quality=88)
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+
+def _risultato(out, pil_img, scale, pad_x, pad_y):
+    """Post-processing dell'output di una immagine → dict risultato."""
+    import numpy as np
+    boxes, conf, cls = _decode(out, scale, pad_x, pad_y)
+    # Confidenza arrotondata come quella restituita, anche per l'ordine dell'NMS
+    conf = np.array([round(c, 3) for c in conf.tolist()])
+    kept = _nms(boxes, conf, cls, _IOU_THRESHOLD)
+
+    filtered = [
+        {
+            'class_idx':  int(cls[i]),
+            'class':      _CLASS_NAMES[int(cls[i])],
+            'confidence': float(conf[i]),
+            'bbox':       boxes[i].tolist(),
+        }
+        for i in kept
+    ]
+    summary = {n: 0 for n in _CLASS_NAMES}
+    for det in filtered:
+        summary[det['class']] += 1
+    avg_conf = sum(d['confidence'] for d in filtered) / len(filtered) if filtered else 0.0
 
     return {
         'detections':      [{'class': d['class'], 'confidence': d['confidence']} for d in filtered],
         'summary':         summary,
         'avg_confidence':  round(avg_conf, 3),
-        'annotated_image': base64.b64encode(buf.getvalue()).decode('utf-8'),
+        'annotated_image': _annota(pil_img, filtered),
     }
 
 
+def _run_detection_batch(images_bytes):
+    """
+    Bee detection su più immagini (es. tutte le facciate di un'arnia): le
+    immagini in letterbox vengono impilate in un unico tensore [N,3,H,W] e
+    passate a ONNX Runtime in una sola chiamata (a blocchi di `_batch_max`).
+    La sessione è presa dal pool (core/onnx_pool.py) solo per le chiamate;
+    con il pool saturo solleva PoolSaturo.
+    Ritorna una lista di risultati come `_run_detection`, nello stesso ordine.
+    """
+    import numpy as np
+    from PIL import Image as PILImage
+
+    immagini, tensori, parametri = [], [], []
+    for data in images_bytes:
+        pil_img = PILImage.open(io.BytesIO(data)).convert('RGB')
+        tensor, scale, pad_x, pad_y = _letterbox_chw(pil_img, _INPUT_SIZE)
+        immagini.append(pil_img)
+        tensori.append(tensor)
+        parametri.append((scale, pad_x, pad_y))
+
+    try:
+        with pool_onnx().sessione() as sess:
+            input_name = sess.get_inputs()[0].name
+            blocco     = _batch_max(sess)
+            uscite     = []
+            for inizio in range(0, len(tensori), blocco):
+                # output[0]: [N, features, detections]  features = 4bbox + num_cls + 32masks
+                outputs = sess.run(None, {input_name: np.concatenate(tensori[inizio:inizio + blocco], axis=0)})
+                uscite.extend(outputs[0])
+    except ModelloNonDisponibile as e:
+        return [{'error': str(e)} for _ in images_bytes]
+
+    return [
+        _risultato(out, pil_img, scale, pad_x, pad_y)
+        for out, pil_img, (scale, pad_x, pad_y) in zip(uscite, immagini, parametri)
+    ]
+
+
+def _run_detection(image_data_bytes):
+    """
+    Bee detection con ONNX Runtime.
+    Output YOLOv8-seg: [1, 4+num_cls+32, 8400] — usiamo solo bbox+cls.
+    Ritorna dict con: detections, summary, avg_confidence, annotated_image (base64 JPEG).
+    """
+    return _run_detection_batch([image_data_bytes])[0]
+
+
 # ---------------------------------------------------------------------------
 # Prompt di sistema per il chat AI
 # ---------------------------------------------------------------------------
@@ -251,15 +276,7 @@ def _get_accessible_apiari(user):
     - apiari di cui è proprietario
     - apiari condivisi con un gruppo di cui l'utente è membro (ruolo admin/editor/viewer)
     """
-    group_ids = list(
-        MembroGruppo.objects.filter(utente=user).values_list('gruppo_id', flat=True)
-    )
-    from django.db.models import Q
-    qs = Apiario.objects.filter(
-        Q(proprietario=user) |
-        Q(gruppo_id__in=group_ids, condiviso_con_gruppo=True)
-    ).distinct()
-    return qs
+    return Apiario.objects.filter(pk__in=apiari_accessibili_ids(user))
 
 
 def _get_user_role_for_apiario(user, apiario):
@@ -267,9 +284,9 @@ def _get_user_role_for_apiario(user, apiario):
     if apiario.proprietario_id == user.id:
         return 'proprietario'
     if apiario.gruppo_id:
-        membro = MembroGruppo.objects.filter(utente=user, gruppo_id=apiario.gruppo_id).first()
-        if membro:
-            return membro.ruolo
+        accesso = accesso_utente(user)
+        # Ruolo nel gruppo anche se l'apiario non è condiviso (come in origine)
+        return accesso.ruolo(apiario.pk) or accesso.gruppi.get(apiario.gruppo_id)
     return None
 
 
@@ -283,17 +300,16 @@ def _build_user_context(user):
         lines = []
         for apiario in apiari:
             ruolo = _get_user_role_for_apiario(user, apiario)
-            arnie = list(apiario.arnie.filter(attiva=True).order_by('numero'))
+            # Ultimo controllo denormalizzato sull'arnia (core/ultimo_controllo.py)
+            arnie = list(
+                apiario.arnie.filter(attiva=True)
+                .select_related('ultimo_controllo').order_by('numero')
+            )
             n_arnie = len(arnie)
 
             arnie_details = []
             for arnia in arnie[:12]:  # max 12 arnie per apiario nel contesto
-                last_ctrl = (
-                    ControlloArnia.objects
-                    .filter(arnia=arnia)
-                    .order_by('-data')
-                    .first()
-                )
+                last_ctrl = arnia.ultimo_controllo
                 if last_ctrl:
                     alerts = []
                     if not last_ctrl.presenza_regina:
@@ -565,33 +581,14 @@ def analisi_telaino(request):
         if arnia_id and numero_telaino and 'error' not in det_result:
             arnia = Arnia.objects.filter(
                 id=arnia_id,
-                apiario__in=_get_accessible_apiari(request.user),
+                apiario_id__in=apiari_accessibili_ids(request.user),
             ).first()
             if arnia:
-                summary = det_result.get('summary', {})
-                import tempfile, os as _os
-                from django.core.files.base import ContentFile
-                analisi = AnalisiTelaino(
-                    arnia              = arnia,
-                    numero_telaino     = int(numero_telaino),
-                    facciata           = facciata,
-                    conteggio_api      = summary.get('bees', 0),
-                    conteggio_regine   = summary.get('queenbees', 0),
-                    conteggio_fuchi    = summary.get('drone', 0),
-                    conteggio_celle_reali = summary.get('royal cell', 0),
-                    confidence_media   = det_result.get('avg_confidence', 0.0),
-                    note               = note or None,
-                    utente             = request.user,
-                )
-                # salva immagine originale
                 image_file.seek(0)
-                analisi.immagine.save(
-                    f'telaino_{arnia_id}_{numero_telaino}{facciata}.jpg',
-                    ContentFile(image_file.read()),
-                    save=False,
-                )
-                analisi.save()
-                saved_id = analisi.id
+                saved_id = _salva_analisi(
+                    request.user, arnia, numero_telaino, facciata, note,
+                    det_result, image_file.read(),
+                ).id
 
         return JsonResponse({
             'analysis':  analysis_text,
@@ -600,18 +597,122 @@ def analisi_telaino(request):
             'saved_id':  saved_id,
         })
 
+    except PoolSaturo as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def _salva_analisi(user, arnia, numero_telaino, facciata, note, det_result, image_bytes):
+    """Crea l'AnalisiTelaino con i conteggi della detection, l'immagine
+    originale e quella annotata. In `det_result` il base64 dell'annotata
+    viene sostituito dal suo URL (`annotated_image_url`)."""
+    from django.core.files.base import ContentFile
+    from .immagini import salva_annotata
+    summary = det_result.get('summary', {})
+    analisi = AnalisiTelaino(
+        arnia              = arnia,
+        numero_telaino     = int(numero_telaino),
+        facciata           = facciata,
+        conteggio_api      = summary.get('bees', 0),
+        conteggio_regine   = summary.get('queenbees', 0),
+        conteggio_fuchi    = summary.get('drone', 0),
+        conteggio_celle_reali = summary.get('royal cell', 0),
+        confidence_media   = det_result.get('avg_confidence', 0.0),
+        note               = note or None,
+        utente             = user,
+    )
+    analisi.immagine.save(
+        f'telaino_{arnia.id}_{numero_telaino}{facciata}.jpg',
+        ContentFile(image_bytes),
+        save=False,
+    )
+    if det_result.get('annotated_image'):
+        annotata = base64.b64decode(det_result.pop('annotated_image'))
+        det_result['annotated_image_url'] = salva_annotata(analisi, annotata)
+    analisi.save()
+    return analisi
+
+
+@login_required
+@require_POST
+def analisi_telaini_batch(request):
+    """
+    Analisi di più facciate in una sola inferenza ONNX (es. tutti i telaini
+    A/B di un'arnia). POST multipart:
+      images          — una o più immagini
+      numero_telaino  — ripetuto, uno per immagine (opzionale)
+      facciata        — ripetuto, uno per immagine (default 'A')
+      arnia_id, note  — opzionali; con arnia e numero le analisi vengono salvate
+    Ritorna {'risultati': [{analysis, yolo, saved_id}, ...]} nell'ordine delle immagini.
+    """
+    images = request.FILES.getlist('images')
+    if not images:
+        return JsonResponse({'error': 'Nessuna immagine caricata'}, status=400)
+    max_images = settings.ONNX_BATCH_MAX_IMAGES
+    if len(images) > max_images:
+        return JsonResponse({'error': f'Massimo {max_images} immagini per richiesta'}, status=400)
+
+    numeri   = request.POST.getlist('numero_telaino')
+    facciate = request.POST.getlist('facciata')
+    arnia_id = request.POST.get('arnia_id')
+    note     = request.POST.get('note', '').strip()
+
+    try:
+        arnia = None
+        if arnia_id:
+            arnia = Arnia.objects.filter(
+                id=arnia_id,
+                apiario_id__in=apiari_accessibili_ids(request.user),
+            ).first()
+
+        images_bytes = [f.read() for f in images]
+        det_results  = _run_detection_batch(images_bytes)
+
+        risultati = []
+        for i, (det_result, image_bytes) in enumerate(zip(det_results, images_bytes)):
+            numero_telaino = numeri[i] if i < len(numeri) else None
+            facciata       = facciate[i] if i < len(facciate) else 'A'
+            saved_id = None
+            if arnia and numero_telaino and 'error' not in det_result:
+                saved_id = _salva_analisi(
+                    request.user, arnia, numero_telaino, facciata, note,
+                    det_result, image_bytes,
+                ).id
+            risultati.append({
+                'analysis': _genera_analisi_yolo(det_result),
+                'yolo':     det_result,
+                'saved_id': saved_id,
+            })
+
+        return JsonResponse({'model': 'ONNX bee detector', 'risultati': risultati})
+
+    except PoolSaturo as e:
+        return JsonResponse({'error': str(e)}, status=503)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@login_required
+def onnx_metriche(request):
+    """JSON (solo staff): latenze e saturazione del pool ONNX di questo processo."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Accesso non autorizzato'}, status=403)
+    return JsonResponse(metriche())
+
+
 @login_required
 def get_arnie_per_apiario(request):
     """AJAX: ritorna le arnie attive di un apiario dell'utente."""
     apiario_id = request.GET.get('apiario_id')
     if not apiario_id:
         return JsonResponse({'arnie': []})
+    try:
+        apiario_id = int(apiario_id)
+    except ValueError:
+        return JsonResponse({'arnie': [], 'error': 'apiario_id non valido'}, status=400)
     # Verifica che l'apiario sia accessibile all'utente (proprietario o membro del gruppo)
-    if not _get_accessible_apiari(request.user).filter(id=apiario_id).exists():
+    if apiario_id not in accesso_utente(request.user).ruoli:
         return JsonResponse({'arnie': [], 'error': 'Accesso non autorizzato'}, status=403)
     arnie = list(
         Arnia.objects.filter(
@@ -630,7 +731,7 @@ def get_telaini_per_arnia(request):
         return JsonResponse({'config': None})
     last = (
         ControlloArnia.objects
-        .filter(arnia_id=arnia_id, arnia__apiario__in=_get_accessible_apiari(request.user))
+        .filter(arnia_id=arnia_id, arnia__apiario_id__in=apiari_accessibili_ids(request.user))
         .order_by('-data').first()
     )
     if last and last.telaini_config:
@@ -646,7 +747,7 @@ def get_telaini_per_arnia(request):
 def lista_analisi_telaino(request, arnia_id):
     """Lista storica analisi telaini per un'arnia."""
     arnia = Arnia.objects.filter(
-        id=arnia_id, apiario__in=_get_accessible_apiari(request.user)
+        id=arnia_id, apiario_id__in=apiari_accessibili_ids(request.user)
     ).select_related('apiario').first()
     if not arnia:
         from django.http import Http404
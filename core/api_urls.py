@@ -20,7 +20,7 @@ from .api_views import (
     google_auth,
     VarroaCheckpointViewSet,
     PesataMelarioViewSet, AlimentazioneViewSet, NomadismoEventViewSet,
-    ml_dataset_colonia, ml_predict_colonia,
+    ml_dataset_colonia, ml_predict_colonia, ml_predict_apiario,
     NotificaViewSet,
 )
 
@@ -106,4 +106,6 @@ urlpatterns = [
     path('ml/dataset/colonia/<int:colonia_id>/', ml_dataset_colonia, name='api-ml-dataset-colonia'),
     # Endpoint ML predizioni (pilota: rischio sciamatura)
     path('ml/predict/colonia/<int:colonia_id>/', ml_predict_colonia, name='api-ml-predict-colonia'),
+    # Endpoint ML predizioni batch: tutte le colonie attive di un apiario
+    path('ml/predict/apiario/<int:apiario_id>/', ml_predict_apiario, name='api-ml-predict-apiario'),
 ]
\ No newline at end of file
@@ -30,6 +30,8 @@ from .models import (
     VarroaCheckpoint, PesataMelario, Alimentazione, NomadismoEvent,
     Notifica,
 )
+from .accesso import accesso_utente, apiari_accessibili_ids
+from .notifications import aggiorna_contatori, riepilogo_notifiche
 
 from .serializers import (
     ApiarioSerializer, ApiarioCommunitySerializer, ArniaSerializer,
@@ -49,7 +51,7 @@ from .serializers import (
     AnalisiTelainoSerializer, ApiarioMapLayoutSerializer, MeteoGiornalieroSerializer,
     NucleoSerializer, ControlloNucleoSerializer,
     PreferenzaMaturazionSerializer, MatutatoreSerializer, ContenitoreStoccaggioSerializer,
-    VarroaCheckpointSerializer,
+    VarroaCheckpointSerializer, SimulazioneVarroaSerializer, annota_fioriture,
     PesataMelarioSerializer, AlimentazioneSerializer, NomadismoEventSerializer,
     NotificaSerializer,
 )
@@ -63,20 +65,17 @@ def get_apiari_accessibili(user):
     Restituisce il queryset degli apiari accessibili a un utente:
     - apiari di cui è proprietario
     - apiari condivisi con i gruppi di cui è membro
+
+    Gli id vengono da core/accesso.py (in cache): il filtro è un semplice
+    `id IN (...)`. Per filtrare altri modelli usare `apiari_accessibili_ids`.
     """
-    apiari_propri = Apiario.objects.filter(proprietario=user)
-    gruppi_utente = Gruppo.objects.filter(membri=user)
-    apiari_condivisi = Apiario.objects.filter(
-        gruppo__in=gruppi_utente,
-        condiviso_con_gruppo=True
-    ).exclude(proprietario=user)
     # order_by esplicito: la paginazione DRF richiede un queryset ordinato
-    return (apiari_propri | apiari_condivisi).distinct().order_by('id')
+    return Apiario.objects.filter(pk__in=apiari_accessibili_ids(user)).order_by('id')
 
 
 def get_gruppi_utente(user):
     """Restituisce i gruppi di cui l'utente è membro."""
-    return Gruppo.objects.filter(membri=user)
+    return Gruppo.objects.filter(pk__in=accesso_utente(user).gruppi_ids)
 
 
 # --- Permessi personalizzati ---
@@ -375,7 +374,7 @@ class ApiarioViewSet(viewsets.ModelViewSet):
         Riservato al proprietario per evitare abusi.
         """
         from datetime import date, timedelta
-        from .meteo_archive_utils import aggiorna_meteo_apiario
+        from .meteo_archive_utils import MeteoFetchError, aggiorna_meteo_apiario
 
         apiario = self.get_object()
         if apiario.proprietario != request.user:
@@ -399,7 +398,11 @@ class ApiarioViewSet(viewsets.ModelViewSet):
             except (TypeError, ValueError):
                 pass
 
-        result = aggiorna_meteo_apiario(apiario, start, ieri)
+        try:
+            result = aggiorna_meteo_apiario(apiario, start, ieri)
+        except MeteoFetchError:
+            return Response({"detail": "Servizio meteo non disponibile."},
+                            status=status.HTTP_502_BAD_GATEWAY)
         result['start'] = start.isoformat()
         result['end'] = ieri.isoformat()
         return Response(result)
@@ -483,7 +486,7 @@ class ApiarioViewSet(viewsets.ModelViewSet):
         Le coordinate sono offuscate server-side (vedi ApiarioCommunitySerializer):
         l'endpoint NON espone mai la posizione precisa degli apiari di terzi.
         """
-        accessibili_ids = get_apiari_accessibili(request.user).values_list('id', flat=True)
+        accessibili_ids = apiari_accessibili_ids(request.user)
         apiari = Apiario.objects.filter(
             visibilita_mappa='pubblico',
             latitudine__isnull=False,
@@ -502,7 +505,7 @@ class NucleoViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Nucleo.objects.filter(
-            apiario__in=get_apiari_accessibili(self.request.user)
+            apiario_id__in=apiari_accessibili_ids(self.request.user)
         )
 
     @action(detail=True, methods=['post'])
@@ -637,8 +640,8 @@ class ArniaViewSet(viewsets.ModelViewSet):
         """
         Filtra le arnie in base agli apiari accessibili all'utente.
         """
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
-        return Arnia.objects.filter(apiario__in=apiari_accessibili).order_by('id')
+        apiari_ids = apiari_accessibili_ids(self.request.user)
+        return Arnia.objects.filter(apiario_id__in=apiari_ids).order_by('id')
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -778,11 +781,11 @@ class ControlloArniaViewSet(viewsets.ModelViewSet):
         return ControlloArniaDetailSerializer
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         # Filtra per colonia.apiario (nuovo) con fallback su arnia.apiario (legacy)
         return ControlloArnia.objects.filter(
-            Q(colonia__apiario__in=apiari_accessibili) |
-            Q(colonia__isnull=True, arnia__apiario__in=apiari_accessibili)
+            Q(colonia__apiario_id__in=apiari_ids) |
+            Q(colonia__isnull=True, arnia__apiario_id__in=apiari_ids)
         ).distinct()
 
 
@@ -794,9 +797,9 @@ class ReginaViewSet(viewsets.ModelViewSet):
     search_fields = ['colonia__apiario__nome', 'razza']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         return Regina.objects.filter(
-            colonia__apiario__in=apiari_accessibili
+            colonia__apiario_id__in=apiari_ids
         ).distinct()
 
     def perform_create(self, serializer):
@@ -859,9 +862,9 @@ class StoriaRegineViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrGroupRole]
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         return StoriaRegine.objects.filter(
-            colonia__apiario__in=apiari_accessibili
+            colonia__apiario_id__in=apiari_ids
         ).distinct()
 
 
@@ -891,8 +894,8 @@ class ColoniaViewSet(viewsets.ModelViewSet):
         return ColoniaDetailSerializer
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
-        return Colonia.objects.filter(apiario__in=apiari_accessibili)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
+        return Colonia.objects.filter(apiario_id__in=apiari_ids)
 
     def perform_create(self, serializer):
         from rest_framework.exceptions import ValidationError as DRFValidationError
@@ -1013,17 +1016,22 @@ class FiorituraViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrGroupRole]
     filter_backends = [filters.SearchFilter]
     search_fields = ['pianta', 'apiario__nome']
+    # Conferme annotate (annota_fioriture): costo costante per pagina. Budget
+    # misurati con JWT: utente + last_login (una volta l'ora) + apiari accessibili (2);
+    # community non legge gli apiari: JWT + una query; vicine legge la versione
+    # dell'indice spaziale e, se cambiata, lo ricostruisce (core/geo.py)
+    query_budget = {'list': 6, 'retrieve': 5, 'attive': 5, 'community': 3, 'vicine': 7}
 
     def get_queryset(self):
         user = self.request.user
-        apiari_accessibili = get_apiari_accessibili(user)
+        apiari_ids = apiari_accessibili_ids(user)
         # Fioriture proprie/di gruppo + fioriture pubbliche della community
         proprie = (
-            Fioritura.objects.filter(apiario__in=apiari_accessibili) |
+            Fioritura.objects.filter(apiario_id__in=apiari_ids) |
             Fioritura.objects.filter(apiario__isnull=True, creatore=user)
         )
         pubbliche = Fioritura.objects.filter(pubblica=True)
-        return (proprie | pubbliche).distinct()
+        return annota_fioriture((proprie | pubbliche).distinct(), user)
 
     @action(detail=False, methods=['get'])
     def attive(self, request):
@@ -1041,7 +1049,7 @@ class FiorituraViewSet(viewsets.ModelViewSet):
     def community(self, request):
         """Fioriture pubbliche di tutta la community, attive."""
         oggi = timezone.now().date()
-        fioriture = Fioritura.objects.filter(pubblica=True).filter(
+        fioriture = annota_fioriture(Fioritura.objects.filter(pubblica=True), request.user).filter(
             data_inizio__lte=oggi
         ).filter(
             Q(data_fine__isnull=True) | Q(data_fine__gte=oggi)
@@ -1062,29 +1070,12 @@ class FiorituraViewSet(viewsets.ModelViewSet):
         except (ValueError, TypeError):
             return Response({'error': 'Parametri lat, lng, raggio_km non validi'}, status=400)
 
-        import math
-
-        def haversine_approx(lat1, lon1, lat2, lon2):
-            """Distanza approssimativa in km tra due coordinate."""
-            R = 6371
-            dlat = math.radians(lat2 - lat1)
-            dlon = math.radians(lon2 - lon1)
-            a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-            return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        # Filtro approssimativo con bounding box (1° lat ≈ 111 km)
-        delta_lat = raggio_km / 111.0
-        delta_lng = raggio_km / (111.0 * math.cos(math.radians(lat)))
-
-        candidati = self.get_queryset().filter(
-            latitudine__gte=lat - delta_lat,
-            latitudine__lte=lat + delta_lat,
-            longitudine__gte=lng - delta_lng,
-            longitudine__lte=lng + delta_lng,
-        )
+        from .geo import indice_fioriture
 
-        # Filtro preciso con haversine
-        vicine = [f for f in candidati if haversine_approx(lat, lng, float(f.latitudine), float(f.longitudine)) <= raggio_km]
+        # Candidati dall'indice spaziale (distanza haversine esatta), poi
+        # filtro di visibilità del queryset, che ne conserva l'ordinamento
+        ids = [pk for pk, _ in indice_fioriture().entro(lat, lng, raggio_km)]
+        vicine = self.get_queryset().filter(pk__in=ids)
         serializer = self.get_serializer(vicine, many=True)
         return Response(serializer.data)
 
@@ -1106,6 +1097,8 @@ class FiorituraViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
             serializer.save()
+            # Riletta: i conteggi annotati da get_object() sono di prima del salvataggio
+            fioritura = self.get_queryset().get(pk=fioritura.pk)
             fioritura_serializer = self.get_serializer(fioritura)
             return Response(fioritura_serializer.data)
         return Response(serializer.errors, status=400)
@@ -1143,8 +1136,8 @@ class TrattamentoSanitarioViewSet(viewsets.ModelViewSet):
         Filtra i trattamenti in base agli apiari accessibili all'utente.
         Supporta il parametro opzionale ?apiario=<id> per filtrare per apiario.
         """
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
-        qs = TrattamentoSanitario.objects.filter(apiario__in=apiari_accessibili)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
+        qs = TrattamentoSanitario.objects.filter(apiario_id__in=apiari_ids)
         apiario_id = self.request.query_params.get('apiario')
         if apiario_id:
             qs = qs.filter(apiario__id=apiario_id)
@@ -1347,13 +1340,15 @@ class MelarioViewSet(viewsets.ModelViewSet):
     """
     serializer_class = MelarioSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrGroupRole]
+    # Query per azione (core/query_budget.py), JWT e apiari accessibili compresi
+    query_budget = {'list': 6, 'retrieve': 5}
     filter_backends = [filters.SearchFilter]
     search_fields = ['colonia__apiario__nome', 'stato']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = Melario.objects.filter(
-            colonia__apiario__in=apiari_accessibili
+            colonia__apiario_id__in=apiari_ids
         ).select_related(
             'colonia', 'colonia__arnia', 'colonia__apiario', 'colonia__apiario__gruppo'
         ).distinct()
@@ -1389,9 +1384,9 @@ class SmielaturaViewSet(viewsets.ModelViewSet):
         esaurite (kg_residui ≤ 0). Default: tutte (per compat e per stats
         annuali in app).
         """
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = Smielatura.objects.filter(
-            apiario__in=apiari_accessibili
+            apiario_id__in=apiari_ids
         ).select_related('apiario', 'apiario__gruppo', 'utente')
         attive = self.request.query_params.get('attive')
         if attive in ('1', 'true', 'True'):
@@ -2034,9 +2029,9 @@ class InvasettamentoViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         from django.db.models import Q, F
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = Invasettamento.objects.filter(
-            Q(smielatura__apiario__in=apiari_accessibili) |
+            Q(smielatura__apiario_id__in=apiari_ids) |
             Q(contenitore__utente=self.request.user)
         ).select_related(
             'smielatura', 'smielatura__apiario', 'smielatura__apiario__gruppo',
@@ -2316,8 +2311,8 @@ class AnalisiTelainoViewSet(viewsets.ModelViewSet):
         Filtra le analisi in base alle arnie accessibili all'utente.
         Supporta filtro per arnia con ?arnia=<id>.
         """
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
-        arnie_accessibili = Arnia.objects.filter(apiario__in=apiari_accessibili)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
+        arnie_accessibili = Arnia.objects.filter(apiario_id__in=apiari_ids)
         queryset = AnalisiTelaino.objects.filter(arnia__in=arnie_accessibili)
 
         arnia_id = self.request.query_params.get('arnia')
@@ -2437,13 +2432,76 @@ class CustomTokenRefreshView(TokenRefreshView):
             )
 
 # Endpoint per la sincronizzazione
+def _sync_incrementale(request):
+    """Una pagina della sync incrementale (vedi core/sync.py)."""
+    from django.conf import settings
+    from . import sync
+
+    try:
+        stato = sync.leggi_cursore(request.query_params.get('cursor'))
+    except sync.CursoreNonValido as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page_size = int(request.query_params.get('page_size', settings.SYNC_PAGE_SIZE))
+    except ValueError:
+        return Response({"detail": "page_size deve essere un intero."}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = max(1, min(page_size, settings.SYNC_PAGE_SIZE_MAX))
+
+    ambito = sync.ambito_utente(request.user)
+    stato = sync.inizia_passata(stato, ambito)
+    # reset vale solo per la prima pagina della passata
+    reset, stato['reset'] = stato['reset'], False
+    payload, stato, has_more = sync.sync_pagina(ambito, stato, page_size)
+    cursore = stato if has_more else sync.cursore_successivo(stato)
+    return Response({
+        'cursor': sync.scrivi_cursore(cursore),
+        'has_more': has_more,
+        'reset': reset,
+        'timestamp': stato['until'],
+        **payload,
+    })
+
+
+def _sync_stream(request):
+    """Sync completa in streaming, a memoria costante (vedi core/sync.py)."""
+    from django.conf import settings
+    from django.http import StreamingHttpResponse
+    from . import sync
+
+    formato = request.query_params.get('stream')
+    if formato == 'ndjson':
+        generatore, content_type = sync.stream_ndjson, 'application/x-ndjson'
+    elif formato == 'json':
+        generatore, content_type = sync.stream_json, 'application/json'
+    else:
+        return Response(
+            {"detail": "stream deve essere 'ndjson' o 'json'."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    ambito = sync.ambito_utente(request.user)
+    response = StreamingHttpResponse(
+        generatore(ambito, settings.SYNC_STREAM_CHUNK_SIZE), content_type=content_type,
+    )
+    # Evita il buffering dei reverse proxy (nginx)
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def sync_data(request):
     """
     Endpoint per sincronizzare i dati dell'app mobile.
     Restituisce i dati accessibili all'utente.
+
+    Con il parametro `cursor` (vuoto alla prima chiamata) usa la sync
+    incrementale a pagine di core/sync.py; senza, il dump completo.
+    `stream=ndjson|json` invia il dump completo in streaming.
     """
+    if 'cursor' in request.query_params:
+        return _sync_incrementale(request)
+    if 'stream' in request.query_params:
+        return _sync_stream(request)
     try:
         # Timestamp ultima sincronizzazione
         last_sync = request.query_params.get('last_sync', None)
@@ -2478,10 +2536,10 @@ def sync_data(request):
             logger.error(f"Errore durante il recupero delle regine: {e}")
         
         try:
-            fioriture = (
+            fioriture = annota_fioriture((
                 Fioritura.objects.filter(apiario__in=apiari_accessibili) |
                 Fioritura.objects.filter(apiario__isnull=True, creatore=user)
-            ).distinct()
+            ).distinct())
         except Exception as e:
             fioriture = []
             logger.error(f"Errore durante il recupero delle fioriture: {e}")
@@ -3393,14 +3451,17 @@ class VarroaCheckpointViewSet(viewsets.ModelViewSet):
     """
     serializer_class = VarroaCheckpointSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Query per azione (core/query_budget.py), JWT e apiari accessibili compresi:
+    # traiettorie carica tutto in blocco
+    query_budget = {'list': 6, 'retrieve': 5, 'traiettorie': 9}
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['data_campionamento', 'percentuale_calcolata']
     ordering = ['-data_campionamento']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = VarroaCheckpoint.objects.filter(
-            colonia__apiario__in=apiari_accessibili
+            colonia__apiario_id__in=apiari_ids
         ).select_related('colonia', 'colonia__arnia', 'utente')
         colonia_id = self.request.query_params.get('colonia')
         if colonia_id:
@@ -3423,9 +3484,9 @@ class VarroaCheckpointViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'colonia_id è obbligatorio.'}, status=400)
         days_ahead = min(int(request.query_params.get('days_ahead', 60)), 180)
 
-        apiari_accessibili = get_apiari_accessibili(request.user)
+        apiari_ids = apiari_accessibili_ids(request.user)
         try:
-            colonia = Colonia.objects.get(pk=colonia_id, apiario__in=apiari_accessibili)
+            colonia = Colonia.objects.get(pk=colonia_id, apiario_id__in=apiari_ids)
         except Colonia.DoesNotExist:
             return Response({'detail': 'Colonia non trovata.'}, status=404)
 
@@ -3464,6 +3525,131 @@ class VarroaCheckpointViewSet(viewsets.ModelViewSet):
         ).data
         return Response(result)
 
+    @action(detail=False, methods=['get'], url_path='traiettorie')
+    def traiettorie(self, request):
+        """
+        Varroa trajectories for many colonies in one call (apiary overview).
+        Query params:
+          apiario_id  colonie attive dell'apiario, oppure
+          colonia_ids lista di id separati da virgola
+          days_ahead  (optional, default 60)
+        Inputs are loaded in three queries for all colonies (core.varroa_batch).
+        """
+        apiario_id = request.query_params.get('apiario_id')
+        colonia_ids = request.query_params.get('colonia_ids')
+        if not apiario_id and not colonia_ids:
+            return Response({'detail': 'apiario_id o colonia_ids è obbligatorio.'}, status=400)
+        try:
+            days_ahead = min(int(request.query_params.get('days_ahead', 60)), 180)
+            ids = [int(x) for x in colonia_ids.split(',') if x.strip()] if colonia_ids else None
+            apiario_id = int(apiario_id) if apiario_id else None
+        except ValueError:
+            return Response({'detail': 'Parametri non validi.'}, status=400)
+
+        apiari_ids = apiari_accessibili_ids(request.user)
+        colonie = Colonia.objects.filter(apiario_id__in=apiari_ids)
+        if apiario_id:
+            if apiario_id not in apiari_ids:
+                return Response({'detail': 'Apiario non trovato.'}, status=404)
+            colonie = colonie.filter(apiario_id=apiario_id)
+            if ids is None:
+                colonie = colonie.filter(stato='attiva', data_fine__isnull=True)
+        if ids is not None:
+            colonie = colonie.filter(pk__in=ids)
+        colonie = list(colonie.order_by('id'))
+
+        from django.conf import settings
+        from .varroa_batch import compute_trajectories
+        risultati, timings = compute_trajectories(
+            colonie,
+            days_ahead=days_ahead,
+            workers=settings.VARROA_BATCH_WORKERS,
+            pool=settings.VARROA_BATCH_POOL,
+        )
+
+        riepilogo = {}
+        for result in risultati.values():
+            livello = (result['allarme'] or {}).get('livello')
+            if livello:
+                riepilogo[livello] = riepilogo.get(livello, 0) + 1
+
+        return Response({
+            'apiario_id': apiario_id,
+            'days_ahead': days_ahead,
+            'n_colonie': len(colonie),
+            'riepilogo_allarmi': riepilogo,
+            'colonie': [
+                {'colonia_id': c.id, 'apiario_id': c.apiario_id, **risultati[c.id]}
+                for c in colonie
+            ],
+            'timings': timings,
+        })
+
+    @action(detail=False, methods=['post'], url_path='simula')
+    def simula(self, request):
+        """
+        What-if: compare hypothetical treatment schedules for one colony.
+        Payload (SimulazioneVarroaSerializer):
+          colonia_id, days_ahead (default 120), mantieni_trattamenti (default true),
+          scenari: [{nome, trattamenti: [{tipo_trattamento, data_inizio, blocco_covata}]}]
+        Every scenario is projected in one batch (VarroaEngine.simulate_schedules);
+        'base' is the projection with the recorded treatments only.
+        """
+        serializer = SimulazioneVarroaSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        apiari_ids = apiari_accessibili_ids(request.user)
+        try:
+            colonia = Colonia.objects.get(pk=data['colonia_id'], apiario_id__in=apiari_ids)
+        except Colonia.DoesNotExist:
+            return Response({'detail': 'Colonia non trovata.'}, status=404)
+
+        tipo_ids = {t['tipo_trattamento'] for sc in data['scenari'] for t in sc['trattamenti']}
+        tipi = TipoTrattamento.objects.in_bulk(tipo_ids)
+        mancanti = sorted(tipo_ids - set(tipi))
+        if mancanti:
+            return Response({'detail': f'Tipi di trattamento inesistenti: {mancanti}.'}, status=400)
+
+        from .varroa_batch import load_trajectory_inputs
+        from .varroa_engine import VarroaEngine
+        checkpoints, ispezioni, trattamenti = load_trajectory_inputs(
+            [colonia.id], days_ahead=data['days_ahead'],
+        )[colonia.id]
+        if not checkpoints:
+            return Response({'detail': 'La colonia non ha checkpoint Varroa.'}, status=400)
+
+        engine = VarroaEngine(
+            checkpoints=checkpoints,
+            ispezioni=ispezioni,
+            trattamenti=trattamenti if data['mantieni_trattamenti'] else [],
+            days_ahead=data['days_ahead'],
+        )
+        # Unsaved instances: the engine only reads the fields below
+        schedules = [[]] + [
+            [
+                TrattamentoSanitario(
+                    tipo_trattamento=tipi[t['tipo_trattamento']],
+                    data_inizio=t['data_inizio'],
+                    blocco_covata_attivo=t['blocco_covata'],
+                    stato='programmato',
+                )
+                for t in sc['trattamenti']
+            ]
+            for sc in data['scenari']
+        ]
+        base, *esiti = engine.simulate_schedules(schedules)
+
+        return Response({
+            'colonia_id': colonia.id,
+            'days_ahead': data['days_ahead'],
+            'base': base,
+            'scenari': [
+                {'indice': i, 'nome': sc.get('nome') or f'Scenario {i + 1}', **esito}
+                for i, (sc, esito) in enumerate(zip(data['scenari'], esiti))
+            ],
+        })
+
 
 # ── ViewSet ML: pesate / alimentazione / nomadismo ──────────────────────────
 
@@ -3476,12 +3662,12 @@ class PesataMelarioViewSet(viewsets.ModelViewSet):
     ordering = ['-data', '-id']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         # Una pesata è accessibile se il melario è su un apiario accessibile
         # (ricostruito dalla colonia attuale del melario o dalla colonia snapshot)
         qs = PesataMelario.objects.filter(
-            Q(colonia__apiario__in=apiari_accessibili) |
-            Q(melario__colonia__apiario__in=apiari_accessibili)
+            Q(colonia__apiario_id__in=apiari_ids) |
+            Q(melario__colonia__apiario_id__in=apiari_ids)
         ).select_related('melario', 'colonia', 'fioritura', 'smielatura', 'utente').distinct()
         melario_id = self.request.query_params.get('melario')
         colonia_id = self.request.query_params.get('colonia')
@@ -3510,9 +3696,9 @@ class AlimentazioneViewSet(viewsets.ModelViewSet):
     ordering = ['-data', '-id']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = Alimentazione.objects.filter(
-            colonia__apiario__in=apiari_accessibili
+            colonia__apiario_id__in=apiari_ids
         ).select_related('colonia', 'colonia__arnia', 'utente')
         colonia_id = self.request.query_params.get('colonia')
         apiario_id = self.request.query_params.get('apiario')
@@ -3535,10 +3721,10 @@ class NomadismoEventViewSet(viewsets.ModelViewSet):
     ordering = ['-data_spostamento', '-id']
 
     def get_queryset(self):
-        apiari_accessibili = get_apiari_accessibili(self.request.user)
+        apiari_ids = apiari_accessibili_ids(self.request.user)
         qs = NomadismoEvent.objects.filter(
-            Q(apiario_origine__in=apiari_accessibili) |
-            Q(apiario_destinazione__in=apiari_accessibili)
+            Q(apiario_origine_id__in=apiari_ids) |
+            Q(apiario_destinazione_id__in=apiari_ids)
         ).select_related(
             'colonia', 'apiario_origine', 'apiario_destinazione', 'utente',
         ).distinct()
@@ -3571,10 +3757,10 @@ def ml_dataset_colonia(request, colonia_id):
     L'unità di osservazione consigliata è settimana-colonia: il consumatore
     aggrega le serie su finestre di 7 giorni.
     """
-    apiari_accessibili = get_apiari_accessibili(request.user)
+    apiari_ids = apiari_accessibili_ids(request.user)
     try:
         colonia = Colonia.objects.select_related('apiario', 'arnia', 'nucleo').get(
-            pk=colonia_id, apiario__in=apiari_accessibili,
+            pk=colonia_id, apiario_id__in=apiari_ids,
         )
     except Colonia.DoesNotExist:
         return Response({'detail': 'Colonia non trovata.'}, status=404)
@@ -3594,16 +3780,51 @@ def ml_predict_colonia(request, colonia_id):
     flag dati-scarsi + i fattori che hanno determinato la stima. Vedi
     core/ml/predict.py per l'orchestrazione e core/ml/models/ per i modelli.
     """
-    apiari_accessibili = get_apiari_accessibili(request.user)
+    apiari_ids = apiari_accessibili_ids(request.user)
     try:
         colonia = Colonia.objects.select_related('apiario', 'arnia', 'nucleo').get(
-            pk=colonia_id, apiario__in=apiari_accessibili,
+            pk=colonia_id, apiario_id__in=apiari_ids,
         )
     except Colonia.DoesNotExist:
         return Response({'detail': 'Colonia non trovata.'}, status=404)
 
-    from core.ml.predict import predict_colonia
-    return Response(predict_colonia(colonia))
+    # Snapshot persistente: ricalcolo solo se i dati della colonia sono cambiati
+    # (vedi core/ml/cache.py e gli handler di invalidazione in core/signals.py).
+    from core.ml.cache import cached_predict_colonia
+    return Response(cached_predict_colonia(colonia))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def ml_predict_apiario(request, apiario_id):
+    """Predizioni per tutte le colonie attive di un apiario in una sola chiamata.
+
+    Stesso payload per-colonia di ``ml_predict_colonia``, ma dataset caricati in
+    blocco (una query per tabella, meteo/fioriture condivisi per apiario) e
+    scoring eventualmente distribuito su ``settings.ML_PREDICT_WORKERS``
+    processi. Le colonie con snapshot valido non vengono ricalcolate.
+    ``timings`` riporta la durata (ms) di ogni fase e i ``cache_hits``.
+    """
+    apiari_accessibili = get_apiari_accessibili(request.user)
+    try:
+        apiario = apiari_accessibili.get(pk=apiario_id)
+    except Apiario.DoesNotExist:
+        return Response({'detail': 'Apiario non trovato.'}, status=404)
+
+    from django.conf import settings
+    from core.ml.cache import cached_predict_colonie
+    colonie = Colonia.objects.filter(
+        apiario=apiario, stato='attiva', data_fine__isnull=True,
+    ).select_related('apiario').order_by('id')
+    risultati, timings = cached_predict_colonie(
+        colonie, workers=getattr(settings, 'ML_PREDICT_WORKERS', 0),
+    )
+    return Response({
+        'apiario_id': apiario.id,
+        'n_colonie': len(risultati),
+        'colonie': risultati,
+        'timings': timings,
+    })
 
 
 # ── Notifiche utente (centro notifiche app) ─────────────────────────────────
@@ -3625,8 +3846,7 @@ class NotificaViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='unread_count')
     def unread_count(self, request):
-        count = self.get_queryset().filter(letta=False).count()
-        return Response({'unread_count': count})
+        return Response({'unread_count': riepilogo_notifiche(request.user)['non_lette']})
 
     @action(detail=True, methods=['post'], url_path='mark_read')
     def mark_read(self, request, pk=None):
@@ -3639,4 +3859,5 @@ class NotificaViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['post'], url_path='mark_all_read')
     def mark_all_read(self, request):
         updated = self.get_queryset().filter(letta=False).update(letta=True)
+        aggiorna_contatori({request.user.pk: -updated})
         return Response({'status': 'ok', 'updated': updated})
@@ -0,0 +1,21 @@
+"""Cache di default condivisa o no tra i processi.
+
+LocMemCache (il backend in settings) vive dentro il singolo processo: una voce
+invalidata da un worker web o da ``esegui_lavori`` resta valida negli altri
+fino alla scadenza. I dati che devono seguire le modifiche fatte altrove
+(apiari accessibili, aggregati della dashboard) restano in cache tra una
+richiesta e l'altra solo con un backend condiviso (Redis, Memcached, database,
+file); altrimenti si leggono dal database.
+"""
+
+from django.conf import settings
+
+_BACKEND_LOCALI = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_condivisa():
+    """True se la cache di default è la stessa per tutti i processi."""
+    return settings.CACHES['default']['BACKEND'] not in _BACKEND_LOCALI
@@ -13,10 +13,9 @@ def notifiche_context(request):
     """Rende disponibile il conteggio notifiche non lette in tutti i template"""
     if not request.user.is_authenticated:
         return {'notifiche_non_lette': 0, 'notifiche_recenti': []}
-    from .models import Notifica
-    non_lette = Notifica.objects.filter(utente=request.user, letta=False).count()
-    recenti = Notifica.objects.filter(utente=request.user).order_by('-data_creazione')[:8]
+    from .notifications import riepilogo_notifiche
+    riepilogo = riepilogo_notifiche(request.user)
     return {
-        'notifiche_non_lette': non_lette,
-        'notifiche_recenti': recenti,
+        'notifiche_non_lette': riepilogo['non_lette'],
+        'notifiche_recenti': riepilogo['recenti'][:8],
     }
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""Aggregati della dashboard web (core.views.dashboard).
+
+Invece di una query per mese e una per arnia, :func:`aggregati_dashboard`
+calcola tutto in tre query, indipendenti dal numero di arnie:
+
+  * controlli per mese: un ``GROUP BY TruncMonth('data')`` sugli ultimi sei mesi;
+  * kg smielati per mese: idem con ``SUM(quantita_miele)``;
+  * numero di arnie e stato dall'ultimo controllo di ciascuna, con aggregati
+    condizionali sui campi denormalizzati (core/ultimo_controllo.py).
+
+Con una cache condivisa tra i processi (core/cache_condivisa.py) il risultato
+è in cache per utente. La chiave contiene gli apiari accessibili e la loro
+versione: i signal (core/signals.py) cambiano la versione di un apiario quando
+cambiano i suoi controlli (dopo aver aggiornato la fotografia dell'ultimo
+controllo), le sue smielature o le sue arnie, e le voci che lo includono
+smettono di essere lette. Chi scrive con ``.update()`` / ``bulk_create``
+chiama :func:`invalida_dashboard`. Con LocMemCache le versioni cambiate da un
+processo non arriverebbero agli altri: gli aggregati si calcolano sempre.
+
+    from core.dashboard import aggregati_dashboard
+    dati = aggregati_dashboard(request.user)
+    dati['controlli_per_mese']   # [n, ...] dal mese più vecchio all'attuale
+"""
+
+import hashlib
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .accesso import apiari_accessibili_ids
+from .cache_condivisa import cache_condivisa
+from .models import Arnia, ControlloArnia, Smielatura
+
+MESI_GRAFICI = 6
+
+
+def _chiave_versione(apiario_id):
+    return f'dashboard:apiario:{apiario_id}'
+
+
+def _versioni(apiari_ids):
+    """Versione corrente di ogni apiario; le mancanti sono create uniche."""
+    chiavi = [_chiave_versione(a) for a in apiari_ids]
+    versioni = cache.get_many(chiavi)
+    mancanti = {c: time.time_ns() for c in chiavi if c not in versioni}
+    if mancanti:
+        # Valore nuovo, non 0: dopo un'espulsione non si rileggono voci vecchie
+        cache.set_many(mancanti, None)
+        versioni.update(mancanti)
+    return [versioni[c] for c in chiavi]
+
+
+def invalida_dashboard(apiari_ids):
+    """Scarta gli aggregati in cache che includono gli apiari, al commit."""
+    chiavi = {_chiave_versione(a) for a in apiari_ids if a is not None}
+    if chiavi:
+        transaction.on_commit(lambda: cache.set_many({c: time.time_ns() for c in chiavi}, None))
+
+
+def mesi_grafici(oggi):
+    """Primo giorno di ciascuno degli ultimi MESI_GRAFICI mesi, in ordine."""
+    inizio = oggi.replace(day=1)
+    return [inizio - relativedelta(months=i) for i in range(MESI_GRAFICI - 1, -1, -1)]
+
+
+def calcola_aggregati(apiari_ids, oggi):
+    """Aggregati della dashboard per gli apiari indicati, senza cache."""
+    mesi = mesi_grafici(oggi)
+    periodo = {'data__gte': mesi[0], 'data__lt': mesi[-1] + relativedelta(months=1)}
+
+    controlli = dict(
+        ControlloArnia.objects.filter(arnia__apiario_id__in=apiari_ids, **periodo)
+        .annotate(mese=TruncMonth('data')).values('mese')
+        .annotate(n=Count('id')).values_list('mese', 'n')
+    )
+    produzione = dict(
+        Smielatura.objects.filter(apiario_id__in=apiari_ids, **periodo)
+        .annotate(mese=TruncMonth('data')).values('mese')
+        .annotate(kg=Sum('quantita_miele')).values_list('mese', 'kg')
+    )
+
+    arnie = Arnia.objects.filter(apiario_id__in=apiari_ids).aggregate(
+        n=Count('id'),
+        senza_regina=Count('id', filter=Q(ultimo_presenza_regina=False)),
+        con_problemi=Count('id', filter=Q(ultimo_problemi_sanitari=True) | Q(ultimo_sciamatura=True)),
+    )
+
+    return {
+        'num_arnie': arnie['n'],
+        'controlli_per_mese': [controlli.get(m, 0) for m in mesi],
+        'produzione_per_mese': [float(produzione.get(m) or 0) for m in mesi],
+        'arnie_senza_regina': arnie['senza_regina'],
+        'arnie_con_problemi': arnie['con_problemi'],
+    }
+
+
+def aggregati_dashboard(user, oggi=None):
+    """Aggregati della dashboard dell'utente, dalla cache se ancora validi.
+
+    Dentro una transazione o senza cache condivisa si calcolano sempre dal
+    database, come in core/accesso.py.
+    """
+    oggi = oggi or timezone.now().date()
+    apiari_ids = apiari_accessibili_ids(user)
+    if connection.in_atomic_block or not cache_condivisa():
+        return calcola_aggregati(apiari_ids, oggi)
+    impronta = hashlib.md5(repr((apiari_ids, _versioni(apiari_ids))).encode()).hexdigest()
+    chiave = f'dashboard:{user.pk}:{oggi.isoformat()}:{impronta}'
+    dati = cache.get(chiave)
+    if dati is None:
+        dati = calcola_aggregati(apiari_ids, oggi)
+        cache.set(chiave, dati, settings.DASHBOARD_CACHE_TTL)
+    return dati
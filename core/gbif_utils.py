@@ -10,6 +10,8 @@ import math
 import requests
 from django.core.cache import cache
 
+from .geo import distanze_km
+
 # ── Preset miele: specie target per nomadismo ─────────────────────────────────
 PRESET_MIELE = {
     'acacia': {
@@ -190,8 +192,20 @@ def get_specie_mellifere_vicine(lat, lng, raggio_km=5):
     except Exception:
         return []
 
+    # La ricerca GBIF è per rettangolo: si scartano gli angoli fuori dal raggio
+    occorrenze = [
+        occ for occ in data.get('results', [])
+        if occ.get('decimalLatitude') is not None and occ.get('decimalLongitude') is not None
+    ]
+    distanze = distanze_km(
+        lat, lng,
+        [occ['decimalLatitude'] for occ in occorrenze],
+        [occ['decimalLongitude'] for occ in occorrenze],
+    )
+    occorrenze = [occ for occ, d in zip(occorrenze, distanze) if d <= raggio_km]
+
     species_dict = {}
-    for occ in data.get('results', []):
+    for occ in occorrenze:
         sp_key = occ.get('speciesKey')
         sp_name = occ.get('species') or ''
         if not sp_name:
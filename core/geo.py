@@ -0,0 +1,216 @@
+"""Indice spaziale in memoria per fioriture e apiari.
+
+Le ricerche di prossimità ("entro R km", "i k più vicini") non scorrono più
+tutte le righe: i punti sono distribuiti in celle di una griglia regolare in
+gradi (lato ``GEO_GRID_KM``), e una ricerca visita solo le celle che
+intersecano il cerchio richiesto, calcolando la distanza haversine esatta sui
+soli punti di quelle celle. Le distanze sono calcolate in blocco da
+:func:`distanze_km` (NumPy; ciclo Python per pochi punti).
+
+Un indice per modello, costruito da una sola query ``(id, lat, lon)`` e tenuto
+nel processo, che lo ricostruisce alla prima lettura dopo un cambio di
+versione (o comunque dopo GEO_INDEX_TTL secondi). Con una cache condivisa tra
+i processi la versione è una chiave cambiata dai signal (core/signals.py)
+quando cambiano le coordinate; altrimenti è letta dal database a ogni uso
+(numero di righe e ultima modifica, una query aggregata), così un worker vede
+subito le fioriture create negli altri.
+
+    from core.geo import indice_fioriture
+    indice_fioriture().entro(45.07, 7.68, 10)     # [(id, km), ...] per distanza
+    indice_fioriture().piu_vicini(45.07, 7.68, 5)
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+from .cache_condivisa import cache_condivisa
+
+RAGGIO_TERRA_KM = 6371.0
+KM_PER_GRADO = 111.0
+# Metà circonferenza: oltre questa distanza ogni punto è incluso
+_MAX_KM = math.pi * RAGGIO_TERRA_KM
+
+
+# Sotto questa soglia di coppie il ciclo Python costa meno di creare gli array
+_MIN_VETTORIALE = 32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distanza in km tra due coordinate (Haversine)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return RAGGIO_TERRA_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    """Haversine su array NumPy (broadcasting)."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return RAGGIO_TERRA_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def distanze_km(lat, lon, lats, lons):
+    """Distanze da un punto a molti: lista di float nell'ordine di `lats`/`lons`."""
+    lat, lon = float(lat), float(lon)
+    if len(lats) < _MIN_VETTORIALE:
+        return [haversine_km(lat, lon, float(a), float(b)) for a, b in zip(lats, lons)]
+    return _haversine_np(
+        lat, lon, np.asarray(lats, dtype=float), np.asarray(lons, dtype=float),
+    ).tolist()
+
+
+class GridIndex:
+    """Griglia lat/lon di celle quadrate (in gradi) con liste di punti."""
+
+    def __init__(self, punti, cella_km=10.0):
+        # Lato arrotondato a un divisore di 360°: le colonne si richiudono
+        # esattamente sull'antimeridiano.
+        self.colonne = math.ceil(360 / (cella_km / KM_PER_GRADO))
+        self.cella = 360 / self.colonne
+        self.righe = math.ceil(180 / self.cella)
+        self.celle = {}
+        self.n = 0
+        for pk, lat, lon in punti:
+            if lat is None or lon is None:
+                continue
+            lat, lon = float(lat), float(lon)
+            self.celle.setdefault(self._cella(lat, lon), []).append((pk, lat, lon))
+            self.n += 1
+
+    def __len__(self):
+        return self.n
+
+    def _riga(self, lat):
+        return min(int((lat + 90) // self.cella), self.righe - 1)
+
+    def _colonna(self, lon):
+        return int((lon + 180) // self.cella) % self.colonne
+
+    def _cella(self, lat, lon):
+        return self._riga(lat), self._colonna(lon)
+
+    def _celle_candidate(self, lat, lon, raggio_km):
+        """Celle che possono contenere punti entro `raggio_km` da (lat, lon)."""
+        dlat = raggio_km / KM_PER_GRADO
+        riga_min = self._riga(max(-90.0, lat - dlat))
+        riga_max = self._riga(min(90.0, lat + dlat))
+        # La larghezza in km di un grado di longitudine cala con la latitudine:
+        # si usa la latitudine più lontana dall'equatore dentro la fascia.
+        lat_estrema = min(90.0, abs(lat) + dlat)
+        cos_lat = math.cos(math.radians(lat_estrema))
+        if cos_lat < 1e-9 or raggio_km / (KM_PER_GRADO * cos_lat) >= 180:
+            colonne = None
+            n_colonne = self.colonne
+        else:
+            dlon = raggio_km / (KM_PER_GRADO * cos_lat)
+            primo = int((lon - dlon + 180) // self.cella)
+            ultimo = int((lon + dlon + 180) // self.cella)
+            n_colonne = min(ultimo - primo + 1, self.colonne)
+            colonne = range(primo, primo + n_colonne)
+
+        # Raggio grande rispetto alla cella: meno costoso scorrere le celle
+        # occupate che tutte quelle del rettangolo.
+        if (riga_max - riga_min + 1) * n_colonne > len(self.celle):
+            for (riga, colonna), punti in self.celle.items():
+                if riga_min <= riga <= riga_max and (
+                    colonne is None or (colonna - colonne.start) % self.colonne < n_colonne
+                ):
+                    yield punti
+            return
+        colonne = range(self.colonne) if colonne is None else [c % self.colonne for c in colonne]
+        for riga in range(riga_min, riga_max + 1):
+            for colonna in colonne:
+                punti = self.celle.get((riga, colonna))
+                if punti:
+                    yield punti
+
+    def entro(self, lat, lon, raggio_km):
+        """Punti entro `raggio_km` da (lat, lon): ``[(id, km), ...]`` per distanza crescente."""
+        lat, lon = float(lat), float(lon)
+        candidati = [p for punti in self._celle_candidate(lat, lon, raggio_km) for p in punti]
+        distanze = distanze_km(lat, lon, [p[1] for p in candidati], [p[2] for p in candidati])
+        risultati = [(p[0], d) for p, d in zip(candidati, distanze) if d <= raggio_km]
+        risultati.sort(key=lambda r: r[1])
+        return risultati
+
+    def piu_vicini(self, lat, lon, k, raggio_max_km=None):
+        """I `k` punti più vicini a (lat, lon), eventualmente entro `raggio_max_km`."""
+        limite = min(raggio_max_km or _MAX_KM, _MAX_KM)
+        raggio = min(self.cella * KM_PER_GRADO, limite)
+        while True:
+            trovati = self.entro(lat, lon, raggio)
+            # Tutti i punti entro `raggio` sono stati visti: i primi k sono esatti
+            if len(trovati) >= k or raggio >= limite:
+                return trovati[:k]
+            raggio = min(raggio * 2, limite)
+
+
+# ── Indici per modello ─────────────────────────────────────────────────────
+
+_indici = {}
+_lock = threading.Lock()
+
+
+def _versione(nome, model, watermark):
+    if cache_condivisa():
+        return cache.get_or_set(f'geo:{nome}:versione', time.time_ns(), None)
+    return tuple(model.objects.aggregate(n=Count('id'), ultima=Max(watermark)).values())
+
+
+def invalida_indice(nome):
+    """Fa ricostruire l'indice `nome` ('fioriture' o 'apiari'), al commit."""
+    transaction.on_commit(lambda: cache.set(f'geo:{nome}:versione', time.time_ns(), None))
+
+
+def _indice(nome, model, watermark):
+    queryset = model.objects.filter(latitudine__isnull=False, longitudine__isnull=False)
+    if connection.in_atomic_block:
+        # Può vedere righe non committate: costruito ma non conservato
+        return GridIndex(
+            queryset.values_list('id', 'latitudine', 'longitudine'),
+            cella_km=getattr(settings, 'GEO_GRID_KM', 10.0),
+        )
+    versione = _versione(nome, model, watermark)
+    ttl = getattr(settings, 'GEO_INDEX_TTL', 300)
+    with _lock:
+        voce = _indici.get(nome)
+        if voce and voce[0] == versione and time.monotonic() - voce[1] < ttl:
+            return voce[2]
+        indice = GridIndex(
+            queryset.values_list('id', 'latitudine', 'longitudine').iterator(),
+            cella_km=getattr(settings, 'GEO_GRID_KM', 10.0),
+        )
+        _indici[nome] = (versione, time.monotonic(), indice)
+    return indice
+
+
+def indice_fioriture():
+    from .models import Fioritura
+    return _indice('fioriture', Fioritura, 'data_modifica')
+
+
+def indice_apiari():
+    from .models import Apiario
+    return _indice('apiari', Apiario, 'updated_at')
+
+
+def apiari_vicini(lat, lon, raggio_km):
+    """Apiari entro `raggio_km` da (lat, lon), con la distanza in `distanza_km`."""
+    from .models import Apiario
+    distanze = dict(indice_apiari().entro(lat, lon, raggio_km))
+    apiari = list(Apiario.objects.filter(pk__in=distanze).only('id', 'proprietario_id', 'nome'))
+    for apiario in apiari:
+        apiario.distanza_km = distanze[apiario.pk]
+    apiari.sort(key=lambda a: a.distanza_km)
+    return apiari
@@ -0,0 +1,90 @@
+"""Derivati delle immagini delle analisi telaino.
+
+L'originale caricato resta in ``AnalisiTelaino.immagine``. Accanto vengono
+salvati file più leggeri per le liste e l'app:
+
+  * ``miniatura`` (WebP) e ``miniatura_jpeg``, lato lungo ANALISI_MINIATURA_PX;
+  * ``immagine_annotata``, il JPEG con i bounding box prodotto dalla
+    detection, al posto del base64 nella risposta JSON.
+
+I nomi derivano dallo sha256 del contenuto
+(``analisi_telaini/derivati/ab/abcdef…_320.webp``): lo stesso file non
+viene scritto due volte e gli URL si possono mettere in cache per sempre.
+Le miniature sono generate dalla coda lavori (gestore ``derivati_analisi``,
+accodato dal post_save di AnalisiTelaino); finché mancano i client usano
+l'originale.
+"""
+
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .jobs import registra
+
+CARTELLA = 'analisi_telaini/derivati'
+
+
+def _nome(digest, suffisso):
+    return f'{CARTELLA}/{digest[:2]}/{digest}_{suffisso}'
+
+
+def _salva(nome, dati):
+    """Scrive `dati` in `nome` se non esiste già; ritorna il nome salvato."""
+    if default_storage.exists(nome):
+        return nome
+    return default_storage.save(nome, ContentFile(dati))
+
+
+def salva_annotata(analisi, jpeg_bytes):
+    """Memorizza l'immagine annotata della detection e ne ritorna l'URL."""
+    digest = hashlib.sha256(jpeg_bytes).hexdigest()
+    analisi.immagine_annotata.name = _salva(_nome(digest, 'annotata.jpg'), jpeg_bytes)
+    return analisi.immagine_annotata.url
+
+
+def genera_miniature(analisi):
+    """Genera (se l'originale è cambiato) le miniature WebP e JPEG.
+
+    Ritorna True se i campi sono stati aggiornati. Non salva il model.
+    """
+    from PIL import Image, ImageOps
+
+    if not analisi.immagine:
+        return False
+    with analisi.immagine.open('rb') as f:
+        originale = f.read()
+    digest = hashlib.sha256(originale).hexdigest()
+    if digest == analisi.hash_immagine and analisi.miniatura and analisi.miniatura_jpeg:
+        return False
+
+    lato = settings.ANALISI_MINIATURA_PX
+    img = ImageOps.exif_transpose(Image.open(BytesIO(originale))).convert('RGB')
+    img.thumbnail((lato, lato), Image.LANCZOS)
+
+    webp = BytesIO()
+    img.save(webp, format='WEBP', quality=80, method=4)
+    jpeg = BytesIO()
+    img.save(jpeg, format='JPEG', quality=80, optimize=True, progressive=True)
+
+    analisi.miniatura.name = _salva(_nome(digest, f'{lato}.webp'), webp.getvalue())
+    analisi.miniatura_jpeg.name = _salva(_nome(digest, f'{lato}.jpg'), jpeg.getvalue())
+    analisi.hash_immagine = digest
+    return True
+
+
+@registra('derivati_analisi', concorrenza=2, max_tentativi=3)
+def derivati_analisi(analisi_id):
+    """Gestore della coda lavori: miniature di un'AnalisiTelaino."""
+    from .models import AnalisiTelaino
+
+    analisi = AnalisiTelaino.objects.filter(pk=analisi_id).first()
+    if analisi is not None and genera_miniature(analisi):
+        # .update(): nessun nuovo post_save (e quindi nessun nuovo lavoro)
+        AnalisiTelaino.objects.filter(pk=analisi.pk).update(
+            miniatura=analisi.miniatura.name,
+            miniatura_jpeg=analisi.miniatura_jpeg.name,
+            hash_immagine=analisi.hash_immagine,
+        )
@@ -0,0 +1,299 @@
+"""Coda di lavori in background su database.
+
+Gli effetti collaterali lenti non girano più nella richiesta né in thread
+daemon non gestiti: si accodano come righe :class:`~core.models.LavoroInCoda`
+(nella stessa transazione dei dati, quindi partono solo se questa committa) e
+li esegue il worker ``python manage.py esegui_lavori``.
+
+Un gestore si registra con un nome::
+
+    @registra('meteo_backfill', concorrenza=2, max_tentativi=4)
+    def backfill_meteo(apiario_id, days):
+        ...
+
+    accoda('meteo_backfill', chiave=f'meteo_backfill:{apiario.pk}',
+           apiario_id=apiario.pk, days=30)
+
+  * tentativi: un'eccezione del gestore rimette il lavoro in attesa dopo
+    JOB_BACKOFF_SECONDI * 2^(tentativo-1) secondi (al massimo
+    JOB_BACKOFF_MAX_SECONDI), fino a ``max_tentativi``; poi è ``fallito``;
+  * concorrenza: al più ``concorrenza`` lavori dello stesso tipo in corso
+    contemporaneamente, su tutti i worker;
+  * lavori ``in_corso`` da più di JOB_TIMEOUT_SECONDI (worker morto o
+    riciclato) contano come tentativo fallito e tornano in coda;
+  * con JOB_ESECUZIONE_IMMEDIATA (sviluppo, deploy senza worker sempre
+    attivo) il lavoro è comunque accodato, e al commit un thread daemon del
+    processo che lo accoda lo preleva ed esegue subito, fuori dalla
+    richiesta. Se fallisce resta in coda con il suo backoff: i tentativi
+    successivi li esegue ``esegui_lavori`` (anche da cron con --una-volta);
+  * un errore del worker stesso (database irraggiungibile, ...) non ne ferma
+    i thread: è registrato e il ciclo riprende dopo un'attesa crescente.
+
+Il prelievo è una UPDATE condizionata sullo stato: due worker non possono
+prendere lo stesso lavoro, senza bisogno di ``SELECT ... FOR UPDATE``.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+# Attesa massima di un thread del worker dopo errori ripetuti, in secondi
+_ATTESA_MAX_ERRORE = 60
+# Errori di fila dopo cui un worker --una-volta (cron) rinuncia
+_ERRORI_MAX_UNA_VOLTA = 3
+
+
+@dataclass(frozen=True)
+class Gestore:
+    nome: str
+    funzione: object
+    concorrenza: int = None
+    max_tentativi: int = 5
+
+
+_gestori = {}
+
+
+def registra(nome, concorrenza=None, max_tentativi=5):
+    """Decoratore: registra la funzione come gestore dei lavori `nome`."""
+    def decoratore(funzione):
+        _gestori[nome] = Gestore(nome, funzione, concorrenza, max_tentativi)
+        return funzione
+    return decoratore
+
+
+def accoda(nome, chiave='', ritardo=0, **argomenti):
+    """Accoda un lavoro `nome` con gli argomenti (serializzabili JSON).
+
+    Se esiste già un lavoro pendente con la stessa `chiave` non ne crea un
+    altro e restituisce quello. `ritardo` in secondi.
+    """
+    from .models import LavoroInCoda
+
+    gestore = _gestori[nome]
+    if chiave:
+        esistente = LavoroInCoda.objects.filter(
+            chiave=chiave, stato__in=('in_attesa', 'in_corso'),
+        ).first()
+        if esistente is not None:
+            return esistente
+    lavoro = LavoroInCoda.objects.create(
+        tipo=nome,
+        argomenti=argomenti,
+        chiave=chiave,
+        max_tentativi=gestore.max_tentativi,
+        esegui_dopo=timezone.now() + timedelta(seconds=ritardo),
+    )
+    if settings.JOB_ESECUZIONE_IMMEDIATA and not ritardo:
+        transaction.on_commit(lambda: threading.Thread(
+            target=_thread_immediato, args=(lavoro.pk,),
+            name=f'lavoro-{lavoro.pk}', daemon=True,
+        ).start())
+    return lavoro
+
+
+def esegui_subito(lavoro_id, worker=WORKER_ID):
+    """Preleva ed esegue il lavoro indicato, se è in attesa ed eseguibile
+    (nessun worker l'ha preso nel frattempo, altrimenti None). Come
+    :func:`esegui`, False se fallisce."""
+    from .models import LavoroInCoda
+
+    presi = LavoroInCoda.objects.filter(
+        pk=lavoro_id, stato='in_attesa', esegui_dopo__lte=timezone.now(),
+    ).update(
+        stato='in_corso', worker=worker, data_inizio=timezone.now(), tentativi=F('tentativi') + 1,
+    )
+    if not presi:
+        return None
+    return esegui(LavoroInCoda.objects.get(pk=lavoro_id))
+
+
+def _thread_immediato(lavoro_id):
+    try:
+        esegui_subito(lavoro_id, worker=f'{WORKER_ID}/immediato')
+    except Exception:
+        logger.exception("Lavoro #%s: esecuzione immediata non riuscita, resta in coda", lavoro_id)
+    finally:
+        connection.close()
+
+
+def _backoff(tentativi):
+    secondi = settings.JOB_BACKOFF_SECONDI * 2 ** max(tentativi - 1, 0)
+    return timedelta(seconds=min(secondi, settings.JOB_BACKOFF_MAX_SECONDI))
+
+
+def _tipi_saturi():
+    """Tipi che hanno già raggiunto il limite di lavori in corso."""
+    from .models import LavoroInCoda
+
+    limitati = {g.nome: g.concorrenza for g in _gestori.values() if g.concorrenza}
+    if not limitati:
+        return []
+    in_corso = (
+        LavoroInCoda.objects.filter(stato='in_corso', tipo__in=list(limitati))
+        .values('tipo').annotate(n=Count('id'))
+    )
+    return [r['tipo'] for r in in_corso if r['n'] >= limitati[r['tipo']]]
+
+
+def preleva(tipi=None, worker=WORKER_ID):
+    """Prende in carico il prossimo lavoro eseguibile, o None."""
+    from .models import LavoroInCoda
+
+    candidati = LavoroInCoda.objects.filter(
+        stato='in_attesa', esegui_dopo__lte=timezone.now(), tipo__in=tipi or list(_gestori),
+    ).exclude(tipo__in=_tipi_saturi()).order_by('esegui_dopo', 'id')
+    for pk in candidati.values_list('id', flat=True)[:10]:
+        adesso = timezone.now()
+        presi = LavoroInCoda.objects.filter(pk=pk, stato='in_attesa').update(
+            stato='in_corso', worker=worker, data_inizio=adesso, tentativi=F('tentativi') + 1,
+        )
+        if not presi:
+            continue
+        lavoro = LavoroInCoda.objects.get(pk=pk)
+        gestore = _gestori.get(lavoro.tipo)
+        if gestore and gestore.concorrenza and LavoroInCoda.objects.filter(
+            tipo=lavoro.tipo, stato='in_corso',
+        ).count() > gestore.concorrenza:
+            # Un altro worker l'ha saturato nel frattempo: si restituisce
+            LavoroInCoda.objects.filter(pk=pk).update(
+                stato='in_attesa', worker='', data_inizio=None, tentativi=F('tentativi') - 1,
+            )
+            continue
+        return lavoro
+    return None
+
+
+def esegui(lavoro):
+    """Esegue un lavoro già prelevato e ne registra l'esito."""
+    from .models import LavoroInCoda
+
+    gestore = _gestori.get(lavoro.tipo)
+    try:
+        if gestore is None:
+            raise LookupError(f'Nessun gestore registrato per {lavoro.tipo!r}')
+        gestore.funzione(**lavoro.argomenti)
+    except Exception:
+        errore = traceback.format_exc(limit=5)
+        if lavoro.tentativi < lavoro.max_tentativi and gestore is not None:
+            aggiornamento = {'stato': 'in_attesa', 'esegui_dopo': timezone.now() + _backoff(lavoro.tentativi)}
+        else:
+            aggiornamento = {'stato': 'fallito', 'data_fine': timezone.now()}
+        logger.warning("Lavoro %s #%s fallito (tentativo %s/%s)",
+                       lavoro.tipo, lavoro.pk, lavoro.tentativi, lavoro.max_tentativi)
+        LavoroInCoda.objects.filter(pk=lavoro.pk).update(errore=errore, **aggiornamento)
+        return False
+    LavoroInCoda.objects.filter(pk=lavoro.pk).update(stato='completato', data_fine=timezone.now(), errore='')
+    return True
+
+
+def esegui_prossimo(tipi=None, worker=WORKER_ID):
+    """Preleva ed esegue un lavoro. False se la coda non ne ha di pronti."""
+    lavoro = preleva(tipi, worker)
+    if lavoro is None:
+        return False
+    esegui(lavoro)
+    return True
+
+
+def recupera_bloccati():
+    """Rimette in coda (o chiude come falliti) i lavori rimasti in corso oltre
+    JOB_TIMEOUT_SECONDI: il worker che li aveva presi non c'è più."""
+    from .models import LavoroInCoda
+
+    limite = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDI)
+    n = 0
+    for lavoro in LavoroInCoda.objects.filter(stato='in_corso', data_inizio__lt=limite):
+        if lavoro.tentativi < lavoro.max_tentativi:
+            aggiornamento = {'stato': 'in_attesa', 'esegui_dopo': timezone.now() + _backoff(lavoro.tentativi)}
+        else:
+            aggiornamento = {'stato': 'fallito', 'data_fine': timezone.now()}
+        n += LavoroInCoda.objects.filter(pk=lavoro.pk, stato='in_corso').update(
+            errore=f'Timeout: worker {lavoro.worker} non ha completato il lavoro', **aggiornamento,
+        )
+    return n
+
+
+def pulisci_completati(giorni):
+    """Elimina i lavori completati da più di `giorni` giorni."""
+    from .models import LavoroInCoda
+
+    limite = timezone.now() - timedelta(days=giorni)
+    eliminati, _ = LavoroInCoda.objects.filter(stato='completato', data_fine__lt=limite).delete()
+    return eliminati
+
+
+class Worker:
+    """`concorrenza` thread che eseguono lavori finché `ferma()` o, con
+    `una_volta`, finché la coda non ha più lavori pronti."""
+
+    def __init__(self, concorrenza=2, tipi=None, attesa=2.0, una_volta=False):
+        self.concorrenza = concorrenza
+        self.tipi = tipi
+        self.attesa = attesa
+        self.una_volta = una_volta
+        self.eseguiti = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ferma(self):
+        self._stop.set()
+
+    def _ciclo(self, indice):
+        worker = f'{WORKER_ID}/{indice}'
+        errori = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    eseguito = esegui_prossimo(self.tipi, worker)
+                except Exception:
+                    errori += 1
+                    logger.exception("Worker %s: errore nel prelievo/esecuzione (%s di fila)", worker, errori)
+                    # La connessione potrebbe essere rotta: se ne apre una nuova
+                    connection.close()
+                    if self.una_volta and errori >= _ERRORI_MAX_UNA_VOLTA:
+                        return
+                    self._stop.wait(min(self.attesa * 2 ** errori, _ATTESA_MAX_ERRORE))
+                    continue
+                errori = 0
+                if eseguito:
+                    with self._lock:
+                        self.eseguiti += 1
+                    continue
+                if self.una_volta:
+                    return
+                self._stop.wait(self.attesa)
+        finally:
+            connection.close()
+
+    def avvia(self):
+        """Blocca fino alla fine; restituisce il numero di lavori eseguiti."""
+        recupera_bloccati()
+        threads = [
+            threading.Thread(target=self._ciclo, args=(i,), name=f'esegui_lavori-{i}', daemon=True)
+            for i in range(self.concorrenza)
+        ]
+        for t in threads:
+            t.start()
+        intervallo = settings.JOB_TIMEOUT_SECONDI / 4
+        prossimo_recupero = time.monotonic() + intervallo
+        while any(t.is_alive() for t in threads):
+            self._stop.wait(1.0)
+            if time.monotonic() >= prossimo_recupero:
+                recupera_bloccati()
+                prossimo_recupero = time.monotonic() + intervallo
+        return self.eseguiti
@@ -7,9 +7,14 @@ I giorni più vecchi vengono letti da Open-Meteo Archive (ERA5), gli ultimi
 2-5 da Forecast. Nei run successivi le righe `forecast` vengono sovrascritte
 dalle versioni `archive`, quindi nel tempo il dataset converge a ERA5.
 
+I download girano in parallelo (--workers, default METEO_FETCH_WORKERS)
+sotto il rate limit condiviso OPEN_METEO_MAX_RPS; ogni apiario viene
+scritto con un solo upsert.
+
 Eseguire su PythonAnywhere come scheduled task quotidiana (ore 04:00 UTC
 suggerito):
   python manage.py aggiorna_meteo_giornaliero
+  python manage.py aggiorna_meteo_giornaliero --days 14 --workers 16
 """
 
 from datetime import date, timedelta
@@ -17,7 +22,7 @@ from datetime import date, timedelta
 from django.core.management.base import BaseCommand
 
 from core.models import Apiario
-from core.meteo_archive_utils import aggiorna_meteo_apiario
+from core.meteo_archive_utils import aggiorna_meteo_apiari
 
 
 class Command(BaseCommand):
@@ -26,6 +31,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--days', type=int, default=7,
                             help='Numero di giorni indietro da aggiornare (default: 7).')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Download paralleli (default: settings.METEO_FETCH_WORKERS).')
 
     def handle(self, *args, **options):
         days = max(1, int(options['days']))
@@ -39,16 +46,19 @@ class Command(BaseCommand):
             monitoraggio_meteo=True,
         )
 
+        apiari = {a.pk: a for a in qs}
+        risultati = aggiorna_meteo_apiari(
+            [(a, start, end) for a in apiari.values()], workers=options['workers'],
+        )
+
         total_archive = 0
         total_forecast = 0
         processati = 0
 
-        for apiario in qs:
-            try:
-                result = aggiorna_meteo_apiario(apiario, start, end)
-            except Exception as e:
+        for apiario_id, result in risultati.items():
+            if 'errore' in result:
                 self.stderr.write(self.style.ERROR(
-                    f"Apiario {apiario.id} ({apiario.nome}): errore {e}"
+                    f"Apiario {apiario_id} ({apiari[apiario_id].nome}): errore {result['errore']}"
                 ))
                 continue
             total_archive += result['archive']
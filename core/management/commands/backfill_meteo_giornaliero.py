@@ -9,6 +9,9 @@ Per ogni apiario con coordinate e monitoraggio_meteo abilitato:
   - usa Open-Meteo Forecast per coprire gli ultimi 2-5 giorni che ERA5 non
     indicizza ancora
 
+I download girano in parallelo (--workers) sotto il rate limit condiviso;
+le scritture sono un upsert per apiario.
+
 Idempotente: si può rilanciare a piacere; le righe `archive` esistenti non
 vengono toccate.
 
@@ -16,6 +19,7 @@ Uso:
   python manage.py backfill_meteo_giornaliero
   python manage.py backfill_meteo_giornaliero --apiario-id 12
   python manage.py backfill_meteo_giornaliero --max-days 365
+  python manage.py backfill_meteo_giornaliero --workers 16
 """
 
 from datetime import date, timedelta
@@ -23,7 +27,7 @@ from datetime import date, timedelta
 from django.core.management.base import BaseCommand
 
 from core.models import Apiario
-from core.meteo_archive_utils import aggiorna_meteo_apiario
+from core.meteo_archive_utils import aggiorna_meteo_apiari
 
 
 class Command(BaseCommand):
@@ -34,6 +38,8 @@ class Command(BaseCommand):
                             help='Limita il backfill a un singolo apiario.')
         parser.add_argument('--max-days', type=int, default=None,
                             help='Limita il backfill agli ultimi N giorni (default: tutto).')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Download paralleli (default: settings.METEO_FETCH_WORKERS).')
 
     def handle(self, *args, **options):
         qs = Apiario.objects.filter(
@@ -48,26 +54,31 @@ class Command(BaseCommand):
         ieri = oggi - timedelta(days=1)
         max_days = options.get('max_days')
 
-        total_archive = 0
-        total_forecast = 0
-        processati = 0
-
+        apiari = {}
+        richieste = []
         for apiario in qs:
             start = apiario.data_creazione.date() if apiario.data_creazione else (ieri - timedelta(days=365))
             if max_days:
                 start = max(start, oggi - timedelta(days=max_days))
             if start > ieri:
                 continue
-
             self.stdout.write(f"Backfill apiario {apiario.id} ({apiario.nome}): {start} -> {ieri}")
-            try:
-                result = aggiorna_meteo_apiario(apiario, start, ieri)
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"  errore: {e}"))
-                continue
+            apiari[apiario.id] = apiario
+            richieste.append((apiario, start, ieri))
 
+        risultati = aggiorna_meteo_apiari(richieste, workers=options['workers'])
+
+        total_archive = 0
+        total_forecast = 0
+        processati = 0
+
+        for apiario_id, result in risultati.items():
+            if 'errore' in result:
+                self.stderr.write(self.style.ERROR(f"Apiario {apiario_id}: errore {result['errore']}"))
+                continue
             self.stdout.write(self.style.SUCCESS(
-                f"  archive={result['archive']} forecast={result['forecast']}"
+                f"Apiario {apiario_id} ({apiari[apiario_id].nome}): "
+                f"archive={result['archive']} forecast={result['forecast']}"
             ))
             total_archive += result['archive']
             total_forecast += result['forecast']
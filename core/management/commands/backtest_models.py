@@ -15,7 +15,7 @@ layer exists.
 from django.core.management.base import BaseCommand
 
 from core.models import Colonia
-from core.ml.dataset import build_colonia_dataset
+from core.ml.dataset import build_colonia_datasets
 from core.ml.features import (
     colony_feature_frame, attach_swarm_labels, wintering_label, AUTUMN_MONTHS,
 )
@@ -41,7 +41,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         target = options['target']
         colonie = list(Colonia.objects.all().select_related('apiario'))
-        datasets = [(c, build_colonia_dataset(c)) for c in colonie]
+        by_id = build_colonia_datasets(colonie)
+        datasets = [(c, by_id[c.id]) for c in colonie]
 
         if target in ('swarm', 'all'):
             self._run_swarm(datasets, options['horizon_days'], options['alarm_score'])
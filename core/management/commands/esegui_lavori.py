@@ -0,0 +1,53 @@
+"""Worker della coda lavori su database (core/jobs.py).
+
+Esegue i lavori accodati (fan-out broadcast, backfill meteo, notifiche
+fioritura, ...) con al più --concorrenza lavori in parallelo, ritentando con
+backoff quelli falliti. Si ferma in modo pulito su SIGTERM/SIGINT, finendo i
+lavori in corso. All'avvio elimina i lavori completati più vecchi di
+JOB_RETENTION_DAYS.
+
+Come processo sempre attivo (always-on task su PythonAnywhere, systemd, ...):
+  python manage.py esegui_lavori
+  python manage.py esegui_lavori --concorrenza 4 --tipo broadcast_fanout
+
+Oppure da cron, svuotando la coda ed uscendo:
+  python manage.py esegui_lavori --una-volta
+"""
+
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import Worker, pulisci_completati
+
+
+class Command(BaseCommand):
+    help = 'Esegue i lavori in background accodati nel database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concorrenza', type=int, default=settings.JOB_CONCORRENZA,
+                            help='Lavori eseguiti in parallelo (default: settings.JOB_CONCORRENZA).')
+        parser.add_argument('--tipo', action='append', default=None,
+                            help='Esegue solo i lavori di questo tipo (ripetibile).')
+        parser.add_argument('--attesa', type=float, default=2.0,
+                            help='Secondi di attesa quando la coda è vuota (default: 2).')
+        parser.add_argument('--una-volta', action='store_true',
+                            help='Esce quando non ci sono più lavori pronti.')
+
+    def handle(self, *args, **options):
+        eliminati = pulisci_completati(settings.JOB_RETENTION_DAYS)
+        if eliminati:
+            self.stdout.write(f'Eliminati {eliminati} lavori completati')
+
+        worker = Worker(
+            concorrenza=max(1, options['concorrenza']),
+            tipi=options['tipo'],
+            attesa=options['attesa'],
+            una_volta=options['una_volta'],
+        )
+        for segnale in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(segnale, lambda *_: worker.ferma())
+
+        eseguiti = worker.avvia()
+        self.stdout.write(self.style.SUCCESS(f'Eseguiti {eseguiti} lavori'))
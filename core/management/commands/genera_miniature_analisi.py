@@ -0,0 +1,45 @@
+"""Genera le miniature mancanti delle analisi telaino (core/immagini.py).
+
+Le analisi nuove le ricevono dalla coda lavori; questo comando serve per
+quelle caricate prima, o per rigenerarle dopo un cambio di
+ANALISI_MINIATURA_PX.
+
+    python manage.py genera_miniature_analisi
+    python manage.py genera_miniature_analisi --tutte --accoda
+"""
+
+from django.core.management.base import BaseCommand
+
+from core.immagini import derivati_analisi
+from core.jobs import accoda
+from core.models import AnalisiTelaino
+
+
+class Command(BaseCommand):
+    help = 'Genera le miniature WebP/JPEG delle analisi telaino che non le hanno.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tutte', action='store_true',
+                            help='Ricontrolla anche le analisi che hanno già le miniature.')
+        parser.add_argument('--accoda', action='store_true',
+                            help='Accoda i lavori per il worker invece di eseguirli subito.')
+
+    def handle(self, *args, **options):
+        qs = AnalisiTelaino.objects.exclude(immagine='').exclude(immagine__isnull=True)
+        if not options['tutte']:
+            qs = qs.filter(miniatura='') | qs.filter(miniatura__isnull=True)
+        ids = list(qs.values_list('id', flat=True))
+
+        errori = 0
+        for analisi_id in ids:
+            if options['accoda']:
+                accoda('derivati_analisi', chiave=f'derivati_analisi:{analisi_id}', analisi_id=analisi_id)
+                continue
+            try:
+                derivati_analisi(analisi_id)
+            except Exception as e:
+                errori += 1
+                self.stderr.write(self.style.ERROR(f'Analisi {analisi_id}: {e}'))
+
+        azione = 'accodate' if options['accoda'] else 'elaborate'
+        self.stdout.write(self.style.SUCCESS(f'{len(ids) - errori} analisi {azione}, {errori} errori'))
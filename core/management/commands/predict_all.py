@@ -0,0 +1,62 @@
+"""Scoring batch dei modelli predittivi per tutte le colonie attive.
+
+Carica i dataset in blocco (una query per tabella per ogni blocco di colonie,
+meteo/fioriture condivisi per apiario) e calcola rischio sciamatura, rischio
+invernamento e produzione attesa per ogni colonia, opzionalmente su un pool di
+processi. Alla fine stampa i tempi di ogni fase.
+
+    python manage.py predict_all
+    python manage.py predict_all --apiario-id 3 --apiario-id 7
+    python manage.py predict_all --workers 4 --json
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.models import Colonia
+from core.ml.predict import predict_colonie
+
+
+class Command(BaseCommand):
+    help = 'Calcola le predizioni ML per tutte le colonie attive di uno o più apiari.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apiario-id', type=int, action='append', default=None,
+                            dest='apiario_ids',
+                            help='Limita lo scoring a questo apiario (ripetibile).')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Processi per lo scoring (default: 0 = in-process).')
+        parser.add_argument('--json', action='store_true',
+                            help='Stampa le predizioni complete in JSON invece del riepilogo.')
+
+    def handle(self, *args, **options):
+        qs = Colonia.objects.filter(
+            stato='attiva', data_fine__isnull=True,
+        ).select_related('apiario').order_by('apiario_id', 'id')
+        if options['apiario_ids']:
+            qs = qs.filter(apiario_id__in=options['apiario_ids'])
+
+        risultati, timings = predict_colonie(qs, workers=options['workers'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(
+                {'colonie': risultati, 'timings': timings}, default=str, indent=2,
+            ))
+            return
+
+        for r in risultati:
+            p = r['predictions']
+            kg = p['honey_production'].get('expected_kg')
+            self.stdout.write(
+                f"Apiario {r['apiario_id']} · colonia {r['colonia_id']}: "
+                f"sciamatura {p['swarm_risk']['level'] or 'n/d'}, "
+                f"invernamento {p['wintering_risk']['level'] or 'n/d'}, "
+                f"produzione {f'{kg} kg' if kg is not None else 'n/d'}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Predizioni calcolate per {len(risultati)} colonie "
+            f"(workers={timings['workers']}): dataset {timings['dataset_ms']} ms, "
+            f"scoring {timings['predict_ms']} ms, totale {timings['total_ms']} ms."
+        ))
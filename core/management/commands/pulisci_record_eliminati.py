@@ -0,0 +1,37 @@
+"""Rimuove i tombstone della sync incrementale più vecchi della ritenzione.
+
+Un client che torna con un cursore più vecchio di SYNC_TOMBSTONE_DAYS riceve
+``reset: true`` e riparte da una sync completa, quindi questi record non
+servono più. Da schedulare nel cron quotidiano.
+
+    python manage.py pulisci_record_eliminati
+    python manage.py pulisci_record_eliminati --days 30
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import RecordEliminato
+
+
+class Command(BaseCommand):
+    help = 'Elimina i tombstone della sync incrementale più vecchi della ritenzione.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.SYNC_TOMBSTONE_DAYS,
+            help='Giorni di conservazione dei tombstone (default da settings)',
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        limite = timezone.now() - timedelta(days=days)
+        eliminati, _ = RecordEliminato.objects.filter(data_eliminazione__lt=limite).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Eliminati {eliminati} tombstone più vecchi di {days} giorni'
+        ))
@@ -0,0 +1,25 @@
+"""Ricalcola l'ultimo controllo denormalizzato di arnie e colonie
+(core/ultimo_controllo.py).
+
+I signal lo tengono aggiornato; il comando serve dopo import massivi o
+scritture che non passano da save()/delete(), e per verificarlo.
+
+    python manage.py ricalcola_ultimo_controllo
+    python manage.py ricalcola_ultimo_controllo --blocco 1000
+"""
+
+from django.core.management.base import BaseCommand
+
+from core.ultimo_controllo import ricalcola_tutti
+
+
+class Command(BaseCommand):
+    help = "Ricalcola l'ultimo controllo denormalizzato di tutte le arnie e colonie."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocco', type=int, default=500,
+                            help='Righe aggiornate per transazione (default 500).')
+
+    def handle(self, *args, **options):
+        arnie, colonie = ricalcola_tutti(blocco=options['blocco'])
+        self.stdout.write(self.style.SUCCESS(f'{arnie} arnie e {colonie} colonie aggiornate'))
@@ -16,19 +16,40 @@ data_creazione e ieri, prendendo i giorni "vecchi" dall'Archive e gli
 ultimi giorni dal Forecast (etichettati `source='forecast'`). Al run
 successivo, quegli stessi giorni vengono richiesti di nuovo all'Archive
 e sovrascritti come `source='archive'`.
+
+Per molti apiari (cron, backfill) `aggiorna_meteo_apiari` scarica in
+parallelo su un pool di thread, sotto un token bucket condiviso, e scrive
+le righe di ogni apiario con un solo `bulk_create` (upsert) dal thread
+chiamante.
+
+Per l'Archive le coordinate vengono agganciate a celle di griglia
+(METEO_GRID_DEG, 0.25° ≈ risoluzione ERA5, più fine non cambia il dato):
+apiari vicini cadono nella stessa cella, che viene scaricata una volta sola
+e distribuita a tutti i suoi apiari. Il Forecast ha una risoluzione più
+fine e usa le coordinate esatte di ogni apiario. Le coordinate
+viaggiano a lotti nella stessa richiesta (Open-Meteo accetta liste di
+latitudini/longitudini separate da virgola e risponde con un blocco per
+località). Un lotto rifiutato per dimensione o per una coordinata (HTTP
+400/413/414, risposta illeggibile) si riprova diviso a metà; 429 e 5xx si
+ritentano con backoff e, se persistono, il lotto fallisce. Le celle che non
+si riescono a scaricare finiscono come errore nei risultati dell'apiario.
 """
 
 from __future__ import annotations
 
 import logging
+import math
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
-from typing import Iterable
+from typing import Iterable, Union
 
 import requests
-from django.core.cache import cache
-from django.db import transaction
+from django.conf import settings
+from django.db import connection, transaction
 
 from .models import Apiario, MeteoGiornaliero
 
@@ -58,22 +79,106 @@ DAILY_VARS = [
     'weather_code',
 ]
 
-# Open-Meteo: 10k chiamate/giorno gratuito; teniamo un piccolo throttle.
-_RATE_LIMIT_KEY = 'open_meteo_throttle'
-_MIN_INTERVAL_SECONDS = 0.2
+# Open-Meteo: 10k chiamate/giorno gratuito. Rate limit condiviso tra tutti i
+# thread del processo (token bucket): in media OPEN_METEO_MAX_RPS richieste/s,
+# con raffiche fino a _BURST richieste.
+_BURST = 5
+
+
+class _TokenBucket:
+    """Token bucket thread-safe: `rate` token/s, capacità `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocca finché non c'è un token disponibile, poi lo consuma."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = _TokenBucket(getattr(settings, 'OPEN_METEO_MAX_RPS', 5), _BURST)
 
 
 def _throttle() -> None:
-    last = cache.get(_RATE_LIMIT_KEY)
-    now = time.monotonic()
-    if last is not None:
-        delta = now - last
-        if delta < _MIN_INTERVAL_SECONDS:
-            time.sleep(_MIN_INTERVAL_SECONDS - delta)
-    cache.set(_RATE_LIMIT_KEY, time.monotonic(), 60)
+    _rate_limiter.acquire()
+
+
+class MeteoFetchError(Exception):
+    """Open-Meteo non ha restituito dati validi per una richiesta.
+
+    `lotto` è vero se l'errore dipende dal contenuto della richiesta
+    (troppe coordinate, una coordinata rifiutata): dividerla può servire.
+    """
+
+    def __init__(self, messaggio: str, lotto: bool = False):
+        super().__init__(messaggio)
+        self.lotto = lotto
+
 
+# Richiesta troppo grande o coordinata rifiutata: si divide il lotto
+_STATI_LOTTO = {400, 413, 414}
+# Limite di frequenza o errore transitorio: si ritenta con backoff
+_STATI_RITENTA = {429, 500, 502, 503, 504}
+_BACKOFF_MAX_S = 60
 
-def _http_get(url: str, params: dict, timeout: int = 30) -> dict | None:
+
+def _attesa_backoff(tentativo: int, retry_after: str | None) -> float:
+    """Secondi da attendere: Retry-After se presente, altrimenti esponenziale."""
+    try:
+        attesa = float(retry_after)
+    except (TypeError, ValueError):
+        attesa = getattr(settings, 'METEO_HTTP_BACKOFF', 2.0) * 2 ** tentativo
+    return min(max(attesa, 0.0), _BACKOFF_MAX_S)
+
+
+def _http_get_lotto(url: str, params: dict, timeout: int = 30) -> dict | list:
+    """GET per un lotto multi-località; solleva MeteoFetchError se fallisce.
+
+    429, 5xx ed errori di rete vengono ritentati con backoff fino a
+    settings.METEO_HTTP_RETRIES tentativi.
+    """
+    tentativi = max(1, getattr(settings, 'METEO_HTTP_RETRIES', 3))
+    for tentativo in range(tentativi):
+        _throttle()
+        retry_after = None
+        try:
+            r = requests.get(url, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            errore = MeteoFetchError(f"Open-Meteo request error: {e}")
+        else:
+            if r.status_code == 200:
+                try:
+                    return r.json()
+                except ValueError as e:
+                    raise MeteoFetchError(f"Open-Meteo JSON error: {e}", lotto=True)
+            errore = MeteoFetchError(
+                f"Open-Meteo HTTP {r.status_code}: {r.text[:200]}",
+                lotto=r.status_code in _STATI_LOTTO,
+            )
+            if r.status_code not in _STATI_RITENTA:
+                raise errore
+            retry_after = r.headers.get('Retry-After')
+        if tentativo + 1 < tentativi:
+            attesa = _attesa_backoff(tentativo, retry_after)
+            logger.warning("%s: nuovo tentativo tra %.1fs", errore, attesa)
+            time.sleep(attesa)
+    raise errore
+
+
+def _http_get(url: str, params: dict, timeout: int = 30) -> dict | list | None:
     _throttle()
     try:
         r = requests.get(url, params=params, timeout=timeout)
@@ -149,6 +254,81 @@ def _parse_daily(payload: dict) -> list[DailyRow]:
     return rows
 
 
+def _parse_daily_multi(payload: dict | list) -> list[list[DailyRow]]:
+    """Risposta multi-località: una lista di blocchi, uno per coordinata.
+
+    Con una sola coordinata Open-Meteo restituisce un oggetto e non una lista.
+    """
+    if isinstance(payload, dict):
+        return [_parse_daily(payload)]
+    return [_parse_daily(p) for p in payload]
+
+
+def _fetch_multi(
+    url: str, params: dict, punti: list[tuple[float, float]],
+) -> list[list[DailyRow] | MeteoFetchError]:
+    """Una richiesta per tutti i `punti`; se il lotto è rifiutato, lo divide a metà.
+
+    Si divide solo per errori che dipendono dal lotto (vedi MeteoFetchError);
+    gli altri, dopo i tentativi con backoff, risalgono al chiamante.
+    Restituisce una lista allineata a `punti`, con l'errore al posto delle
+    righe per le coordinate rifiutate anche da sole.
+    """
+    try:
+        payload = _http_get_lotto(url, {
+            **params,
+            'latitude': ','.join(str(lat) for lat, _ in punti),
+            'longitude': ','.join(str(lon) for _, lon in punti),
+        })
+        blocchi = _parse_daily_multi(payload)
+        if len(blocchi) != len(punti):
+            raise MeteoFetchError(
+                f"Open-Meteo: {len(blocchi)} blocchi per {len(punti)} località", lotto=True,
+            )
+        return blocchi
+    except MeteoFetchError as e:
+        if not e.lotto:
+            raise
+        logger.warning("%s (%s località)", e, len(punti))
+        if len(punti) == 1:
+            return [e]
+    meta = len(punti) // 2
+    return _fetch_multi(url, params, punti[:meta]) + _fetch_multi(url, params, punti[meta:])
+
+
+def fetch_meteo_archive_multi(
+    punti: list[tuple[float, float]],
+    start: date,
+    end: date,
+    timezone_str: str = 'auto',
+) -> list[list[DailyRow] | MeteoFetchError]:
+    """Come `fetch_meteo_archive` per più coordinate (lat, lon) nella stessa richiesta."""
+    if start > end or not punti:
+        return [[] for _ in punti]
+    return _fetch_multi(ARCHIVE_URL, {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'daily': ','.join(DAILY_VARS),
+        'timezone': timezone_str,
+    }, punti)
+
+
+def fetch_meteo_forecast_recent_multi(
+    punti: list[tuple[float, float]],
+    past_days: int = ARCHIVE_LAG_DAYS,
+    timezone_str: str = 'auto',
+) -> list[list[DailyRow] | MeteoFetchError]:
+    """Come `fetch_meteo_forecast_recent` per più coordinate nella stessa richiesta."""
+    if not punti:
+        return []
+    return _fetch_multi(FORECAST_URL, {
+        'daily': ','.join(DAILY_VARS),
+        'past_days': max(1, min(past_days, 92)),
+        'forecast_days': 1,
+        'timezone': timezone_str,
+    }, punti)
+
+
 def calcola_gdd(tmin: float | None, tmax: float | None, base: float = 10.0) -> float | None:
     """Growing Degree Days: max(0, (Tmin+Tmax)/2 - base). None se input mancanti."""
     if tmin is None or tmax is None:
@@ -206,6 +386,14 @@ def fetch_meteo_forecast_recent(
     return _parse_daily(payload)
 
 
+_UPSERT_FIELDS = [
+    'temp_min', 'temp_max', 'temp_mean', 'precip_mm', 'precip_hours',
+    'umidita_media', 'vento_medio', 'vento_raffica_max', 'pressione_media',
+    'ore_sole', 'radiazione_mj', 'gdd_base10', 'weather_code_dominante',
+    'source', 'updated_at',
+]
+
+
 @transaction.atomic
 def upsert_meteo_giornaliero(
     apiario: Apiario,
@@ -216,35 +404,59 @@ def upsert_meteo_giornaliero(
 
     Regola: una riga `archive` non viene mai sovrascritta da `forecast`.
     Una riga `forecast` viene sovrascritta da `archive`.
+
+    Una query per le date già `archive` (solo per `forecast`) e un solo
+    `bulk_create(update_conflicts=True)` su (apiario, data); su MySQL senza
+    `unique_fields`, che il backend non supporta. bulk_create non
+    emette post_save: gli snapshot ML dell'apiario vengono invalidati qui.
     """
-    written = 0
-    for row in rows:
-        gdd = calcola_gdd(row.temp_min, row.temp_max)
-        existing = MeteoGiornaliero.objects.filter(apiario=apiario, data=row.data).first()
-        if existing and existing.source == MeteoGiornaliero.SOURCE_ARCHIVE \
-                and source == MeteoGiornaliero.SOURCE_FORECAST:
-            continue
-        defaults = {
-            'temp_min': row.temp_min,
-            'temp_max': row.temp_max,
-            'temp_mean': row.temp_mean,
-            'precip_mm': row.precip_mm,
-            'precip_hours': row.precip_hours,
-            'umidita_media': row.umidita_media,
-            'vento_medio': row.vento_medio,
-            'vento_raffica_max': row.vento_raffica_max,
-            'pressione_media': row.pressione_media,
-            'ore_sole': row.ore_sole,
-            'radiazione_mj': row.radiazione_mj,
-            'gdd_base10': gdd,
-            'weather_code_dominante': row.weather_code_dominante,
-            'source': source,
-        }
-        MeteoGiornaliero.objects.update_or_create(
-            apiario=apiario, data=row.data, defaults=defaults,
-        )
-        written += 1
-    return written
+    rows = {row.data: row for row in rows}  # una riga per data (vince l'ultima)
+    if source == MeteoGiornaliero.SOURCE_FORECAST and rows:
+        gia_archive = MeteoGiornaliero.objects.filter(
+            apiario=apiario, data__in=list(rows),
+            source=MeteoGiornaliero.SOURCE_ARCHIVE,
+        ).values_list('data', flat=True)
+        for d in gia_archive:
+            rows.pop(d, None)
+    if not rows:
+        return 0
+
+    # MySQL (produzione) non accetta unique_fields: ON DUPLICATE KEY UPDATE
+    # scatta comunque sul vincolo univoco (apiario, data)
+    conflitto = (
+        {'unique_fields': ['apiario', 'data']}
+        if connection.features.supports_update_conflicts_with_target else {}
+    )
+    MeteoGiornaliero.objects.bulk_create(
+        [
+            MeteoGiornaliero(
+                apiario=apiario,
+                data=row.data,
+                temp_min=row.temp_min,
+                temp_max=row.temp_max,
+                temp_mean=row.temp_mean,
+                precip_mm=row.precip_mm,
+                precip_hours=row.precip_hours,
+                umidita_media=row.umidita_media,
+                vento_medio=row.vento_medio,
+                vento_raffica_max=row.vento_raffica_max,
+                pressione_media=row.pressione_media,
+                ore_sole=row.ore_sole,
+                radiazione_mj=row.radiazione_mj,
+                gdd_base10=calcola_gdd(row.temp_min, row.temp_max),
+                weather_code_dominante=row.weather_code_dominante,
+                source=source,
+            )
+            for row in rows.values()
+        ],
+        update_conflicts=True,
+        update_fields=_UPSERT_FIELDS,
+        **conflitto,
+    )
+
+    from .ml.cache import bump_apiaries
+    bump_apiaries([apiario.pk])
+    return len(rows)
 
 
 def trova_giorni_mancanti(apiario: Apiario, start: date, end: date) -> set[date]:
@@ -262,50 +474,245 @@ def trova_giorni_mancanti(apiario: Apiario, start: date, end: date) -> set[date]
     return giorni - presenti
 
 
-def aggiorna_meteo_apiario(apiario: Apiario, start: date, end: date) -> dict:
-    """Riempie i buchi tra start ed end per un singolo apiario.
+def date_archive_presenti(
+    apiario_ids: Iterable[int], start: date, end: date,
+) -> dict[int, set[date]]:
+    """Date `archive` già presenti in [start, end] per molti apiari, con una sola query."""
+    presenti: dict[int, set[date]] = {aid: set() for aid in apiario_ids}
+    if start > end or not presenti:
+        return presenti
+    for aid, d in MeteoGiornaliero.objects.filter(
+        apiario_id__in=list(presenti),
+        data__gte=start,
+        data__lte=end,
+        source=MeteoGiornaliero.SOURCE_ARCHIVE,
+    ).values_list('apiario_id', 'data'):
+        presenti[aid].add(d)
+    return presenti
 
-    - Per i giorni fino a `oggi - ARCHIVE_LAG_DAYS` usa Archive (ERA5).
-    - Per i restanti giorni recenti usa Forecast (etichettati `forecast`).
-    Idempotente: ri-eseguibile a piacere; archivia non viene mai sovrascritto
-    da un forecast successivo.
 
-    Restituisce dizionario con conteggi: {archive: N, forecast: N}.
-    """
-    if not apiario.has_coordinates() or not apiario.monitoraggio_meteo:
-        return {'archive': 0, 'forecast': 0, 'skipped': True}
+# Righe di una località, o l'errore che ne ha impedito lo scarico
+_Righe = Union[list[DailyRow], MeteoFetchError]
+
+
+@dataclass
+class PianoMeteo:
+    """Cosa scaricare per un apiario: giorni Archive mancanti + finestra Forecast."""
+    apiario: Apiario
+    start: date
+    end: date
+    mancanti_archive: set[date]
+    forecast_past_days: int | None  # None: nessun giorno recente da coprire
+
+    @property
+    def punto(self) -> tuple[float, float]:
+        """Coordinate esatte dell'apiario (Forecast)."""
+        return float(self.apiario.latitudine), float(self.apiario.longitudine)
+
+    @property
+    def cella(self) -> tuple[float, float]:
+        """Cella di griglia ERA5 dell'apiario (Archive)."""
+        return cella_meteo(*self.punto)
+
 
-    lat = float(apiario.latitudine)
-    lon = float(apiario.longitudine)
+def cella_meteo(lat: float, lon: float, passo: float | None = None) -> tuple[float, float]:
+    """Centro della cella di griglia che contiene il punto (lat, lon).
 
+    `passo` in gradi, default settings.METEO_GRID_DEG; 0 = coordinate esatte.
+    """
+    if passo is None:
+        passo = getattr(settings, 'METEO_GRID_DEG', 0.25)
+    if not passo:
+        return lat, lon
+    return (
+        round((math.floor(lat / passo) + 0.5) * passo, 4),
+        round((math.floor(lon / passo) + 0.5) * passo, 4),
+    )
+
+
+def _finestre(start: date, end: date) -> tuple[date, date, date]:
+    """(end effettivo, ultimo giorno Archive richiedibile, ultimo giorno ERA5)."""
     oggi = date.today()
     archive_max = oggi - timedelta(days=ARCHIVE_LAG_DAYS)
     end = min(end, oggi)
+    return end, min(end, archive_max), archive_max
 
-    archive_written = 0
-    forecast_written = 0
-
-    # Fase 1: Archive per i giorni vecchi
-    archive_end = min(end, archive_max)
-    if start <= archive_end:
-        mancanti = trova_giorni_mancanti(apiario, start, archive_end)
-        if mancanti:
-            mancanti_sorted = sorted(mancanti)
-            fetch_start = mancanti_sorted[0]
-            fetch_end = mancanti_sorted[-1]
-            rows = fetch_meteo_archive(lat, lon, fetch_start, fetch_end)
-            rows = [r for r in rows if r.data in mancanti]
-            archive_written = upsert_meteo_giornaliero(
-                apiario, rows, MeteoGiornaliero.SOURCE_ARCHIVE,
-            )
 
-    # Fase 2: Forecast per i giorni recenti che Archive non copre
-    if end > archive_max:
-        past_days = (end - archive_max).days + ARCHIVE_LAG_DAYS
-        rows = fetch_meteo_forecast_recent(lat, lon, past_days=past_days)
-        rows = [r for r in rows if start <= r.data <= end]
-        forecast_written = upsert_meteo_giornaliero(
-            apiario, rows, MeteoGiornaliero.SOURCE_FORECAST,
+def pianifica_meteo_apiario(
+    apiario: Apiario, start: date, end: date, presenti_archive: set[date] | None = None,
+) -> PianoMeteo:
+    """Calcola il piano di download.
+
+    `presenti_archive` (date già `archive`, vedi `date_archive_presenti`)
+    evita la query per apiario quando il chiamante le ha già lette in blocco.
+    """
+    end, archive_end, archive_max = _finestre(start, end)
+    if start > archive_end:
+        mancanti_archive = set()
+    elif presenti_archive is None:
+        mancanti_archive = trova_giorni_mancanti(apiario, start, archive_end)
+    else:
+        giorni = {start + timedelta(days=i) for i in range((archive_end - start).days + 1)}
+        mancanti_archive = giorni - presenti_archive
+    forecast_past_days = (end - archive_max).days + ARCHIVE_LAG_DAYS if end > archive_max else None
+    return PianoMeteo(apiario, start, end, mancanti_archive, forecast_past_days)
+
+
+def scarica_celle(
+    gruppi: list[list[PianoMeteo]],
+) -> list[tuple[_Righe, dict[tuple[float, float], _Righe]]]:
+    """Scarica un lotto di celle con una richiesta Archive e una Forecast.
+
+    `gruppi`: una lista di piani per cella. Solo HTTP (nessun accesso al DB):
+    sicuro da eseguire in un thread. Archive copre l'unione dei giorni
+    mancanti del lotto, un punto per cella; Forecast la finestra più lunga,
+    un punto per coordinata esatta degli apiari. Per ogni cella restituisce
+    (righe archive, {punto: righe forecast}) non filtrate, da distribuire con
+    `righe_per_piano`. Una coordinata rifiutata anche da sola riceve il suo
+    MeteoFetchError al posto delle righe; un lotto che fallisce per 429/5xx
+    persistenti solleva MeteoFetchError.
+    """
+    archive: list[_Righe] = [[] for _ in gruppi]
+    forecast: list[dict[tuple[float, float], _Righe]] = [{} for _ in gruppi]
+
+    mancanti = [set().union(*(p.mancanti_archive for p in piani)) for piani in gruppi]
+    idx = [i for i, m in enumerate(mancanti) if m]
+    if idx:
+        blocchi = fetch_meteo_archive_multi(
+            [gruppi[i][0].cella for i in idx],
+            min(min(mancanti[i]) for i in idx),
+            max(max(mancanti[i]) for i in idx),
+        )
+        for i, rows in zip(idx, blocchi):
+            archive[i] = rows
+
+    # punto esatto → celle che lo contengono (più apiari possono coincidere)
+    punti: dict[tuple[float, float], list[int]] = defaultdict(list)
+    for i, piani in enumerate(gruppi):
+        for p in piani:
+            if p.forecast_past_days is not None and i not in punti[p.punto]:
+                punti[p.punto].append(i)
+    if punti:
+        blocchi = fetch_meteo_forecast_recent_multi(
+            list(punti),
+            past_days=max(p.forecast_past_days for piani in gruppi for p in piani
+                          if p.forecast_past_days is not None),
         )
+        for (punto, celle), rows in zip(punti.items(), blocchi):
+            for i in celle:
+                forecast[i][punto] = rows
+
+    return list(zip(archive, forecast))
 
+
+def righe_per_piano(
+    piano: PianoMeteo, archive_rows: _Righe, forecast_rows: dict[tuple[float, float], _Righe],
+) -> tuple[list[DailyRow], list[DailyRow]]:
+    """Le righe di una cella che servono a questo apiario.
+
+    Solleva il MeteoFetchError della cella se lo scarico che serve è fallito.
+    """
+    forecast = forecast_rows.get(piano.punto, []) if piano.forecast_past_days is not None else []
+    for rows in (archive_rows, forecast):
+        if isinstance(rows, MeteoFetchError):
+            raise rows
+    return (
+        [r for r in archive_rows if r.data in piano.mancanti_archive],
+        [r for r in forecast if piano.start <= r.data <= piano.end],
+    )
+
+
+def scrivi_meteo(piano: PianoMeteo, archive_rows: list[DailyRow], forecast_rows: list[DailyRow]) -> dict:
+    archive_written = upsert_meteo_giornaliero(
+        piano.apiario, archive_rows, MeteoGiornaliero.SOURCE_ARCHIVE,
+    ) if archive_rows else 0
+    forecast_written = upsert_meteo_giornaliero(
+        piano.apiario, forecast_rows, MeteoGiornaliero.SOURCE_FORECAST,
+    ) if forecast_rows else 0
     return {'archive': archive_written, 'forecast': forecast_written, 'skipped': False}
+
+
+def aggiorna_meteo_apiario(apiario: Apiario, start: date, end: date) -> dict:
+    """Riempie i buchi tra start ed end per un singolo apiario.
+
+    - Per i giorni fino a `oggi - ARCHIVE_LAG_DAYS` usa Archive (ERA5).
+    - Per i restanti giorni recenti usa Forecast (etichettati `forecast`).
+    Idempotente: ri-eseguibile a piacere; archivia non viene mai sovrascritto
+    da un forecast successivo.
+
+    Restituisce dizionario con conteggi: {archive: N, forecast: N}.
+    Solleva MeteoFetchError se Open-Meteo non restituisce i dati.
+    """
+    if not apiario.has_coordinates() or not apiario.monitoraggio_meteo:
+        return {'archive': 0, 'forecast': 0, 'skipped': True}
+    piano = pianifica_meteo_apiario(apiario, start, end)
+    return scrivi_meteo(piano, *righe_per_piano(piano, *scarica_celle([[piano]])[0]))
+
+
+def aggiorna_meteo_apiari(
+    richieste: Iterable[tuple[Apiario, date, date]],
+    workers: int | None = None,
+) -> dict[int, dict]:
+    """Versione batch di `aggiorna_meteo_apiario` per cron e backfill.
+
+    `richieste`: tuple (apiario, start, end). I giorni Archive mancanti di
+    tutti gli apiari si leggono con una query; gli apiari vengono raggruppati
+    per cella di griglia e le celle in lotti di settings.METEO_BATCH_LOCATIONS
+    coordinate per richiesta HTTP. I lotti girano su `workers` thread
+    (default settings.METEO_FETCH_WORKERS) sotto il rate limit condiviso; le
+    scritture restano sul thread chiamante, un upsert per apiario man mano
+    che i lotti finiscono.
+
+    Restituisce {apiario_id: conteggi}; in caso di errore il dizionario
+    dell'apiario contiene `errore` al posto dei conteggi.
+    """
+    richieste = [
+        (a, s, e) for a, s, e in richieste
+        if a.has_coordinates() and a.monitoraggio_meteo
+    ]
+    if not richieste:
+        return {}
+
+    presenti = date_archive_presenti(
+        [a.pk for a, _, _ in richieste],
+        min(s for _, s, _ in richieste),
+        max(_finestre(s, e)[1] for _, s, e in richieste),
+    )
+    piani = [pianifica_meteo_apiario(a, s, e, presenti[a.pk]) for a, s, e in richieste]
+
+    workers = workers or getattr(settings, 'METEO_FETCH_WORKERS', 8)
+    celle: dict[tuple[float, float], list[PianoMeteo]] = defaultdict(list)
+    for piano in piani:
+        celle[piano.cella].append(piano)
+
+    # Lotti di celle con intervalli Archive vicini: la richiesta copre l'unione
+    # dei giorni del lotto, quindi si ordina per primo giorno mancante.
+    gruppi = sorted(
+        celle.values(),
+        key=lambda piani: min((min(p.mancanti_archive) for p in piani if p.mancanti_archive),
+                              default=date.max),
+    )
+    size = max(1, getattr(settings, 'METEO_BATCH_LOCATIONS', 50))
+    lotti = [gruppi[i:i + size] for i in range(0, len(gruppi), size)]
+
+    risultati: dict[int, dict] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(scarica_celle, lotto): lotto for lotto in lotti}
+        for future in as_completed(futures):
+            lotto = futures[future]
+            try:
+                righe_lotto = future.result()
+            except Exception as e:
+                logger.warning("Meteo lotto di %s celle fallito: %s", len(lotto), e)
+                for piani in lotto:
+                    for piano in piani:
+                        risultati[piano.apiario.pk] = {'errore': str(e)}
+                continue
+            for piani, righe in zip(lotto, righe_lotto):
+                for piano in piani:
+                    try:
+                        risultati[piano.apiario.pk] = scrivi_meteo(piano, *righe_per_piano(piano, *righe))
+                    except Exception as e:
+                        logger.warning("Meteo apiario %s fallito: %s", piano.apiario.pk, e)
+                        risultati[piano.apiario.pk] = {'errore': str(e)}
+    return risultati
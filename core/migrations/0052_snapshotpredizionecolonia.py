@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:50
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0051_pagamento_spesa_attrezzatura'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotPredizioneColonia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versione_dati', models.PositiveIntegerField(default=0, help_text='Contatore incrementato a ogni modifica dei dati della colonia/apiario')),
+                ('versione_calcolata', models.PositiveIntegerField(blank=True, help_text='versione_dati su cui è stato calcolato il payload (NULL = mai calcolato)', null=True)),
+                ('versione_modelli', models.CharField(blank=True, default='', max_length=200)),
+                ('data_riferimento', models.DateField(blank=True, help_text='Giorno in cui è stato calcolato il payload', null=True)),
+                ('payload', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('colonia', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_predizione', to='core.colonia')),
+            ],
+            options={
+                'verbose_name': 'Snapshot predizioni colonia',
+                'verbose_name_plural': 'Snapshot predizioni colonie',
+            },
+        ),
+    ]
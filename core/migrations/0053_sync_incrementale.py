@@ -0,0 +1,96 @@
+"""Watermark `updated_at` e tombstone per la sync incrementale (core/sync.py).
+
+Le righe esistenti ricevono `updated_at` = istante della migrazione. Le
+fioriture con `data_modifica` nulla (righe antecedenti al campo) prendono
+`data_creazione`, altrimenti resterebbero fuori da ogni sync incrementale.
+"""
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def _backfill_data_modifica(apps, schema_editor):
+    Fioritura = apps.get_model('core', 'Fioritura')
+    Fioritura.objects.filter(data_modifica__isnull=True, data_creazione__isnull=False).update(
+        data_modifica=F('data_creazione'),
+    )
+    Fioritura.objects.filter(data_modifica__isnull=True).update(data_modifica=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0052_snapshotpredizionecolonia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordEliminato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modello', models.CharField(help_text="Chiave della collezione di sync (es. 'controlli')", max_length=30)),
+                ('oggetto_id', models.PositiveIntegerField()),
+                ('apiario_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('utente_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('gruppo_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('data_eliminazione', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Record eliminato (sync)',
+                'verbose_name_plural': 'Record eliminati (sync)',
+                'ordering': ['data_eliminazione', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='apiario',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='controlloarnia',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='melario',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='pagamento',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='quotautente',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='regina',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='smielatura',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='trattamentosanitario',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='fioritura',
+            name='data_modifica',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(_backfill_data_modifica, migrations.RunPython.noop),
+    ]
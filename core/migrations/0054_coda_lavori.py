@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0053_sync_incrementale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LavoroInCoda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(help_text='Nome del gestore registrato in core/jobs.py', max_length=50)),
+                ('argomenti', models.JSONField(blank=True, default=dict)),
+                ('chiave', models.CharField(blank=True, db_index=True, default='', help_text='Deduplica: un solo lavoro pendente per chiave', max_length=100)),
+                ('stato', models.CharField(choices=[('in_attesa', 'In attesa'), ('in_corso', 'In corso'), ('completato', 'Completato'), ('fallito', 'Fallito')], default='in_attesa', max_length=12)),
+                ('tentativi', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativi', models.PositiveSmallIntegerField(default=5)),
+                ('esegui_dopo', models.DateTimeField(default=django.utils.timezone.now)),
+                ('errore', models.TextField(blank=True, default='')),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('data_creazione', models.DateTimeField(auto_now_add=True)),
+                ('data_inizio', models.DateTimeField(blank=True, null=True)),
+                ('data_fine', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Lavoro in coda',
+                'verbose_name_plural': 'Lavori in coda',
+                'ordering': ['-data_creazione'],
+                'indexes': [models.Index(fields=['stato', 'esegui_dopo'], name='core_lavoro_stato_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0054_coda_lavori'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analisitelaino',
+            name='hash_immagine',
+            field=models.CharField(blank=True, default='', help_text="sha256 dell'immagine da cui sono state generate le miniature", max_length=64),
+        ),
+        migrations.AddField(
+            model_name='analisitelaino',
+            name='immagine_annotata',
+            field=models.ImageField(blank=True, help_text='Immagine con i bounding box della detection', null=True, upload_to='analisi_telaini/derivati/'),
+        ),
+        migrations.AddField(
+            model_name='analisitelaino',
+            name='miniatura',
+            field=models.ImageField(blank=True, help_text='Miniatura WebP per le liste', null=True, upload_to='analisi_telaini/derivati/'),
+        ),
+        migrations.AddField(
+            model_name='analisitelaino',
+            name='miniatura_jpeg',
+            field=models.ImageField(blank=True, help_text='Miniatura JPEG per i client senza WebP', null=True, upload_to='analisi_telaini/derivati/'),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:42
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+CAMPI = {
+    'ultimo_controllo': 'pk',
+    'ultimo_controllo_data': 'data',
+    'ultimo_telaini_covata': 'telaini_covata',
+    'ultimo_telaini_scorte': 'telaini_scorte',
+    'ultimo_presenza_regina': 'presenza_regina',
+    'ultimo_problemi_sanitari': 'problemi_sanitari',
+    'ultimo_sciamatura': 'sciamatura',
+}
+
+
+def popola_ultimo_controllo(apps, schema_editor):
+    """Fotografia iniziale; poi la mantengono i signal (core/ultimo_controllo.py)."""
+    ControlloArnia = apps.get_model('core', 'ControlloArnia')
+    for nome, campo in (('Arnia', 'arnia'), ('Colonia', 'colonia')):
+        ultimo = ControlloArnia.objects.filter(**{campo: OuterRef('pk')}).order_by(
+            '-data', '-data_creazione', '-id',
+        )
+        apps.get_model('core', nome).objects.update(**{
+            destinazione: Subquery(ultimo.values(sorgente)[:1])
+            for destinazione, sorgente in CAMPI.items()
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0055_derivati_analisi_telaino'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_controllo',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.controlloarnia'),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_controllo_data',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_presenza_regina',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_problemi_sanitari',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_sciamatura',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_telaini_covata',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='arnia',
+            name='ultimo_telaini_scorte',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_controllo',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.controlloarnia'),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_controllo_data',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_presenza_regina',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_problemi_sanitari',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_sciamatura',
+            field=models.BooleanField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_telaini_covata',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='colonia',
+            name='ultimo_telaini_scorte',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(popola_ultimo_controllo, migrations.RunPython.noop),
+    ]
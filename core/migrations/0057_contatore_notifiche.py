@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def popola_contatori(apps, schema_editor):
+    """Contatori iniziali per chi ha notifiche; poi li mantengono i signal."""
+    Notifica = apps.get_model('core', 'Notifica')
+    ContatoreNotifiche = apps.get_model('core', 'ContatoreNotifiche')
+    righe = (
+        Notifica.objects.order_by().values('utente_id')
+        .annotate(non_lette=Count('id', filter=Q(letta=False)))
+        .values_list('utente_id', 'non_lette')
+    )
+    ContatoreNotifiche.objects.bulk_create(
+        [ContatoreNotifiche(utente_id=u, non_lette=n) for u, n in righe], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0056_ultimo_controllo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContatoreNotifiche',
+            fields=[
+                ('utente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='contatore_notifiche', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('non_lette', models.PositiveIntegerField(default=0)),
+                ('versione', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contatore notifiche',
+                'verbose_name_plural': 'Contatori notifiche',
+            },
+        ),
+        migrations.RunPython(popola_contatori, migrations.RunPython.noop),
+    ]
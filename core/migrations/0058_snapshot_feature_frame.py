@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0057_contatore_notifiche'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshotpredizionecolonia',
+            name='impronta_righe',
+            field=models.CharField(blank=True, default='', help_text="frame_digest degli input fino all'ultima riga: se coincide, il frame si estende", max_length=32),
+        ),
+        migrations.AddField(
+            model_name='snapshotpredizionecolonia',
+            name='righe',
+            field=models.JSONField(blank=True, help_text='Feature frame (core.ml.features) da cui è stato calcolato il payload', null=True),
+        ),
+    ]
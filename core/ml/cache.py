@@ -0,0 +1,153 @@
+"""Persistent prediction cache: one stored snapshot per colony.
+
+A snapshot (``core.models.SnapshotPredizioneColonia``) is served as-is while
+all of these still hold:
+
+  * ``versione_calcolata == versione_dati`` — no input row changed since the
+    payload was computed. ``versione_dati`` is bumped by the signal handlers in
+    ``core/signals.py`` through the ``bump_*`` helpers below;
+  * ``data_riferimento`` is today — every target depends on the current date
+    (staleness of the last control, queen age, production year, meteo window);
+  * ``versione_modelli`` matches the deployed model versions.
+
+Otherwise the colony is recomputed and the snapshot is written back with a
+compare-and-set on ``versione_dati``, so a bump racing with the computation
+leaves the snapshot stale instead of storing an outdated payload as fresh.
+
+The snapshot also keeps the feature frame the payload was computed from and
+its :func:`core.ml.features.frame_digest`. On recompute, if the current
+dataset still has the same digest up to the last stored row (typically: only
+newer controls were added), the frame is extended with
+:func:`core.ml.features.extend_feature_frame` instead of rebuilt.
+"""
+
+from datetime import date
+
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import SnapshotPredizioneColonia
+from core.ml.dataset import build_colonia_dataset
+from core.ml.features import colony_feature_frame, extend_feature_frame, frame_digest
+from core.ml.models import swarm, wintering, production
+from core.ml.predict import predict_colonie, predict_dataset
+
+MODELS_VERSION = '|'.join((
+    swarm.MODEL_VERSION, wintering.MODEL_VERSION, production.MODEL_VERSION,
+))
+
+
+def cached_predict_colonia(colonia):
+    """:func:`core.ml.predict.predict_colonia` answered from the snapshot when fresh."""
+    snap, _ = SnapshotPredizioneColonia.objects.get_or_create(colonia=colonia)
+    if _is_fresh(snap):
+        return snap.payload
+    dataset = build_colonia_dataset(colonia)
+    rows, digest = _feature_frame(snap, dataset)
+    result = predict_dataset(dataset, rows)
+    _store(snap, result, rows, digest)
+    return result
+
+
+def cached_predict_colonie(colonie, workers=None):
+    """Batch counterpart of :func:`cached_predict_colonia`.
+
+    Loads every snapshot in one query and recomputes only the stale colonies via
+    :func:`core.ml.predict.predict_colonie`. Returns ``(results, timings)`` like
+    ``predict_colonie``; ``timings`` also reports ``cache_hits``.
+    """
+    colonie = list(colonie)
+    ids = [c.id for c in colonie]
+    snaps = {s.colonia_id: s for s in SnapshotPredizioneColonia.objects.filter(colonia_id__in=ids)}
+    mancanti = [cid for cid in ids if cid not in snaps]
+    if mancanti:
+        SnapshotPredizioneColonia.objects.bulk_create(
+            [SnapshotPredizioneColonia(colonia_id=cid) for cid in mancanti],
+            ignore_conflicts=True,
+        )
+        snaps.update({
+            s.colonia_id: s
+            for s in SnapshotPredizioneColonia.objects.filter(colonia_id__in=mancanti)
+        })
+
+    stale = [c for c in colonie if not _is_fresh(snaps[c.id])]
+    frames = {}
+
+    def frame(colonia, dataset):
+        frames[colonia.id] = _feature_frame(snaps[colonia.id], dataset)
+        return frames[colonia.id][0]
+
+    if stale:
+        computed, timings = predict_colonie(stale, workers=workers, frames=frame)
+    else:
+        computed, timings = [], {'dataset_ms': 0.0, 'predict_ms': 0.0, 'total_ms': 0.0, 'workers': 1}
+
+    by_id = {}
+    for colonia, result in zip(stale, computed):
+        _store(snaps[colonia.id], result, *frames[colonia.id])
+        by_id[colonia.id] = result
+    results = [by_id[cid] if cid in by_id else snaps[cid].payload for cid in ids]
+
+    timings['cache_hits'] = len(colonie) - len(stale)
+    return results, timings
+
+
+def bump_colonies(colonia_ids):
+    """Mark the snapshots of these colonies as stale (one UPDATE)."""
+    colonia_ids = [cid for cid in colonia_ids if cid is not None]
+    if colonia_ids:
+        SnapshotPredizioneColonia.objects.filter(colonia_id__in=colonia_ids).update(
+            versione_dati=F('versione_dati') + 1,
+        )
+
+
+def bump_apiaries(apiario_ids):
+    """Mark stale the snapshots of every colony in these apiari (one UPDATE)."""
+    apiario_ids = [aid for aid in apiario_ids if aid is not None]
+    if apiario_ids:
+        SnapshotPredizioneColonia.objects.filter(colonia__apiario_id__in=apiario_ids).update(
+            versione_dati=F('versione_dati') + 1,
+        )
+
+
+def bump_harvests(smielatura_ids):
+    """Mark stale the colonies whose melari are linked to these smielature."""
+    smielatura_ids = [sid for sid in smielatura_ids if sid is not None]
+    if smielatura_ids:
+        SnapshotPredizioneColonia.objects.filter(
+            colonia__melari__smielature__in=smielatura_ids,
+        ).update(versione_dati=F('versione_dati') + 1)
+
+
+def _is_fresh(snap):
+    return (
+        snap.payload is not None
+        and snap.versione_calcolata == snap.versione_dati
+        and snap.data_riferimento == date.today()
+        and snap.versione_modelli == MODELS_VERSION
+    )
+
+
+def _feature_frame(snap, dataset):
+    """``(rows, digest)`` for ``dataset``, extending the stored frame when valid."""
+    rows = snap.righe
+    if rows and snap.impronta_righe == frame_digest(dataset, rows[-1]['data']):
+        rows = extend_feature_frame(rows, dataset)
+    else:
+        rows = colony_feature_frame(dataset)
+    return rows, (frame_digest(dataset, rows[-1]['data']) if rows else '')
+
+
+def _store(snap, result, rows, digest):
+    """Compare-and-set write: skipped if ``versione_dati`` moved meanwhile."""
+    SnapshotPredizioneColonia.objects.filter(
+        pk=snap.pk, versione_dati=snap.versione_dati,
+    ).update(
+        payload=result,
+        righe=rows,
+        impronta_righe=digest,
+        versione_calcolata=snap.versione_dati,
+        versione_modelli=MODELS_VERSION,
+        data_riferimento=date.today(),
+        updated_at=timezone.now(),
+    )
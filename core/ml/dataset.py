@@ -6,9 +6,11 @@ lists. It is consumed by:
   * the REST endpoint ``ml_dataset_colonia`` (HTTP export for inspection/debug),
   * the feature pipeline (``core.ml.features``) for both inference and training.
 
-Training over many colonies (cross-user pooling) calls this function directly on
-ORM objects, avoiding per-colony HTTP round-trips. Extend feature collection HERE,
-not in parallel endpoints.
+Training over many colonies (cross-user pooling) calls the bulk variant
+``build_colonia_datasets(colonie)`` directly on ORM objects: one query per table
+for the whole id set instead of a dozen per colony. The single-colony function is
+a thin wrapper around it. Extend feature collection HERE, not in parallel
+endpoints.
 """
 
 from datetime import date, timedelta
@@ -24,6 +26,9 @@ from core.models import (
 # How many days of daily weather to attach. Kept here so the endpoint and the
 # training pipeline stay consistent.
 METEO_WINDOW_DAYS = 365
+# Colonies per bulk round-trip in ``build_colonia_datasets``: bounds both the
+# size of the ``IN (...)`` lists and the rows held in memory at once.
+BULK_CHUNK_SIZE = 500
 
 
 def build_colonia_dataset(colonia, meteo_days=METEO_WINDOW_DAYS):
@@ -41,121 +46,194 @@ def build_colonia_dataset(colonia, meteo_days=METEO_WINDOW_DAYS):
     dict
         Parallel date-ordered lists. See module docstring.
     """
-    controlli = list(
-        ControlloArnia.objects.filter(colonia=colonia).values(
+    return build_colonia_datasets([colonia], meteo_days=meteo_days)[colonia.id]
+
+
+def build_colonia_datasets(colonie, meteo_days=METEO_WINDOW_DAYS):
+    """Bulk variant of :func:`build_colonia_dataset` for many colonies at once.
+
+    Each source table is queried once per chunk of ``BULK_CHUNK_SIZE`` colonies
+    (filtering on the whole id set) and the rows are partitioned in memory, so
+    the query count no longer grows with the number of colonies. Meteo and
+    fioriture are loaded per *apiario* and the same lists are shared by every
+    colony of that apiario: treat the returned lists as read-only.
+
+    Parameters
+    ----------
+    colonie : iterable of core.models.Colonia
+        Already-fetched colony instances; ``select_related('apiario')`` avoids
+        one query per colony for ``apiario_nome``.
+    meteo_days : int
+        Size of the trailing daily-weather window to include.
+
+    Returns
+    -------
+    dict
+        ``{colonia_id: dataset}`` with the same per-colony shape as
+        :func:`build_colonia_dataset`.
+    """
+    colonie = list(colonie)
+    datasets = {}
+    for i in range(0, len(colonie), BULK_CHUNK_SIZE):
+        datasets.update(_build_chunk(colonie[i:i + BULK_CHUNK_SIZE], meteo_days))
+    return datasets
+
+
+def _build_chunk(colonie, meteo_days):
+    ids = [c.id for c in colonie]
+    apiario_ids = {c.apiario_id for c in colonie}
+
+    controlli = _partition(
+        ControlloArnia.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'data', 'telaini_covata', 'telaini_scorte',
             'presenza_regina', 'regina_vista', 'uova_fresche',
             'celle_reali', 'numero_celle_reali', 'sciamatura', 'data_sciamatura',
             'problemi_sanitari', 'regina_sostituita', 'sostituzione_scatola',
-        ).order_by('data')
+        ).order_by('data'),
+        'colonia_id',
     )
 
-    pesate = list(
-        PesataMelario.objects.filter(colonia=colonia).values(
+    pesate = _partition(
+        PesataMelario.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'data', 'tipo', 'melario_id', 'fioritura_id',
             'smielatura_id', 'peso_lordo_kg', 'tara_kg', 'peso_netto_kg',
-        ).order_by('data')
+        ).order_by('data'),
+        'colonia_id',
     )
 
-    smielature = list(
-        SmielaturaMelario.objects.filter(melario__colonia=colonia)
-        .select_related('smielatura')
+    smielature = _partition(
+        SmielaturaMelario.objects.filter(melario__colonia_id__in=ids)
         .values(
+            'melario__colonia_id',
             'smielatura_id', 'smielatura__data', 'smielatura__tipo_miele',
             'kg_miele', 'melario_id',
-        ).order_by('smielatura__data')
+        ).order_by('smielatura__data'),
+        'melario__colonia_id',
+    )
+    # Fioriture d'origine di tutte le smielature del chunk in una sola query.
+    fioriture_per_smielatura = _fioriture_per_smielatura(
+        {r['smielatura_id'] for rows in smielature.values() for r in rows}
     )
 
-    # Eventi di raccolto aggregati per smielatura: kg attribuiti a QUESTA colonia
-    # + fioriture d'origine (M2M Smielatura.fioriture). È l'unità target del
-    # modello produzione miele per-colonia.
-    smielature_eventi = _aggrega_smielature(smielature)
-
-    alimentazioni = list(
-        Alimentazione.objects.filter(colonia=colonia).values(
+    alimentazioni = _partition(
+        Alimentazione.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'data', 'tipo', 'scopo', 'quantita_kg',
-        ).order_by('data')
+        ).order_by('data'),
+        'colonia_id',
     )
 
-    varroa = list(
-        VarroaCheckpoint.objects.filter(colonia=colonia).values(
+    varroa = _partition(
+        VarroaCheckpoint.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'data_campionamento', 'metodo',
             'percentuale_calcolata', 'caduta_giornaliera', 'confidenza',
             'telaini_covata',
-        ).order_by('data_campionamento')
+        ).order_by('data_campionamento'),
+        'colonia_id',
     )
 
-    trattamenti = list(
-        TrattamentoSanitario.objects.filter(colonie=colonia)
+    # M2M: un trattamento su più colonie produce una riga per colonia.
+    trattamenti = _partition(
+        TrattamentoSanitario.objects.filter(colonie__in=ids)
         .exclude(stato='annullato').values(
+            'colonie',
             'id', 'data_inizio', 'data_fine', 'data_fine_sospensione',
             'tipo_trattamento_id', 'tipo_trattamento__nome',
             'tipo_trattamento__principio_attivo',
             'blocco_covata_attivo', 'data_inizio_blocco', 'data_fine_blocco',
-        ).order_by('data_inizio')
+        ).order_by('data_inizio'),
+        'colonie',
     )
 
     cutoff = date.today() - timedelta(days=meteo_days)
-    meteo = list(
+    meteo = _partition(
         MeteoGiornaliero.objects.filter(
-            apiario=colonia.apiario, data__gte=cutoff,
+            apiario_id__in=apiario_ids, data__gte=cutoff,
         ).values(
+            'apiario_id',
             'data', 'temp_min', 'temp_max', 'temp_mean',
             'precip_mm', 'precip_hours', 'umidita_media',
             'vento_medio', 'pressione_media',
             'ore_sole', 'radiazione_mj', 'gdd_base10', 'source',
-        ).order_by('data')
+        ).order_by('data'),
+        'apiario_id',
     )
 
-    nomadismi = list(
-        NomadismoEvent.objects.filter(colonia=colonia).values(
+    nomadismi = _partition(
+        NomadismoEvent.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'data_spostamento',
             'apiario_origine_id', 'apiario_destinazione_id', 'motivo',
-        ).order_by('data_spostamento')
+        ).order_by('data_spostamento'),
+        'colonia_id',
     )
 
-    fioriture = list(
-        Fioritura.objects.filter(apiario=colonia.apiario).values(
+    fioriture = _partition(
+        Fioritura.objects.filter(apiario_id__in=apiario_ids).values(
+            'apiario_id',
             'id', 'pianta', 'data_inizio', 'data_fine', 'intensita',
             'latitudine', 'longitudine',
-        ).order_by('data_inizio')
+        ).order_by('data_inizio'),
+        'apiario_id',
     )
 
     # ── Regina: not in the legacy endpoint, but a strong swarm/longevity signal ──
-    regina = _regina_snapshot(colonia)
-    storia_regine = list(
-        StoriaRegine.objects.filter(colonia=colonia).values(
+    regine = {r.colonia_id: r for r in Regina.objects.filter(colonia_id__in=ids)}
+    storia_regine = _partition(
+        StoriaRegine.objects.filter(colonia_id__in=ids).values(
+            'colonia_id',
             'id', 'regina_id', 'data_inizio', 'data_fine', 'motivo_fine',
-        ).order_by('data_inizio')
-    ) if _has_storia_regine_fields() else []
-
-    return {
-        'colonia': {
-            'id': colonia.id,
-            'apiario_id': colonia.apiario_id,
-            'apiario_nome': colonia.apiario.nome,
-            'data_inizio': colonia.data_inizio,
-            'data_fine': colonia.data_fine,
-            'stato': colonia.stato,
-        },
-        'controlli': controlli,
-        'pesate_melari': pesate,
-        'smielature': smielature,
-        'smielature_eventi': smielature_eventi,
-        'alimentazioni': alimentazioni,
-        'varroa': varroa,
-        'trattamenti': trattamenti,
-        'meteo_giornaliero': meteo,
-        'nomadismi': nomadismi,
-        'fioriture': fioriture,
-        'regina': regina,
-        'storia_regine': storia_regine,
-    }
-
-
-def _regina_snapshot(colonia):
+        ).order_by('data_inizio'),
+        'colonia_id',
+    ) if _has_storia_regine_fields() else {}
+
+    datasets = {}
+    for colonia in colonie:
+        cid = colonia.id
+        smielature_colonia = smielature.get(cid, [])
+        datasets[cid] = {
+            'colonia': {
+                'id': cid,
+                'apiario_id': colonia.apiario_id,
+                'apiario_nome': colonia.apiario.nome,
+                'data_inizio': colonia.data_inizio,
+                'data_fine': colonia.data_fine,
+                'stato': colonia.stato,
+            },
+            'controlli': controlli.get(cid, []),
+            'pesate_melari': pesate.get(cid, []),
+            'smielature': smielature_colonia,
+            # Eventi di raccolto aggregati per smielatura: kg attribuiti a QUESTA
+            # colonia + fioriture d'origine (M2M Smielatura.fioriture). È l'unità
+            # target del modello produzione miele per-colonia.
+            'smielature_eventi': _aggrega_smielature(
+                smielature_colonia, fioriture_per_smielatura,
+            ),
+            'alimentazioni': alimentazioni.get(cid, []),
+            'varroa': varroa.get(cid, []),
+            'trattamenti': trattamenti.get(cid, []),
+            'meteo_giornaliero': meteo.get(colonia.apiario_id, []),
+            'nomadismi': nomadismi.get(cid, []),
+            'fioriture': fioriture.get(colonia.apiario_id, []),
+            'regina': _regina_snapshot(regine.get(cid)),
+            'storia_regine': storia_regine.get(cid, []),
+        }
+    return datasets
+
+
+def _partition(rows, key):
+    """Split ``values()`` rows by ``key`` (popped from each row), keeping order."""
+    out = defaultdict(list)
+    for r in rows:
+        out[r.pop(key)].append(r)
+    return out
+
+
+def _regina_snapshot(regina):
     """Current queen summary: age (days) and user-rated swarming tendency."""
-    regina = Regina.objects.filter(colonia=colonia).first()
     if regina is None:
         return None
     eta_giorni = regina.get_eta_giorni()
@@ -177,7 +255,23 @@ def _has_storia_regine_fields():
     return {'data_inizio'}.issubset(field_names)
 
 
-def _aggrega_smielature(smielature_per_melario):
+def _fioriture_per_smielatura(smielatura_ids):
+    """``{smielatura_id: [fioritura_id, ...]}`` via the M2M through table."""
+    if not smielatura_ids:
+        return {}
+    out = defaultdict(list)
+    rows = (
+        Smielatura.fioriture.through.objects
+        .filter(smielatura_id__in=smielatura_ids)
+        .order_by('smielatura_id', '-fioritura__data_inizio')
+        .values_list('smielatura_id', 'fioritura_id')
+    )
+    for sid, fid in rows:
+        out[sid].append(fid)
+    return out
+
+
+def _aggrega_smielature(smielature_per_melario, fioriture_per_smielatura):
     """Aggrega le righe per-melario in eventi di raccolto (uno per smielatura).
 
     Somma ``kg_miele`` attribuiti ai melari della colonia e allega le fioriture
@@ -203,12 +297,6 @@ def _aggrega_smielature(smielature_per_melario):
     if not grouped:
         return []
 
-    fioriture_per_smielatura = {
-        sm.id: list(sm.fioriture.values_list('id', flat=True))
-        for sm in Smielatura.objects.filter(id__in=grouped.keys())
-        .prefetch_related('fioriture')
-    }
-
     eventi = []
     for sid, g in grouped.items():
         eventi.append({
@@ -10,8 +10,16 @@ separately by :func:`attach_swarm_labels`, never mixed into the features.
 
 Weekly resampling for the production model can be layered on top later; each row
 already carries its ISO ``(year, week)`` bucket.
+
+Lookups go through per-colony indexes (bisect over date-sorted series, merged
+treatment intervals), so each row costs O(log n + window) instead of a scan of
+the whole history, and :func:`extend_feature_frame` appends rows for new
+controls to a previously computed frame instead of rebuilding it.
+:func:`frame_digest` tells whether a stored frame is still valid for extension.
 """
 
+import hashlib
+from bisect import bisect_right
 from datetime import date, datetime, timedelta
 
 # Trailing window over which we accumulate growing-degree-days as a phenology proxy.
@@ -22,6 +30,9 @@ SWARM_SEASON_MONTHS = (4, 5, 6)
 AUTUMN_MONTHS = (9, 10, 11)
 # Trailing window over which we sum supplemental feeding (kg) as a stores proxy.
 FEEDING_WINDOW_DAYS = 60
+# Bump when the row layout or any feature definition changes: stored frames
+# computed by older code then fail :func:`frame_digest` and get rebuilt.
+FRAME_VERSION = 1
 
 
 def _as_date(v):
@@ -60,42 +71,111 @@ def colony_feature_frame(dataset):
     controlli = sorted(dataset.get('controlli', []), key=lambda c: _as_date(c['data']))
     if not controlli:
         return []
+    return _FeatureIndex(dataset).rows(controlli)
+
 
-    gdd_by_day = _gdd_by_day(dataset.get('meteo_giornaliero', []))
-    varroa_points = _varroa_points(dataset.get('varroa', []))
-    treatment_intervals = _treatment_intervals(dataset.get('trattamenti', []))
-    feeding_points = _feeding_points(dataset.get('alimentazioni', []))
+def extend_feature_frame(rows, dataset):
+    """Append rows for controls newer than the last row of ``rows``.
+
+    ``rows`` must be a frame previously computed for this colony whose inputs up
+    to its last date are unchanged (see :func:`frame_digest`); only the new
+    controls are featurised, chained to the last existing row. Returns a new
+    list; ``rows`` itself is not modified.
+    """
+    if not rows:
+        return colony_feature_frame(dataset)
+    last = rows[-1]
+    last_date = _as_date(last['data'])
+    seen = {r['controllo_id'] for r in rows}
+    nuovi = sorted(
+        (c for c in dataset.get('controlli', [])
+         if c.get('id') not in seen and _as_date(c['data']) >= last_date),
+        key=lambda c: _as_date(c['data']),
+    )
+    if not nuovi:
+        return list(rows)
+    return list(rows) + _FeatureIndex(dataset).rows(
+        nuovi, prev_date=last_date, prev_covata=last['telaini_covata'],
+    )
+
+
+def frame_digest(dataset, until):
+    """Fingerprint of every input that determines the frame rows dated <= ``until``.
+
+    Two datasets with the same digest yield identical rows up to ``until``, so a
+    frame stored together with its digest can be passed to
+    :func:`extend_feature_frame` as long as the current dataset still matches.
+    Inputs dated after ``until`` never enter those rows (features are causal).
+    """
+    cutoff = _as_date(until)
+    controlli = sorted(
+        (c for c in dataset.get('controlli', []) if _as_date(c['data']) <= cutoff),
+        key=lambda c: (_as_date(c['data']), c.get('id') or 0),
+    )
     regina = dataset.get('regina') or {}
-    q_birth = _as_date(regina.get('data_nascita'))
-    q_intro = _as_date(regina.get('data_introduzione'))
-    q_tendenza = regina.get('tendenza_sciamatura')
-    q_sospetta = bool(regina.get('sospetta_assente'))
-
-    rows = []
-    prev = None
-    for c in controlli:
-        d = _as_date(c['data'])
-        covata = _to_float(c.get('telaini_covata'))
+    parts = (
+        FRAME_VERSION,
+        [sorted(c.items()) for c in controlli],
+        [p for p in _gdd_points(dataset.get('meteo_giornaliero', [])) if p[0] <= cutoff],
+        [p for p in _varroa_points(dataset.get('varroa', [])) if p[0] <= cutoff],
+        [p for p in _feeding_points(dataset.get('alimentazioni', [])) if p[0] <= cutoff],
+        # Inverted intervals still count for days-since-treatment via their end.
+        [iv for iv in _treatment_intervals(dataset.get('trattamenti', []))
+         if min(iv) <= cutoff],
+        [_as_date(regina.get('data_nascita')), _as_date(regina.get('data_introduzione')),
+         regina.get('tendenza_sciamatura'), bool(regina.get('sospetta_assente'))],
+    )
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+class _FeatureIndex:
+    """Per-colony lookup structures, built once and shared by every row.
+
+    Trailing windows and latest-before lookups bisect date-sorted series and
+    treatment coverage queries a merged interval index, so each row costs
+    O(log n + window) instead of a scan of the whole history.
+    """
+
+    def __init__(self, dataset):
+        self.gdd = _DateSeries(_gdd_points(dataset.get('meteo_giornaliero', [])))
+        self.varroa = _DateSeries(_varroa_points(dataset.get('varroa', [])))
+        self.treatments = _IntervalIndex(_treatment_intervals(dataset.get('trattamenti', [])))
+        self.feeding = _DateSeries(_feeding_points(dataset.get('alimentazioni', [])))
+        regina = dataset.get('regina') or {}
+        self.q_birth = _as_date(regina.get('data_nascita'))
+        self.q_intro = _as_date(regina.get('data_introduzione'))
+        self.q_tendenza = regina.get('tendenza_sciamatura')
+        self.q_sospetta = bool(regina.get('sospetta_assente'))
+
+    def rows(self, controlli, prev_date=None, prev_covata=None):
+        """Feature rows for date-ordered ``controlli``, chained from ``prev_*``."""
+        out = []
+        for c in controlli:
+            d = _as_date(c['data'])
+            covata = _to_float(c.get('telaini_covata'))
+            out.append(self.row(c, d, covata, prev_date, prev_covata))
+            prev_date, prev_covata = d, covata
+        return out
+
+    def row(self, c, d, covata, prev_date, prev_covata):
         scorte = _to_float(c.get('telaini_scorte'))
 
         # Brood trend vs previous control (frames/day), causal.
         covata_delta = None
         covata_rate_day = None
         days_since_prev = None
-        if prev is not None:
-            pd = _as_date(prev['data'])
-            days_since_prev = (d - pd).days
-            pc = _to_float(prev.get('telaini_covata'))
-            if covata is not None and pc is not None:
-                covata_delta = covata - pc
+        if prev_date is not None:
+            days_since_prev = (d - prev_date).days
+            if covata is not None and prev_covata is not None:
+                covata_delta = covata - prev_covata
                 if days_since_prev and days_since_prev > 0:
                     covata_rate_day = covata_delta / days_since_prev
 
         # Queen age at the time of this control.
-        queen_age_days = (d - q_birth).days if q_birth else None
-        queen_days_in_colony = (d - q_intro).days if q_intro else None
+        queen_age_days = (d - self.q_birth).days if self.q_birth else None
+        queen_days_in_colony = (d - self.q_intro).days if self.q_intro else None
 
-        rows.append({
+        return {
             'controllo_id': c.get('id'),
             'data': d.isoformat(),
             'iso_year': d.isocalendar()[0],
@@ -120,22 +200,19 @@ def colony_feature_frame(dataset):
             'problemi_sanitari': bool(c.get('problemi_sanitari')),
             'queen_age_days': queen_age_days,
             'queen_days_in_colony': queen_days_in_colony,
-            'queen_tendenza_sciamatura': q_tendenza,
-            'queen_sospetta_assente': q_sospetta,
+            'queen_tendenza_sciamatura': self.q_tendenza,
+            'queen_sospetta_assente': self.q_sospetta,
 
             # ── Environment / health context ────────────────────────────────
-            'gdd_trailing': _trailing_gdd(gdd_by_day, d, GDD_WINDOW_DAYS),
-            'varroa_pct_latest': _latest_on_or_before(varroa_points, d),
-            'under_treatment': _is_within_any(treatment_intervals, d),
-            'days_since_treatment': _days_since_last_treatment(treatment_intervals, d),
-            'feeding_kg_trailing': _trailing_sum(feeding_points, d, FEEDING_WINDOW_DAYS),
+            'gdd_trailing': _trailing_gdd(self.gdd, d, GDD_WINDOW_DAYS),
+            'varroa_pct_latest': self.varroa.latest_on_or_before(d),
+            'under_treatment': self.treatments.covers(d),
+            'days_since_treatment': self.treatments.days_since_last_end(d),
+            'feeding_kg_trailing': _trailing_sum(self.feeding, d, FEEDING_WINDOW_DAYS),
 
             # Raw swarm flag for THIS control (used by label builder, not as feature).
             '_sciamatura': bool(c.get('sciamatura')) or bool(c.get('data_sciamatura')),
-        })
-        prev = c
-
-    return rows
+        }
 
 
 def latest_features(dataset, as_of=None):
@@ -164,7 +241,9 @@ def attach_swarm_labels(rows, horizon_days=28):
     for r in rows:
         d = _as_date(r['data'])
         window_end = d + timedelta(days=horizon_days)
-        positive = any(d < sd <= window_end for sd in swarm_dates)
+        # swarm_dates is date-ordered (rows are): first swarm strictly after d.
+        i = bisect_right(swarm_dates, d)
+        positive = i < len(swarm_dates) and swarm_dates[i] <= window_end
         censored = (not positive) and (window_end > last_date)
         r['swarm_within_horizon'] = positive
         r['label_censored'] = censored
@@ -225,6 +304,58 @@ def wintering_label(dataset, snapshot_date, window_days=180):
 
 # ── Internal helpers ─────────────────────────────────────────────────────────
 
+class _DateSeries:
+    """Date-ordered ``(date, value)`` points with bisect-based lookups."""
+
+    __slots__ = ('dates', 'values')
+
+    def __init__(self, points):
+        self.dates = [d for d, _ in points]
+        self.values = [v for _, v in points]
+
+    def __bool__(self):
+        return bool(self.dates)
+
+    def latest_on_or_before(self, ref_date):
+        i = bisect_right(self.dates, ref_date)
+        return self.values[i - 1] if i else None
+
+    def window(self, end_date, window_days):
+        """Values with ``end_date - window_days < d <= end_date``, in date order."""
+        lo = bisect_right(self.dates, end_date - timedelta(days=window_days))
+        hi = bisect_right(self.dates, end_date)
+        return self.values[lo:hi]
+
+
+class _IntervalIndex:
+    """Treatment intervals: merged for coverage, ends sorted for recency."""
+
+    __slots__ = ('starts', 'ends', 'sorted_ends')
+
+    def __init__(self, intervals):
+        merged = []
+        for s, e in sorted(intervals):
+            if e < s:
+                continue  # inverted interval: covers no date
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.starts = [m[0] for m in merged]
+        self.ends = [m[1] for m in merged]
+        self.sorted_ends = sorted(e for _, e in intervals)
+
+    def covers(self, ref_date):
+        i = bisect_right(self.starts, ref_date) - 1
+        return i >= 0 and ref_date <= self.ends[i]
+
+    def days_since_last_end(self, ref_date):
+        i = bisect_right(self.sorted_ends, ref_date)
+        if not i:
+            return None
+        return (ref_date - self.sorted_ends[i - 1]).days
+
+
 def _feeding_points(alimentazioni):
     pts = []
     for a in alimentazioni:
@@ -236,28 +367,28 @@ def _feeding_points(alimentazioni):
     return pts
 
 
-def _trailing_sum(points, end_date, window_days):
-    if not points:
+def _trailing_sum(series, end_date, window_days):
+    if not series:
         return 0.0
-    start = end_date - timedelta(days=window_days)
-    return round(sum(kg for d, kg in points if start < d <= end_date), 2)
+    # Slice-sum rather than prefix-sum differences: same addition order as a
+    # plain filtered sum, so rounded outputs stay bit-identical.
+    return round(sum(series.window(end_date, window_days)), 2)
+
 
-def _gdd_by_day(meteo):
-    out = {}
+def _gdd_points(meteo):
+    by_day = {}
     for m in meteo:
         d = _as_date(m.get('data'))
         gdd = _to_float(m.get('gdd_base10'))
         if d is not None and gdd is not None:
-            out[d] = gdd
-    return out
+            by_day[d] = gdd
+    return sorted(by_day.items())
 
 
-def _trailing_gdd(gdd_by_day, end_date, window_days):
-    if not gdd_by_day:
+def _trailing_gdd(series, end_date, window_days):
+    if not series:
         return None
-    start = end_date - timedelta(days=window_days)
-    total = sum(g for d, g in gdd_by_day.items() if start < d <= end_date)
-    return round(total, 1)
+    return round(sum(series.window(end_date, window_days)), 1)
 
 
 def _varroa_points(varroa):
@@ -271,16 +402,6 @@ def _varroa_points(varroa):
     return pts
 
 
-def _latest_on_or_before(points, ref_date):
-    val = None
-    for d, pct in points:
-        if d <= ref_date:
-            val = pct
-        else:
-            break
-    return val
-
-
 def _treatment_intervals(trattamenti):
     intervals = []
     for t in trattamenti:
@@ -290,14 +411,3 @@ def _treatment_intervals(trattamenti):
             intervals.append((start, end or start))
     intervals.sort(key=lambda x: x[0])
     return intervals
-
-
-def _is_within_any(intervals, ref_date):
-    return any(s <= ref_date <= e for s, e in intervals)
-
-
-def _days_since_last_treatment(intervals, ref_date):
-    ended = [e for s, e in intervals if e <= ref_date]
-    if not ended:
-        return None
-    return (ref_date - max(ended)).days
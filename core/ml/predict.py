@@ -2,14 +2,23 @@
 
 Single entry point shared by the REST endpoint and any management command, so
 the wiring (dataset -> features -> per-target models) lives in one place.
+
+``predict_colonie`` is the batch path (whole apiario / whole install): datasets
+are loaded in bulk via :func:`core.ml.dataset.build_colonia_datasets` and the
+pure-Python scoring can optionally fan out over a process pool.
 """
 
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 
-from core.ml.dataset import build_colonia_dataset
+from core.ml.dataset import build_colonia_dataset, build_colonia_datasets
 from core.ml.features import colony_feature_frame, select_autumn_snapshot
 from core.ml.models import swarm, wintering, production
 
+# Below this many colonies the pool start-up costs more than it saves.
+MIN_COLONIES_FOR_POOL = 8
+
 
 def predict_colonia(colonia, dataset=None):
     """Run every available predictive target for one colony.
@@ -20,8 +29,18 @@ def predict_colonia(colonia, dataset=None):
     """
     if dataset is None:
         dataset = build_colonia_dataset(colonia)
+    return predict_dataset(dataset)
+
+
+def predict_dataset(dataset, rows=None):
+    """Score an already-built dataset. Pure function: no ORM access.
 
-    rows = colony_feature_frame(dataset)
+    Kept free of database I/O so it can run inside a worker process. ``rows``
+    is the colony's feature frame when the caller already has it (e.g. extended
+    from a stored snapshot); otherwise it is built from ``dataset``.
+    """
+    if rows is None:
+        rows = colony_feature_frame(dataset)
     n_controls = len(rows)
     latest = rows[-1] if rows else None
     days_since = (
@@ -60,3 +79,56 @@ def predict_colonia(colonia, dataset=None):
             'honey_production': production_result,
         },
     }
+
+
+def predict_colonie(colonie, workers=None, frames=None):
+    """Score many colonies in one pass.
+
+    Parameters
+    ----------
+    colonie : iterable of core.models.Colonia
+        Already-fetched, access-checked colonies (``select_related('apiario')``).
+    workers : int, optional
+        Size of the process pool used for scoring. ``None``/``0``/``1`` scores
+        in-process; the pool is also skipped for fewer than
+        ``MIN_COLONIES_FOR_POOL`` colonies. Workers only run
+        :func:`predict_dataset`, so they never touch the database.
+    frames : callable, optional
+        ``frames(colonia, dataset) -> rows`` supplying each colony's feature
+        frame in-process before scoring (used by the snapshot cache to extend
+        stored frames). ``None`` builds every frame from scratch.
+
+    Returns
+    -------
+    tuple[list[dict], dict]
+        One :func:`predict_colonia`-shaped result per colony (input order) and
+        the per-stage timings in milliseconds (``dataset_ms``, ``predict_ms``,
+        ``total_ms``) plus the effective ``workers`` count.
+    """
+    colonie = list(colonie)
+    t_start = time.perf_counter()
+
+    datasets = build_colonia_datasets(colonie)
+    ordered = [datasets[c.id] for c in colonie]
+    frame_rows = (
+        [frames(c, ds) for c, ds in zip(colonie, ordered)] if frames
+        else [None] * len(ordered)
+    )
+    t_dataset = time.perf_counter()
+
+    use_pool = bool(workers) and workers > 1 and len(ordered) >= MIN_COLONIES_FOR_POOL
+    if use_pool:
+        chunksize = max(1, len(ordered) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(predict_dataset, ordered, frame_rows, chunksize=chunksize))
+    else:
+        results = [predict_dataset(ds, rows) for ds, rows in zip(ordered, frame_rows)]
+    t_predict = time.perf_counter()
+
+    timings = {
+        'dataset_ms': round((t_dataset - t_start) * 1000, 1),
+        'predict_ms': round((t_predict - t_dataset) * 1000, 1),
+        'total_ms': round((t_predict - t_start) * 1000, 1),
+        'workers': workers if use_pool else 1,
+    }
+    return results, timings
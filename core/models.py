@@ -1,4 +1,5 @@
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -114,6 +115,8 @@ class Apiario(models.Model):
         default='privato',
         help_text="Chi può visualizzare questo apiario sulla mappa"
     )
+    # Watermark per la sync incrementale dell'app mobile (core/sync.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.nome
@@ -126,6 +129,24 @@ class Apiario(models.Model):
         verbose_name = "Apiario"
         verbose_name_plural = "Apiari"
 
+# Campi scritti solo da core/ultimo_controllo.py: un save() completo di
+# un'istanza letta prima dell'ultimo controllo non deve sovrascriverli.
+CAMPI_ULTIMO_CONTROLLO = (
+    'ultimo_controllo', 'ultimo_controllo_data', 'ultimo_telaini_covata',
+    'ultimo_telaini_scorte', 'ultimo_presenza_regina', 'ultimo_problemi_sanitari',
+    'ultimo_sciamatura',
+)
+
+
+def _escludi_ultimo_controllo(instance, kwargs):
+    if not instance._state.adding and kwargs.get('update_fields') is None \
+            and not kwargs.get('force_insert'):
+        kwargs['update_fields'] = [
+            f.name for f in instance._meta.concrete_fields
+            if not f.primary_key and f.name not in CAMPI_ULTIMO_CONTROLLO
+        ]
+
+
 class Arnia(models.Model):
     COLORE_CHOICES = [
         ('bianco', 'Bianco'),
@@ -186,6 +207,20 @@ class Arnia(models.Model):
         max_length=50, blank=True, null=True, unique=True,
         help_text="ID del tag NFC associato (es. AA:BB:CC:DD)"
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # ── Ultimo controllo (denormalizzato, core/ultimo_controllo.py) ─────────
+    # Aggiornati dai signal su ControlloArnia: il più recente per data.
+    ultimo_controllo = models.ForeignKey(
+        'ControlloArnia', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', editable=False,
+    )
+    ultimo_controllo_data = models.DateField(null=True, blank=True, editable=False, db_index=True)
+    ultimo_telaini_covata = models.IntegerField(null=True, blank=True, editable=False)
+    ultimo_telaini_scorte = models.IntegerField(null=True, blank=True, editable=False)
+    ultimo_presenza_regina = models.BooleanField(null=True, blank=True, editable=False)
+    ultimo_problemi_sanitari = models.BooleanField(null=True, blank=True, editable=False)
+    ultimo_sciamatura = models.BooleanField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Arnia {self.numero} ({self.colore}) - {self.apiario.nome}"
@@ -203,6 +238,7 @@ class Arnia(models.Model):
         # Per 'altro' rispettiamo l'hex inviato dal client; fallback se mancante.
         elif self.colore == 'altro' and not self.colore_hex:
             self.colore_hex = self.COLORE_HEX['altro']
+        _escludi_ultimo_controllo(self, kwargs)
         super().save(*args, **kwargs)
 
     class Meta:
@@ -311,6 +347,19 @@ class Colonia(models.Model):
 
     data_creazione = models.DateTimeField(auto_now_add=True)
 
+    # ── Ultimo controllo (denormalizzato, core/ultimo_controllo.py) ─────────
+    # Aggiornati dai signal su ControlloArnia: il più recente della colonia, ovunque si trovasse.
+    ultimo_controllo = models.ForeignKey(
+        'ControlloArnia', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', editable=False,
+    )
+    ultimo_controllo_data = models.DateField(null=True, blank=True, editable=False, db_index=True)
+    ultimo_telaini_covata = models.IntegerField(null=True, blank=True, editable=False)
+    ultimo_telaini_scorte = models.IntegerField(null=True, blank=True, editable=False)
+    ultimo_presenza_regina = models.BooleanField(null=True, blank=True, editable=False)
+    ultimo_problemi_sanitari = models.BooleanField(null=True, blank=True, editable=False)
+    ultimo_sciamatura = models.BooleanField(null=True, blank=True, editable=False)
+
     # ── Helpers ──────────────────────────────────────────────────────────────
     def is_attiva(self):
         return self.stato == 'attiva' and self.data_fine is None
@@ -325,6 +374,10 @@ class Colonia(models.Model):
     def __str__(self):
         return f"Colonia {self.id} | {self.contenitore_display()} | {self.apiario.nome} | {self.get_stato_display()}"
 
+    def save(self, *args, **kwargs):
+        _escludi_ultimo_controllo(self, kwargs)
+        super().save(*args, **kwargs)
+
     def clean(self):
         from django.core.exceptions import ValidationError
         if self.arnia_id and self.nucleo_id:
@@ -399,6 +452,7 @@ class ControlloArnia(models.Model):
     regina_sostituita = models.BooleanField(default=False, help_text="La regina è stata sostituita durante questo controllo")
     sostituzione_scatola = models.BooleanField(default=False, help_text="La scatola (corpo nido) è stata sostituita")
     telaini_config = models.TextField(blank=True, null=True, help_text="JSON configuration of frame types and positions")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         if self.colonia:
@@ -476,7 +530,8 @@ class Regina(models.Model):
                                                       help_text="Resistenza alle malattie (1-5)")
     tendenza_sciamatura = models.PositiveSmallIntegerField(null=True, blank=True,
                                                       help_text="Tendenza alla sciamatura (1-5)")
-    
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
     def __str__(self):
         if self.colonia:
             return f"Regina Colonia {self.colonia_id} – {self.get_razza_display()}"
@@ -597,6 +652,7 @@ class Melario(models.Model):
     escludi_regina = models.BooleanField(default=True, help_text="Indica se è presente un escludiregina")
     peso_stimato = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True, help_text="Peso stimato in kg")
     note = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         if self.colonia:
@@ -707,6 +763,7 @@ class Smielatura(models.Model):
         default=False,
         help_text="Se True, la smielatura non appare più nelle viste attive.",
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Smielatura {self.data} - {self.apiario.nome} ({self.quantita_miele}kg)"
@@ -1037,7 +1094,7 @@ class Fioritura(models.Model):
     # Aggiunta del campo creatore per il sistema di permessi
     creatore = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='fioriture_create')
     data_creazione = models.DateTimeField(auto_now_add=True, null=True)
-    data_modifica = models.DateTimeField(auto_now=True, null=True)
+    data_modifica = models.DateTimeField(auto_now=True, null=True, db_index=True)
 
     # Campi social/community
     INTENSITA_CHOICES = [
@@ -1121,6 +1178,7 @@ class Pagamento(models.Model):
                   "e il pagamento viene escluso dal bilancio economico (resta però valido per "
                   "le quote di gruppo). Cancellando la spesa il pagamento sparisce con lei."
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Pagamento {self.utente.username} - {self.importo}€ ({self.data})"
@@ -1135,7 +1193,8 @@ class QuotaUtente(models.Model):
     percentuale = models.DecimalField(max_digits=5, decimal_places=2)  # Percentuale di partecipazione
     # Aggiungi questo campo
     gruppo = models.ForeignKey(Gruppo, on_delete=models.SET_NULL, null=True, blank=True, related_name='quote')
-    
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
     def __str__(self):
         return f"Quota {self.utente.username} - {self.percentuale}%"
     
@@ -1231,7 +1290,8 @@ class TrattamentoSanitario(models.Model):
                                    help_text="Metodo utilizzato per il blocco (es. ingabbiamento, rimozione regina)")
     note_blocco = models.TextField(blank=True, null=True, 
                                  help_text="Note sul blocco di covata")
-    
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
     def __str__(self):
         return f"{self.tipo_trattamento} - {self.apiario} ({self.data_inizio})"
     
@@ -1514,7 +1574,8 @@ def aggiorna_kg_trasferiti_smielatura(sender, instance, created, **kwargs):
     from decimal import Decimal
     from django.db.models import F
     Smielatura.objects.filter(pk=instance.smielatura_id).update(
-        kg_trasferiti=F('kg_trasferiti') + Decimal(instance.kg_attuali or 0)
+        kg_trasferiti=F('kg_trasferiti') + Decimal(instance.kg_attuali or 0),
+        updated_at=timezone.now(),
     )
 
 
@@ -1568,7 +1629,9 @@ def _ripristina_stato_origine(rows, motivo='ripristino_smielatura'):
         ).first()
         if m is None:
             continue
-        Melario.objects.filter(pk=row.melario_id).update(stato=row.stato_origine)
+        Melario.objects.filter(pk=row.melario_id).update(
+            stato=row.stato_origine, updated_at=timezone.now(),
+        )
         _registra_transizione_storico(
             row.melario_id, m['colonia_id'], m['posizione'],
             row.stato_origine, motivo,
@@ -1599,7 +1662,7 @@ def aggiorna_stato_melari_smielatura(sender, instance, action, pk_set, **kwargs)
                 smielatura=instance, melario_id=m['pk']
             ).update(stato_origine=m['stato'])
         # 2) Forza i melari a 'smielato' e logga la transizione storica.
-        Melario.objects.filter(pk__in=pk_set).update(stato='smielato')
+        Melario.objects.filter(pk__in=pk_set).update(stato='smielato', updated_at=timezone.now())
         for m in melari:
             if m['stato'] != 'smielato':
                 _registra_transizione_storico(
@@ -2221,6 +2284,15 @@ class AnalisiTelaino(models.Model):
     confidence_media = models.FloatField(default=0.0)
     note = models.TextField(blank=True, null=True)
     immagine = models.ImageField(upload_to='analisi_telaini/', blank=True, null=True)
+    # Derivati generati da core/immagini.py, con nomi dal contenuto (sha256)
+    miniatura = models.ImageField(upload_to='analisi_telaini/derivati/', blank=True, null=True,
+                                  help_text="Miniatura WebP per le liste")
+    miniatura_jpeg = models.ImageField(upload_to='analisi_telaini/derivati/', blank=True, null=True,
+                                       help_text="Miniatura JPEG per i client senza WebP")
+    immagine_annotata = models.ImageField(upload_to='analisi_telaini/derivati/', blank=True, null=True,
+                                          help_text="Immagine con i bounding box della detection")
+    hash_immagine = models.CharField(max_length=64, blank=True, default='',
+                                     help_text="sha256 dell'immagine da cui sono state generate le miniature")
     utente = models.ForeignKey(User, on_delete=models.CASCADE)
     data_registrazione = models.DateTimeField(auto_now_add=True)
 
@@ -2369,6 +2441,29 @@ class Notifica(models.Model):
         ]
 
 
+class ContatoreNotifiche(models.Model):
+    """
+    Notifiche non lette per utente, denormalizzato (core/notifications.py).
+
+    Il badge di ogni pagina e il polling dell'app leggono questa riga invece
+    di contare le Notifica. `versione` cambia a ogni notifica creata, letta o
+    eliminata e fa da chiave per l'elenco delle recenti in cache. Aggiornato
+    con F() dai signal su Notifica e da chi scrive con bulk_create / .update().
+    """
+    utente = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='contatore_notifiche',
+    )
+    non_lette = models.PositiveIntegerField(default=0)
+    versione = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.utente_id}: {self.non_lette} non lette"
+
+    class Meta:
+        verbose_name = 'Contatore notifiche'
+        verbose_name_plural = 'Contatori notifiche'
+
+
 # ── Varroa monitoring ───────────────────────────────────────────────────────
 
 class VarroaCheckpoint(models.Model):
@@ -2645,3 +2740,115 @@ class NomadismoEvent(models.Model):
             f"{self.apiario_origine_id or '—'} → {self.apiario_destinazione_id} "
             f"({self.data_spostamento})"
         )
+
+
+class SnapshotPredizioneColonia(models.Model):
+    """Ultimo output dei modelli predittivi per una colonia (cache persistente).
+
+    ``versione_dati`` viene incrementata dai signal (core/signals.py) ogni volta
+    che cambia un dato che entra nel dataset ML della colonia o del suo apiario.
+    Il payload è valido solo se è stato calcolato su quella stessa versione,
+    nello stesso giorno (le predizioni dipendono da "oggi") e con la stessa
+    versione dei modelli. Vedi core/ml/cache.py.
+    """
+    colonia = models.OneToOneField(
+        Colonia, on_delete=models.CASCADE, related_name='snapshot_predizione',
+    )
+    versione_dati = models.PositiveIntegerField(
+        default=0,
+        help_text="Contatore incrementato a ogni modifica dei dati della colonia/apiario",
+    )
+    versione_calcolata = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="versione_dati su cui è stato calcolato il payload (NULL = mai calcolato)",
+    )
+    versione_modelli = models.CharField(max_length=200, blank=True, default='')
+    data_riferimento = models.DateField(
+        null=True, blank=True,
+        help_text="Giorno in cui è stato calcolato il payload",
+    )
+    payload = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    righe = models.JSONField(
+        null=True, blank=True,
+        help_text="Feature frame (core.ml.features) da cui è stato calcolato il payload",
+    )
+    impronta_righe = models.CharField(
+        max_length=32, blank=True, default='',
+        help_text="frame_digest degli input fino all'ultima riga: se coincide, il frame si estende",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Snapshot predizioni colonia"
+        verbose_name_plural = "Snapshot predizioni colonie"
+
+    def __str__(self):
+        return f"Predizioni Colonia {self.colonia_id} (v{self.versione_dati})"
+
+
+class RecordEliminato(models.Model):
+    """
+    Tombstone per la sync incrementale dell'app mobile (core/sync.py).
+
+    Una riga per ogni oggetto sincronizzato cancellato, scritta dal signal
+    post_delete. Gli id di ambito (non FK: l'apiario può essere già sparito)
+    servono a consegnarla solo a chi vedeva l'oggetto. Le righe più vecchie
+    di SYNC_TOMBSTONE_DAYS vengono rimosse da `pulisci_record_eliminati`;
+    un client con cursore più vecchio riparte da una sync completa.
+    """
+    modello = models.CharField(max_length=30, help_text="Chiave della collezione di sync (es. 'controlli')")
+    oggetto_id = models.PositiveIntegerField()
+    apiario_id = models.PositiveIntegerField(null=True, blank=True)
+    utente_id = models.PositiveIntegerField(null=True, blank=True)
+    gruppo_id = models.PositiveIntegerField(null=True, blank=True)
+    data_eliminazione = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Record eliminato (sync)"
+        verbose_name_plural = "Record eliminati (sync)"
+        ordering = ['data_eliminazione', 'id']
+
+    def __str__(self):
+        return f"{self.modello} #{self.oggetto_id} eliminato il {self.data_eliminazione:%Y-%m-%d %H:%M}"
+
+
+class LavoroInCoda(models.Model):
+    """
+    Lavoro in background della coda su database (core/jobs.py).
+
+    Gli effetti collaterali lenti (fan-out delle broadcast, backfill meteo,
+    notifiche fioritura) vengono accodati qui dentro la transazione della
+    richiesta ed eseguiti dal worker `esegui_lavori`, con tentativi e backoff.
+    `chiave` evita di accodare due volte lo stesso lavoro ancora pendente.
+    """
+    STATO_CHOICES = [
+        ('in_attesa', 'In attesa'),
+        ('in_corso', 'In corso'),
+        ('completato', 'Completato'),
+        ('fallito', 'Fallito'),
+    ]
+
+    tipo = models.CharField(max_length=50, help_text="Nome del gestore registrato in core/jobs.py")
+    argomenti = models.JSONField(default=dict, blank=True)
+    chiave = models.CharField(max_length=100, blank=True, default='', db_index=True,
+                              help_text="Deduplica: un solo lavoro pendente per chiave")
+    stato = models.CharField(max_length=12, choices=STATO_CHOICES, default='in_attesa')
+    tentativi = models.PositiveSmallIntegerField(default=0)
+    max_tentativi = models.PositiveSmallIntegerField(default=5)
+    esegui_dopo = models.DateTimeField(default=timezone.now)
+    errore = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    data_creazione = models.DateTimeField(auto_now_add=True)
+    data_inizio = models.DateTimeField(null=True, blank=True)
+    data_fine = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Lavoro in coda"
+        verbose_name_plural = "Lavori in coda"
+        ordering = ['-data_creazione']
+        indexes = [
+            models.Index(fields=['stato', 'esegui_dopo'], name='core_lavoro_stato_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.get_stato_display()})"
@@ -1,9 +1,92 @@
 # core/notifications.py
 """
 Utility functions per creare notifiche nel sistema Apiary.
+
+Il riepilogo per utente (non lette + ultime notifiche) mostrato in ogni
+pagina e nel polling dell'app è letto da `riepilogo_notifiche` senza toccare
+la tabella Notifica: il conteggio viene dalla riga ContatoreNotifiche
+dell'utente e le recenti dalla cache, sotto la `versione` del contatore. I
+signal su Notifica aggiornano il contatore a ogni save/delete; chi scrive con
+bulk_create / .update() chiama `aggiorna_contatori` con le variazioni. Essendo
+nel database, il contatore è lo stesso per tutti i processi (web ed
+``esegui_lavori``) anche con una cache non condivisa.
 """
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.urls import reverse
 
+from .jobs import accoda, registra
+
+logger = logging.getLogger(__name__)
+
+# Notifiche recenti tenute nel riepilogo (la tendina ne mostra 8, il polling 10)
+RECENTI_RIEPILOGO = 10
+
+
+def _contatore(utente):
+    """Riga ContatoreNotifiche dell'utente, creata contando le non lette la
+    prima volta (utenti registrati dopo la migrazione)."""
+    from .models import ContatoreNotifiche, Notifica
+    contatore = ContatoreNotifiche.objects.filter(utente_id=utente.pk).first()
+    if contatore is None:
+        contatore, _ = ContatoreNotifiche.objects.get_or_create(
+            utente_id=utente.pk,
+            defaults={'non_lette': Notifica.objects.filter(utente=utente, letta=False).count()},
+        )
+    return contatore
+
+
+def riepilogo_notifiche(utente):
+    """``{'non_lette': int, 'recenti': [Notifica, ...]}`` dell'utente: una
+    query sul contatore, più una per le recenti se non sono in cache per la
+    versione corrente. Dentro una transazione le recenti non vanno in cache."""
+    from .models import Notifica
+    contatore = _contatore(utente)
+    chiave = f'notifiche:recenti:{utente.pk}:{contatore.versione}'
+    recenti = None if connection.in_atomic_block else cache.get(chiave)
+    if recenti is None:
+        recenti = list(
+            Notifica.objects.filter(utente=utente)
+            .select_related('mittente')
+            .order_by('-data_creazione')[:RECENTI_RIEPILOGO]
+        )
+        if not connection.in_atomic_block:
+            cache.set(chiave, recenti, settings.NOTIFICHE_CACHE_TTL)
+    return {'non_lette': contatore.non_lette, 'recenti': recenti}
+
+
+def aggiorna_contatori(variazioni):
+    """Applica ``{utente_id: variazione delle non lette}`` ai contatori e ne
+    cambia la versione (anche con variazione 0: le recenti sono cambiate).
+    Un'UPDATE con F() per ogni variazione distinta, a blocchi di
+    NOTIFICHE_BATCH_SIZE utenti; gli utenti ancora senza contatore lo
+    otterranno contato alla prima lettura."""
+    from .models import ContatoreNotifiche
+    per_variazione = defaultdict(list)
+    for utente_id, variazione in variazioni.items():
+        per_variazione[variazione].append(utente_id)
+    blocco = settings.NOTIFICHE_BATCH_SIZE
+    for variazione, utenti in per_variazione.items():
+        for i in range(0, len(utenti), blocco):
+            ContatoreNotifiche.objects.filter(utente_id__in=utenti[i:i + blocco]).update(
+                non_lette=Greatest(F('non_lette') + variazione, 0),
+                versione=F('versione') + 1,
+            )
+
+
+def nuove_non_lette(notifiche):
+    """Variazioni per `aggiorna_contatori` dopo il bulk_create di `notifiche`."""
+    variazioni = defaultdict(int)
+    for n in notifiche:
+        variazioni[n.utente_id] += 0 if n.letta else 1
+    return variazioni
+
 
 def crea_notifica(utente, tipo, titolo, messaggio, mittente=None, link=None, priorita='media'):
     """Crea una notifica per un utente. Import lazy per evitare circular imports."""
@@ -108,32 +191,91 @@ def notifica_membro_aggiunto(membro):
         )
 
 
-def notifica_fioritura_vicina(fioritura, apiari_vicini):
+def notifica_fioritura_vicina(fioritura, apiari_vicini=None, raggio_km=None):
     """
     Notifica ai proprietari degli apiari vicini di una nuova fioritura.
-    apiari_vicini: queryset di Apiario con i relativi proprietari.
+    apiari_vicini: queryset o lista di Apiario; se None, gli apiari entro
+    `raggio_km` dall'indice spaziale (vedi :func:`apiari_vicini_fioritura`).
+
+    Una notifica per proprietario (con il nome del primo apiario, il più vicino
+    se presi dall'indice), escluso chi ha segnalato la fioritura. I proprietari
+    sono risolti con una sola query e le Notifica inserite con bulk_create.
+    Restituisce il numero di notifiche create.
     """
+    from django.db.models import QuerySet
+    from .models import Notifica
+
+    if apiari_vicini is None:
+        apiari_vicini = apiari_vicini_fioritura(fioritura, raggio_km)
+    if isinstance(apiari_vicini, QuerySet):
+        righe = apiari_vicini.values_list('id', 'proprietario_id', 'nome')
+    else:
+        righe = [(a.id, a.proprietario_id, a.nome) for a in apiari_vicini]
+
     try:
         link = reverse('calendario')
     except Exception:
         link = None
 
-    notificati = set()
-    for apiario in apiari_vicini:
-        proprietario = apiario.proprietario
-        if proprietario.id in notificati:
+    periodo = (
+        f"{fioritura.data_inizio.strftime('%d/%m/%Y')} — "
+        f"{fioritura.data_fine.strftime('%d/%m/%Y') if fioritura.data_fine else 'in corso'}"
+    )
+    notificati = {fioritura.creatore_id}
+    notifiche = []
+    for _, proprietario_id, nome_apiario in righe:
+        if proprietario_id in notificati:
             continue
-        notificati.add(proprietario.id)
-        crea_notifica(
-            utente=proprietario,
+        notificati.add(proprietario_id)
+        notifiche.append(Notifica(
+            utente_id=proprietario_id,
             tipo='fioritura_vicina',
-            titolo=f"Fioritura vicina: {fioritura.nome}",
+            titolo=f"Fioritura vicina: {fioritura.pianta}",
             messaggio=(
-                f"È stata segnalata una fioritura di «{fioritura.nome}» "
-                f"vicino al tuo apiario «{apiario.nome}». "
-                f"Periodo: {fioritura.data_inizio.strftime('%d/%m/%Y')} — "
-                f"{fioritura.data_fine.strftime('%d/%m/%Y') if fioritura.data_fine else 'in corso'}."
+                f"È stata segnalata una fioritura di «{fioritura.pianta}» "
+                f"vicino al tuo apiario «{nome_apiario}». "
+                f"Periodo: {periodo}."
             ),
+            mittente_id=fioritura.creatore_id,
             link=link,
             priorita='media',
-        )
+        ))
+    Notifica.objects.bulk_create(notifiche, batch_size=settings.NOTIFICHE_BATCH_SIZE)
+    aggiorna_contatori(nuove_non_lette(notifiche))
+    return len(notifiche)
+
+
+def apiari_vicini_fioritura(fioritura, raggio_km=None):
+    """Apiari entro `raggio_km` (default FIORITURA_NOTIFICA_RAGGIO_KM) dalla
+    fioritura, dal più vicino; nessuno se la fioritura non ha coordinate."""
+    if not fioritura.has_coordinates():
+        return []
+    from .geo import apiari_vicini
+    return apiari_vicini(
+        fioritura.latitudine, fioritura.longitudine,
+        raggio_km or settings.FIORITURA_NOTIFICA_RAGGIO_KM,
+    )
+
+
+@registra('fioritura_vicina', max_tentativi=3)
+def notifica_fioritura_vicina_job(fioritura_id):
+    """Gestore della coda lavori: fan-out in una transazione (nessuna
+    notifica a metà se un tentativo fallisce).
+
+    Gli apiari vicini si leggono prima della transazione: dentro, l'indice
+    spaziale verrebbe ricostruito a ogni chiamata (core/geo.py).
+    """
+    from django.db import transaction
+    from .models import Fioritura
+    fioritura = Fioritura.objects.filter(pk=fioritura_id).first()
+    if fioritura is None:
+        return
+    vicini = apiari_vicini_fioritura(fioritura)
+    with transaction.atomic():
+        n = notifica_fioritura_vicina(fioritura, vicini)
+    logger.info("Fioritura %s → notificati %s apicoltori vicini", fioritura_id, n)
+
+
+def notifica_fioritura_vicina_differita(fioritura_id):
+    """Accoda il fan-out (core/jobs.py): la response non lo aspetta."""
+    accoda('fioritura_vicina', chiave=f'fioritura_vicina:{fioritura_id}', fioritura_id=fioritura_id)
@@ -0,0 +1,293 @@
+"""Pool di sessioni ONNX Runtime per il bee detector (core/ai_views.py).
+
+Al posto di una sola ``InferenceSession`` globale creata dalla prima
+richiesta, un pool limitato di ONNX_POOL_SIZE sessioni configurate da
+settings:
+
+  * thread intra/inter-op (ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS,
+    0 = default di ONNX Runtime) e livello di ottimizzazione del grafo
+    (ONNX_GRAPH_OPTIMIZATION: disable | basic | extended | all);
+  * coda con contropressione: le richieste aspettano una sessione libera al
+    massimo ONNX_POOL_TIMEOUT secondi, e oltre ONNX_POOL_MAX_WAITING richieste
+    in attesa le nuove falliscono subito con :class:`PoolSaturo` (HTTP 503);
+  * ONNX_SHARED_MODEL: le sessioni condividono i pesi. Il modello in formato
+    ORT (stesso nome, estensione ``.ort``) è letto una volta per processo e
+    ogni sessione è creata sullo stesso buffer con
+    ``session.use_ort_model_bytes_directly`` e
+    ``session.use_ort_model_bytes_for_initializers``, così gli initializer
+    puntano a quei byte invece di essere copiati. Senza il file ``.ort`` le
+    sessioni si caricano dal file ONNX, ognuna con i propri pesi;
+  * warm-up: :func:`riscalda` crea le sessioni ed esegue un tensore di zeri
+    su ognuna, così la prima analisi non paga caricamento e allocazioni. Le
+    sessioni già in uso sono saltate, senza attese né :class:`PoolSaturo`.
+    Con ONNX_WARMUP è chiamato in background all'avvio del worker WSGI;
+  * metriche di latenza per inferenza (:func:`metriche`).
+
+    from core.onnx_pool import pool_onnx
+    with pool_onnx().sessione() as sess:
+        outputs = sess.run(None, {input_name: tensor})
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_LIVELLI_OTTIMIZZAZIONE = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+
+
+class ModelloNonDisponibile(Exception):
+    """onnxruntime non installato, modello mancante o non caricabile."""
+
+
+class PoolSaturo(Exception):
+    """Troppe inferenze in attesa: la richiesta va ritentata più tardi."""
+
+
+class _Metriche:
+    """Latenze delle ultime inferenze e contatori, thread-safe."""
+
+    def __init__(self, finestra=500):
+        self._lock = threading.Lock()
+        self._latenze = deque(maxlen=finestra)
+        self._attese = deque(maxlen=finestra)
+        self.inferenze = 0
+        self.rifiutate = 0
+
+    def registra(self, attesa_s, durata_s):
+        with self._lock:
+            self.inferenze += 1
+            self._attese.append(attesa_s * 1000)
+            self._latenze.append(durata_s * 1000)
+
+    def rifiuto(self):
+        with self._lock:
+            self.rifiutate += 1
+
+    @staticmethod
+    def _percentile(valori, p):
+        if not valori:
+            return None
+        ordinati = sorted(valori)
+        return round(ordinati[min(len(ordinati) - 1, int(len(ordinati) * p))], 1)
+
+    def riepilogo(self):
+        with self._lock:
+            latenze, attese = list(self._latenze), list(self._attese)
+            return {
+                'inferenze': self.inferenze,
+                'rifiutate': self.rifiutate,
+                'latenza_ms_p50': self._percentile(latenze, 0.50),
+                'latenza_ms_p95': self._percentile(latenze, 0.95),
+                'latenza_ms_max': round(max(latenze), 1) if latenze else None,
+                'attesa_ms_p95': self._percentile(attese, 0.95),
+            }
+
+
+class SessionPool:
+    """Al più `dimensione` sessioni, create alla prima necessità e riusate."""
+
+    def __init__(self, model_path, dimensione=1, max_attesa=8, timeout=10.0):
+        self.model_path = model_path
+        self.dimensione = max(1, dimensione)
+        self.max_attesa = max_attesa
+        self.timeout = timeout
+        self.metriche = _Metriche()
+        self._cond = threading.Condition()
+        self._libere = []
+        self._create = 0
+        self._in_attesa = 0
+        self._modello = None  # buffer ORT condiviso (ONNX_SHARED_MODEL)
+        self._avviso_ort = False
+
+    # ── Creazione sessioni ────────────────────────────────────────────────
+
+    def _opzioni(self, ort):
+        opzioni = ort.SessionOptions()
+        intra = getattr(settings, 'ONNX_INTRA_OP_THREADS', 0)
+        inter = getattr(settings, 'ONNX_INTER_OP_THREADS', 0)
+        if intra:
+            opzioni.intra_op_num_threads = intra
+        if inter:
+            opzioni.inter_op_num_threads = inter
+            opzioni.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        livello = _LIVELLI_OTTIMIZZAZIONE.get(
+            getattr(settings, 'ONNX_GRAPH_OPTIMIZATION', 'all'), 'ORT_ENABLE_ALL',
+        )
+        opzioni.graph_optimization_level = getattr(ort.GraphOptimizationLevel, livello)
+        return opzioni
+
+    def _sorgente_modello(self, opzioni):
+        """Percorso del file ONNX, o il buffer ORT condiviso con ONNX_SHARED_MODEL."""
+        if not getattr(settings, 'ONNX_SHARED_MODEL', False):
+            return self.model_path
+        percorso_ort = os.path.splitext(self.model_path)[0] + '.ort'
+        if not os.path.exists(percorso_ort):
+            if not self._avviso_ort:
+                self._avviso_ort = True
+                logger.warning(
+                    'ONNX_SHARED_MODEL senza %s: pesi non condivisi tra le sessioni', percorso_ort)
+            return self.model_path
+        with self._cond:
+            if self._modello is None:
+                with open(percorso_ort, 'rb') as f:
+                    self._modello = f.read()
+        # Il buffer resta vivo quanto il pool: le sessioni ci puntano direttamente
+        opzioni.add_session_config_entry('session.use_ort_model_bytes_directly', '1')
+        opzioni.add_session_config_entry('session.use_ort_model_bytes_for_initializers', '1')
+        return self._modello
+
+    def _crea_sessione(self):
+        if not self.model_path or not os.path.exists(self.model_path):
+            raise ModelloNonDisponibile(f'Modello ONNX non trovato: {self.model_path}')
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ModelloNonDisponibile('onnxruntime non installato (pip install onnxruntime)')
+        try:
+            opzioni = self._opzioni(ort)
+            return ort.InferenceSession(
+                self._sorgente_modello(opzioni), sess_options=opzioni,
+                providers=['CPUExecutionProvider'],
+            )
+        except Exception as e:
+            raise ModelloNonDisponibile(str(e))
+
+    # ── Prestito ─────────────────────────────────────────────────────────
+
+    def _prendi(self):
+        scadenza = time.monotonic() + self.timeout
+        with self._cond:
+            if not self._libere and self._create >= self.dimensione:
+                if self._in_attesa >= self.max_attesa:
+                    self.metriche.rifiuto()
+                    raise PoolSaturo('Troppe analisi in corso, riprova tra poco')
+                self._in_attesa += 1
+                try:
+                    while not self._libere and self._create >= self.dimensione:
+                        rimanente = scadenza - time.monotonic()
+                        if rimanente <= 0 or not self._cond.wait(rimanente):
+                            if not self._libere and self._create >= self.dimensione:
+                                self.metriche.rifiuto()
+                                raise PoolSaturo('Nessuna sessione libera entro il timeout')
+                finally:
+                    self._in_attesa -= 1
+            if self._libere:
+                return self._libere.pop()
+            self._create += 1
+        return self._nuova_sessione()
+
+    def _prendi_se_libera(self):
+        """Una sessione libera o creabile subito, altrimenti None (mai in attesa)."""
+        with self._cond:
+            if self._libere:
+                return self._libere.pop()
+            if self._create >= self.dimensione:
+                return None
+            self._create += 1
+        return self._nuova_sessione()
+
+    def _nuova_sessione(self):
+        # Creazione fuori dal lock: può richiedere secondi
+        try:
+            return self._crea_sessione()
+        except Exception:
+            with self._cond:
+                self._create -= 1
+                self._cond.notify()
+            raise
+
+    def _restituisci(self, sess):
+        with self._cond:
+            self._libere.append(sess)
+            self._cond.notify()
+
+    @contextmanager
+    def sessione(self):
+        """Presta una sessione; registra attesa e durata dell'uso."""
+        inizio = time.perf_counter()
+        sess = self._prendi()
+        preso = time.perf_counter()
+        try:
+            yield sess
+        finally:
+            self._restituisci(sess)
+            self.metriche.registra(preso - inizio, time.perf_counter() - preso)
+
+    def riscalda(self):
+        """Crea le sessioni mancanti ed esegue un tensore di zeri su quelle libere.
+
+        Le sessioni prestate in quel momento sono saltate: il warm-up non
+        aspetta le richieste in corso e non conta come rifiuto.
+        """
+        import numpy as np
+        sessioni = []
+        try:
+            for _ in range(self.dimensione):
+                sess = self._prendi_se_libera()
+                if sess is None:
+                    break
+                sessioni.append(sess)
+            for sess in sessioni:
+                ingresso = sess.get_inputs()[0]
+                forma = [d if isinstance(d, int) and d > 0 else 1 for d in ingresso.shape]
+                # Assi spaziali dinamici: la dimensione usata dall'analisi
+                forma[2:] = [d if d > 1 else 640 for d in forma[2:]]
+                inizio = time.perf_counter()
+                sess.run(None, {ingresso.name: np.zeros(forma, dtype=np.float32)})
+                logger.info('Warm-up sessione ONNX: %.0f ms', (time.perf_counter() - inizio) * 1000)
+        finally:
+            for sess in sessioni:
+                self._restituisci(sess)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_onnx():
+    """Il pool del processo, configurato da settings alla prima chiamata."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SessionPool(
+                    getattr(settings, 'ONNX_MODEL_PATH', ''),
+                    dimensione=getattr(settings, 'ONNX_POOL_SIZE', 1),
+                    max_attesa=getattr(settings, 'ONNX_POOL_MAX_WAITING', 8),
+                    timeout=getattr(settings, 'ONNX_POOL_TIMEOUT', 10.0),
+                )
+    return _pool
+
+
+def metriche():
+    """Latenze e contatori delle inferenze di questo processo."""
+    pool = pool_onnx()
+    riepilogo = pool.metriche.riepilogo()
+    riepilogo.update(sessioni=pool._create, in_attesa=pool._in_attesa)
+    return riepilogo
+
+
+def riscalda(in_background=False):
+    """Warm-up del pool; gli errori (modello assente, ...) sono solo loggati."""
+    def esegui():
+        try:
+            pool_onnx().riscalda()
+        except Exception as e:
+            logger.warning('Warm-up ONNX non eseguito: %s', e)
+
+    if in_background:
+        threading.Thread(target=esegui, name='onnx-warmup', daemon=True).start()
+    else:
+        esegui()
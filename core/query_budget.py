@@ -0,0 +1,167 @@
+"""Conteggio query per endpoint e rilevamento N+1 per la REST API.
+
+Due punti d'ingresso sullo stesso registratore (:class:`QueryRecorder`, basato
+su ``connection.execute_wrapper``, quindi attivo anche con DEBUG=False):
+
+  * :class:`QueryBudgetMiddleware` — con QUERY_BUDGET_ENABLED registra ogni
+    richiesta, aggiunge gli header ``X-Query-Count`` / ``X-Query-Time-ms`` e
+    logga un warning quando l'endpoint supera il budget dichiarato o ripete la
+    stessa forma di query più di QUERY_BUDGET_REPEAT_THRESHOLD volte (tipico
+    N+1 da ``SerializerMethodField``). Con QUERY_BUDGET_STRICT il superamento
+    solleva :class:`QueryBudgetExceeded` (per sviluppo e test).
+  * :func:`assert_query_budget` — context manager per i test.
+
+Il budget si dichiara sul viewset, per azione::
+
+    class FiorituraViewSet(viewsets.ModelViewSet):
+        query_budget = {'list': 6, 'retrieve': 5}
+
+``'*'`` vale per le azioni non elencate. Le viste a funzione possono usare
+l'attributo ``query_budget`` (int) sulla funzione decorata da ``@api_view``.
+
+Esempio in un test::
+
+    with assert_query_budget(8, max_repeats=2):
+        client.get('/api/v1/fioriture/')
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    """Forma della query: parametri e liste IN collassati, per contare le ripetizioni."""
+    sql = _IN_LIST.sub('(%s...)', sql)
+    return _NUMBER.sub('N', sql)
+
+
+class QueryRecorder:
+    """Registra le query eseguite su tutte le connessioni mentre è attivo."""
+
+    def __init__(self):
+        self.queries = []  # (sql, durata in secondi)
+        self._contexts = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __enter__(self):
+        for alias in connections:
+            ctx = connections[alias].execute_wrapper(self)
+            ctx.__enter__()
+            self._contexts.append(ctx)
+        return self
+
+    def __exit__(self, *exc):
+        while self._contexts:
+            self._contexts.pop().__exit__(*exc)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration_ms(self):
+        return round(sum(d for _, d in self.queries) * 1000, 1)
+
+    def repeated(self, threshold):
+        """Forme eseguite più di `threshold` volte: ``[(forma, volte), ...]``."""
+        counts = Counter(query_shape(sql) for sql, _ in self.queries)
+        return [(shape, n) for shape, n in counts.most_common() if n > threshold]
+
+    def report(self, threshold=1, limit=5):
+        righe = [f'{self.count} query in {self.duration_ms} ms']
+        for shape, n in self.repeated(threshold)[:limit]:
+            righe.append(f'  {n}x {shape[:200]}')
+        return '\n'.join(righe)
+
+
+@contextmanager
+def assert_query_budget(max_queries, max_repeats=None):
+    """Fallisce (AssertionError) se il blocco supera `max_queries` query o
+    ripete una stessa forma più di `max_repeats` volte."""
+    recorder = QueryRecorder()
+    with recorder:
+        yield recorder
+    if recorder.count > max_queries:
+        raise AssertionError(f'Budget di {max_queries} query superato: {recorder.report()}')
+    if max_repeats is not None and recorder.repeated(max_repeats):
+        raise AssertionError(
+            f'Query ripetute più di {max_repeats} volte (N+1?): {recorder.report(max_repeats)}'
+        )
+
+
+def endpoint_budget(request):
+    """(nome endpoint, budget dichiarato o None) per la richiesta risolta."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.path, None
+    func = match.func
+    cls = getattr(func, 'cls', None)
+    actions = getattr(func, 'actions', None)
+    if cls is not None and actions:
+        action = actions.get(request.method.lower(), request.method.lower())
+        budget = getattr(cls, 'query_budget', None) or {}
+        return f'{cls.__name__}.{action}', budget.get(action, budget.get('*'))
+    budget = getattr(func, 'query_budget', None)
+    return match.view_name or request.path, budget if isinstance(budget, int) else None
+
+
+class QueryBudgetMiddleware:
+    """Misura query e tempo DB per richiesta e segnala budget superati e N+1."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Letti a ogni richiesta: i test possono usare override_settings
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            return self.get_response(request)
+        strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        threshold = getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 5)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        # Le risposte in streaming eseguono query dopo questo punto: il
+        # conteggio sarebbe parziale.
+        if getattr(response, 'streaming', False):
+            return response
+
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Time-ms'] = str(recorder.duration_ms)
+
+        endpoint, budget = endpoint_budget(request)
+        problemi = []
+        if budget is not None and recorder.count > budget:
+            problemi.append(f'budget {budget} superato')
+        if recorder.repeated(threshold):
+            problemi.append('query ripetute (N+1?)')
+        if problemi:
+            messaggio = (
+                f'{request.method} {endpoint}: {", ".join(problemi)} — '
+                f'{recorder.report(threshold)}'
+            )
+            if strict and budget is not None and recorder.count > budget:
+                raise QueryBudgetExceeded(messaggio)
+            logger.warning(messaggio)
+        return response
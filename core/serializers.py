@@ -5,6 +5,8 @@ import math
 from rest_framework import serializers
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.db.models import Avg, Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from .models import (
     Apiario, Arnia, Colonia, Nucleo, ControlloNucleo, ControlloArnia,
     Regina, StoriaRegine, Fioritura, FiorituraConferma,
@@ -403,6 +405,30 @@ class ReginaGenealogySerializer(serializers.ModelSerializer):
 
 
 # Serializzatore Fioritura
+def annota_fioriture(queryset, user=None):
+    """Aggiunge a un queryset di Fioritura i valori letti da FiorituraSerializer.
+
+    `n_conferme`, `intensita_media_raw` e `confermato_da_me` arrivano come
+    subquery correlate: una lista costa una query qualunque sia la sua
+    lunghezza, e le subquery non alterano join/DISTINCT del queryset.
+    """
+    conferme = FiorituraConferma.objects.filter(fioritura=OuterRef('pk')).order_by().values('fioritura')
+    queryset = queryset.select_related('apiario', 'creatore').annotate(
+        n_conferme=Coalesce(
+            Subquery(conferme.annotate(n=Count('pk')).values('n'), output_field=IntegerField()),
+            Value(0),
+        ),
+        intensita_media_raw=Subquery(
+            conferme.filter(intensita__isnull=False).annotate(media=Avg('intensita')).values('media'),
+        ),
+    )
+    if user is not None and user.is_authenticated:
+        queryset = queryset.annotate(
+            confermato_da_me=Exists(FiorituraConferma.objects.filter(fioritura=OuterRef('pk'), utente=user)),
+        )
+    return queryset
+
+
 class FiorituraSerializer(serializers.ModelSerializer):
     apiario_nome = serializers.ReadOnlyField(source='apiario.nome')
     creatore_username = serializers.ReadOnlyField(source='creatore.username')
@@ -425,19 +451,26 @@ class FiorituraSerializer(serializers.ModelSerializer):
     def get_is_active(self, obj):
         return obj.is_active()
 
+    # I tre valori seguenti vengono da annota_fioriture() quando il queryset
+    # è annotato; altrimenti (singolo oggetto) si interroga il database.
+
     def get_n_conferme(self, obj):
+        if hasattr(obj, 'n_conferme'):
+            return obj.n_conferme
         return obj.conferme.count()
 
     def get_intensita_media(self, obj):
-        conferme = obj.conferme.filter(intensita__isnull=False)
-        if not conferme.exists():
-            return None
-        total = sum(c.intensita for c in conferme)
-        return round(total / conferme.count(), 1)
+        if hasattr(obj, 'intensita_media_raw'):
+            media = obj.intensita_media_raw
+        else:
+            media = obj.conferme.filter(intensita__isnull=False).aggregate(media=Avg('intensita'))['media']
+        return round(media, 1) if media is not None else None
 
     def get_confermato_da_me(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'confermato_da_me'):
+                return obj.confermato_da_me
             return obj.conferme.filter(utente=request.user).exists()
         return False
 
@@ -1065,9 +1098,11 @@ class AnalisiTelainoSerializer(serializers.ModelSerializer):
             'id', 'arnia', 'arnia_numero', 'colonia', 'numero_telaino', 'facciata',
             'data', 'conteggio_api', 'conteggio_regine', 'conteggio_fuchi',
             'conteggio_celle_reali', 'confidence_media', 'note', 'immagine',
+            'miniatura', 'miniatura_jpeg', 'immagine_annotata',
             'utente', 'utente_username', 'data_registrazione'
         ]
-        read_only_fields = ['utente', 'data', 'data_registrazione']
+        read_only_fields = ['utente', 'data', 'data_registrazione',
+                            'miniatura', 'miniatura_jpeg', 'immagine_annotata']
 
     def create(self, validated_data):
         validated_data['utente'] = self.context['request'].user
@@ -1344,6 +1379,39 @@ class VarroaCheckpointSerializer(serializers.ModelSerializer):
         return data
 
 
+class TrattamentoIpoteticoSerializer(serializers.Serializer):
+    """Trattamento ipotetico di uno scenario di simulazione Varroa."""
+    tipo_trattamento = serializers.IntegerField(help_text="id TipoTrattamento")
+    data_inizio      = serializers.DateField()
+    blocco_covata    = serializers.BooleanField(default=False)
+
+
+class ScenarioVarroaSerializer(serializers.Serializer):
+    nome        = serializers.CharField(required=False, allow_blank=True, max_length=100)
+    trattamenti = TrattamentoIpoteticoSerializer(many=True, allow_empty=True)
+
+
+class SimulazioneVarroaSerializer(serializers.Serializer):
+    """
+    Payload per POST /varroa-checkpoints/simula/
+    Confronta più calendari di trattamento ipotetici sulla stessa colonia.
+    """
+    MAX_SCENARI = 100
+
+    colonia_id           = serializers.IntegerField()
+    days_ahead           = serializers.IntegerField(default=120, min_value=1, max_value=365)
+    mantieni_trattamenti = serializers.BooleanField(
+        default=True,
+        help_text="Applica gli scenari in aggiunta ai trattamenti già registrati",
+    )
+    scenari = ScenarioVarroaSerializer(many=True, allow_empty=False)
+
+    def validate_scenari(self, value):
+        if len(value) > self.MAX_SCENARI:
+            raise serializers.ValidationError(f"Massimo {self.MAX_SCENARI} scenari per richiesta.")
+        return value
+
+
 # ── Serializzatori ML: pesate / alimentazione / nomadismo ───────────────────
 
 class SmielaturaMelarioSerializer(serializers.ModelSerializer):
@@ -4,26 +4,55 @@ Signal handlers per il modulo core.
 
 Contenuto:
   - backfill leggero del dataset MeteoGiornaliero quando un Apiario viene creato
-    con coordinate (o quando le coordinate vengono settate per la prima volta).
+    con coordinate (o quando le coordinate vengono settate per la prima volta),
+    accodato ed eseguito dal worker della coda lavori (core/jobs.py).
     Il backfill completo è demandato al cron quotidiano
     `aggiorna_meteo_giornaliero` o al management command
     `backfill_meteo_giornaliero`.
-  - fan-out delle AdminBroadcast pubblicate verso le Notifica per utente.
+  - fan-out delle AdminBroadcast pubblicate verso le Notifica per utente
+    (anch'esso tramite la coda lavori) e contatore per utente delle
+    notifiche non lette (ContatoreNotifiche, core/notifications.py).
   - creazione/sincronizzazione del Pagamento collegato a una SpesaAttrezzatura.
+  - invalidazione degli snapshot delle predizioni ML (core/ml/cache.py) quando
+    cambia un dato che entra nel dataset di una colonia o del suo apiario.
+  - tombstone (RecordEliminato) e aggiornamento di `updated_at` sulle modifiche
+    M2M per la sync incrementale dell'app mobile (core/sync.py).
+  - invalidazione della cache degli apiari accessibili (core/accesso.py).
+  - notifiche "fioritura vicina" agli apicoltori alla creazione di una
+    fioritura pubblica (core/notifications.py).
+  - miniature delle immagini delle analisi telaino (core/immagini.py),
+    accodate quando l'immagine cambia.
+  - invalidazione degli aggregati della dashboard (core/dashboard.py) per
+    apiario quando cambiano controlli, smielature o arnie.
+  - ultimo controllo denormalizzato su Arnia e Colonia
+    (core/ultimo_controllo.py).
 """
 
 from __future__ import annotations
 
 import logging
-import threading
 from datetime import date, timedelta
 from decimal import Decimal
 
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.html import strip_tags
 
-from .models import Apiario, AdminBroadcast, Notifica, Pagamento, SpesaAttrezzatura
+from .models import (
+    Apiario, AdminBroadcast, Notifica, Pagamento, SpesaAttrezzatura,
+    Colonia, ControlloArnia, VarroaCheckpoint, TrattamentoSanitario, PesataMelario,
+    Alimentazione, NomadismoEvent, Regina, StoriaRegine, MeteoGiornaliero, Fioritura,
+    Smielatura, SmielaturaMelario, Arnia, Melario, QuotaUtente, RecordEliminato,
+    MembroGruppo, AnalisiTelaino,
+)
+from . import immagini  # noqa: F401  (registra il gestore 'derivati_analisi')
+from .dashboard import invalida_dashboard
+from .jobs import accoda, registra
+from .notifications import aggiorna_contatori, notifica_fioritura_vicina_differita, nuove_non_lette
+from .ultimo_controllo import aggiorna_ultimo_controllo
 
 
 logger = logging.getLogger(__name__)
@@ -33,33 +62,31 @@ logger = logging.getLogger(__name__)
 ON_CREATE_BACKFILL_DAYS = 30
 
 
-def _backfill_async(apiario_id: int, days: int) -> None:
-    """Esegue il backfill in un thread daemon per non bloccare la response.
+@registra('meteo_backfill', concorrenza=2, max_tentativi=4)
+def backfill_meteo(apiario_id: int, days: int) -> None:
+    """Backfill leggero degli ultimi `days` giorni, eseguito dalla coda lavori.
 
     L'import di `aggiorna_meteo_apiario` è ritardato perché tocca cache/HTTP.
+    Le eccezioni risalgono alla coda, che ritenta con backoff.
     """
-    try:
-        from .meteo_archive_utils import aggiorna_meteo_apiario
-        from .models import Apiario as _Apiario
+    from .meteo_archive_utils import aggiorna_meteo_apiario
 
-        apiario = _Apiario.objects.filter(pk=apiario_id).first()
-        if not apiario or not apiario.has_coordinates() or not apiario.monitoraggio_meteo:
-            return
+    apiario = Apiario.objects.filter(pk=apiario_id).first()
+    if not apiario or not apiario.has_coordinates() or not apiario.monitoraggio_meteo:
+        return
 
-        oggi = date.today()
-        end = oggi - timedelta(days=1)
-        start = max(
-            end - timedelta(days=days - 1),
-            apiario.data_creazione.date() if apiario.data_creazione else end - timedelta(days=days - 1),
-        )
-        aggiorna_meteo_apiario(apiario, start, end)
-    except Exception as e:
-        logger.warning("Backfill meteo on-create fallito per apiario %s: %s", apiario_id, e)
+    oggi = date.today()
+    end = oggi - timedelta(days=1)
+    start = max(
+        end - timedelta(days=days - 1),
+        apiario.data_creazione.date() if apiario.data_creazione else end - timedelta(days=days - 1),
+    )
+    aggiorna_meteo_apiario(apiario, start, end)
 
 
 @receiver(post_save, sender=Apiario)
 def apiario_post_save_backfill_meteo(sender, instance, created, **kwargs):
-    """Lancia il backfill leggero quando un apiario diventa "monitorabile".
+    """Accoda il backfill leggero quando un apiario diventa "monitorabile".
 
     Si scatena se:
       - l'apiario è appena stato creato con coordinate e monitoraggio_meteo attivo
@@ -77,12 +104,12 @@ def apiario_post_save_backfill_meteo(sender, instance, created, **kwargs):
         if MeteoGiornaliero.objects.filter(apiario=instance).exists():
             return
 
-    t = threading.Thread(
-        target=_backfill_async,
-        args=(instance.pk, ON_CREATE_BACKFILL_DAYS),
-        daemon=True,
+    accoda(
+        'meteo_backfill',
+        chiave=f'meteo_backfill:{instance.pk}',
+        apiario_id=instance.pk,
+        days=ON_CREATE_BACKFILL_DAYS,
     )
-    t.start()
 
 
 # ── Fan-out broadcast admin → una Notifica per ogni utente attivo ───────────
@@ -103,54 +130,95 @@ def _plain_excerpt(html: str, max_len: int = 500) -> str:
 @receiver(post_save, sender=AdminBroadcast)
 def broadcast_post_save_fanout(sender, instance, created, **kwargs):
     """Quando una AdminBroadcast viene marcata pubblicata per la prima volta,
-    crea una Notifica per ciascun utente attivo. Idempotente: una volta che
-    `data_pubblicazione` è stato impostato, il fan-out non viene ripetuto.
+    accoda il fan-out (una Notifica per ciascun utente attivo). Finché il
+    lavoro non è eseguito l'admin la mostra "in invio…".
     """
     if not instance.pubblicata:
         return
     if instance.data_pubblicazione is not None:
         return  # già fan-outata
+    accoda('broadcast_fanout', chiave=f'broadcast_fanout:{instance.pk}', broadcast_id=instance.pk)
+
 
+@registra('broadcast_fanout', max_tentativi=3)
+def fanout_broadcast(broadcast_id: int) -> None:
+    """Crea una Notifica per ciascun utente attivo. Idempotente: una volta che
+    `data_pubblicazione` è stato impostato, il fan-out non viene ripetuto.
+    Tutto in una transazione, così un tentativo fallito non lascia notifiche
+    a metà.
+    """
     from django.contrib.auth import get_user_model
     UserModel = get_user_model()
 
-    user_ids = list(
-        UserModel.objects.filter(is_active=True).values_list('id', flat=True)
-    )
-    if not user_ids:
-        return
+    with transaction.atomic():
+        instance = (
+            AdminBroadcast.objects.select_for_update()
+            .filter(pk=broadcast_id, pubblicata=True, data_pubblicazione__isnull=True)
+            .first()
+        )
+        if instance is None:
+            return
 
-    plain = _plain_excerpt(instance.body_html)
-    notifiche = [
-        Notifica(
-            utente_id=u_id,
-            tipo='broadcast',
-            titolo=instance.titolo,
-            messaggio=plain,
-            messaggio_html=instance.body_html or '',
-            immagine_url=instance.immagine_url or None,
-            link_route=instance.link_route or '',
-            link_param=instance.link_param or '',
-            priorita=instance.priorita,
-            broadcast=instance,
-            mittente=instance.creata_da,
+        user_ids = list(
+            UserModel.objects.filter(is_active=True).values_list('id', flat=True)
+        )
+        if not user_ids:
+            return
+
+        plain = _plain_excerpt(instance.body_html)
+        notifiche = [
+            Notifica(
+                utente_id=u_id,
+                tipo='broadcast',
+                titolo=instance.titolo,
+                messaggio=plain,
+                messaggio_html=instance.body_html or '',
+                immagine_url=instance.immagine_url or None,
+                link_route=instance.link_route or '',
+                link_param=instance.link_param or '',
+                priorita=instance.priorita,
+                broadcast=instance,
+                mittente=instance.creata_da,
+            )
+            for u_id in user_ids
+        ]
+        Notifica.objects.bulk_create(notifiche, batch_size=settings.NOTIFICHE_BATCH_SIZE)
+        aggiorna_contatori(nuove_non_lette(notifiche))
+
+        # Aggiorna senza ritriggerare il signal (.update() bypassa save())
+        AdminBroadcast.objects.filter(pk=instance.pk).update(
+            data_pubblicazione=timezone.now(),
+            destinatari_count=len(user_ids),
         )
-        for u_id in user_ids
-    ]
-    Notifica.objects.bulk_create(notifiche, batch_size=500)
-
-    # Aggiorna senza ritriggerare il signal (.update() bypassa save())
-    from django.utils import timezone as tz
-    AdminBroadcast.objects.filter(pk=instance.pk).update(
-        data_pubblicazione=tz.now(),
-        destinatari_count=len(user_ids),
-    )
     logger.info(
         "AdminBroadcast %s pubblicata → fan-out a %s utenti",
-        instance.pk, len(user_ids),
+        broadcast_id, len(user_ids),
     )
 
 
+@receiver(pre_save, sender=Notifica)
+def notifica_pre_save_traccia(sender, instance, **kwargs):
+    if instance.pk:
+        instance._letta_prima = (
+            Notifica.objects.filter(pk=instance.pk).values_list('letta', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Notifica)
+def notifica_post_save_contatore(sender, instance, created, **kwargs):
+    """Contatore delle non lette (core/notifications.py): +1 se nasce non
+    letta, -1/+1 se viene segnata letta/non letta, solo versione altrimenti."""
+    prima = True if created else getattr(instance, '_letta_prima', None)
+    if prima is None:
+        prima = instance.letta
+    aggiorna_contatori({instance.utente_id: int(prima) - int(instance.letta)})
+
+
+@receiver(post_delete, sender=Notifica)
+def notifica_post_delete_contatore(sender, instance, **kwargs):
+    aggiorna_contatori({instance.utente_id: 0 if instance.letta else -1})
+
+
 # ── SpesaAttrezzatura → Pagamento collegato ────────────────────────────────
 #
 # Il Pagamento serve al calcolo delle quote di gruppo (chi ha sborsato cosa).
@@ -208,6 +276,7 @@ def spesa_attrezzatura_post_save_pagamento(sender, instance, created, **kwargs):
                 data=instance.data,
                 descrizione=descrizione_pagamento_spesa(instance),
                 gruppo_id=instance.gruppo_id,
+                updated_at=timezone.now(),
             )
         return
 
@@ -219,3 +288,374 @@ def spesa_attrezzatura_post_save_pagamento(sender, instance, created, **kwargs):
         gruppo_id=instance.gruppo_id,
         spesa_attrezzatura=instance,
     )
+
+
+# ── Invalidazione snapshot predizioni ML ───────────────────────────────────
+#
+# Ogni modifica a una riga letta da core.ml.dataset incrementa la versione dati
+# degli snapshot interessati: per colonia (controlli, varroa, pesate, ...) o per
+# apiario (meteo giornaliero, fioriture). Il ricalcolo avviene alla prossima
+# richiesta, non qui.
+
+# Modelli con FK diretta `colonia`.
+ML_SORGENTI_COLONIA = (
+    ControlloArnia, VarroaCheckpoint, PesataMelario, Alimentazione,
+    NomadismoEvent, Regina, StoriaRegine,
+)
+# Modelli con FK `apiario`: invalidano tutte le colonie dell'apiario.
+ML_SORGENTI_APIARIO = (MeteoGiornaliero, Fioritura)
+
+
+def _ml_invalida_colonia(sender, instance, **kwargs):
+    from .ml.cache import bump_colonies
+    bump_colonies([instance.colonia_id])
+
+
+def _ml_invalida_apiario(sender, instance, **kwargs):
+    from .ml.cache import bump_apiaries
+    bump_apiaries([instance.apiario_id])
+
+
+for _model in ML_SORGENTI_COLONIA:
+    post_save.connect(_ml_invalida_colonia, sender=_model,
+                      dispatch_uid=f'ml_invalida_save_{_model.__name__}')
+    post_delete.connect(_ml_invalida_colonia, sender=_model,
+                        dispatch_uid=f'ml_invalida_delete_{_model.__name__}')
+for _model in ML_SORGENTI_APIARIO:
+    post_save.connect(_ml_invalida_apiario, sender=_model,
+                      dispatch_uid=f'ml_invalida_save_{_model.__name__}')
+    post_delete.connect(_ml_invalida_apiario, sender=_model,
+                        dispatch_uid=f'ml_invalida_delete_{_model.__name__}')
+
+
+@receiver(post_save, sender=Colonia)
+def colonia_post_save_invalida_ml(sender, instance, created, **kwargs):
+    """Stato/data_fine della colonia fanno parte del dataset."""
+    if not created:
+        from .ml.cache import bump_colonies
+        bump_colonies([instance.pk])
+
+
+@receiver(post_save, sender=TrattamentoSanitario)
+def trattamento_post_save_invalida_ml(sender, instance, **kwargs):
+    from .ml.cache import bump_colonies
+    bump_colonies(list(instance.colonie.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=TrattamentoSanitario)
+def trattamento_pre_delete_invalida_ml(sender, instance, **kwargs):
+    # In post_delete le righe M2M sono già state cancellate: le leggiamo qui.
+    instance._ml_colonie_ids = list(instance.colonie.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=TrattamentoSanitario)
+def trattamento_post_delete_invalida_ml(sender, instance, **kwargs):
+    from .ml.cache import bump_colonies
+    bump_colonies(getattr(instance, '_ml_colonie_ids', []))
+
+
+@receiver(m2m_changed, sender=TrattamentoSanitario.colonie.through)
+def trattamento_colonie_changed_invalida_ml(sender, instance, action, reverse, pk_set, **kwargs):
+    from .ml.cache import bump_colonies
+    if reverse:
+        # colonia.trattamenti.add/remove/clear: cambia solo questa colonia.
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_colonies([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        bump_colonies(pk_set or [])
+    elif action == 'pre_clear':
+        bump_colonies(list(instance.colonie.values_list('id', flat=True)))
+
+
+def _colonie_dei_melari(melario_ids):
+    return list(Colonia.objects.filter(melari__in=melario_ids).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=SmielaturaMelario)
+@receiver(post_delete, sender=SmielaturaMelario)
+def smielatura_melario_invalida_ml(sender, instance, **kwargs):
+    from .ml.cache import bump_colonies
+    bump_colonies(_colonie_dei_melari([instance.melario_id]))
+
+
+@receiver(m2m_changed, sender=Smielatura.melari.through)
+def smielatura_melari_changed_invalida_ml(sender, instance, action, reverse, pk_set, **kwargs):
+    from .ml.cache import bump_colonies, bump_harvests
+    if reverse:
+        # melario.smielature.*: cambia solo la colonia di questo melario.
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_colonies(_colonie_dei_melari([instance.pk]))
+    elif action in ('post_add', 'post_remove'):
+        bump_colonies(_colonie_dei_melari(pk_set or []))
+    elif action == 'pre_clear':
+        bump_harvests([instance.pk])
+
+
+@receiver(post_save, sender=Smielatura)
+def smielatura_post_save_invalida_ml(sender, instance, created, **kwargs):
+    """Data e tipo di miele entrano negli eventi di raccolto delle colonie."""
+    if not created:
+        from .ml.cache import bump_harvests
+        bump_harvests([instance.pk])
+
+
+@receiver(m2m_changed, sender=Smielatura.fioriture.through)
+def smielatura_fioriture_changed_invalida_ml(sender, instance, action, reverse, pk_set, **kwargs):
+    """Le fioriture d'origine entrano negli eventi di raccolto della colonia."""
+    from .ml.cache import bump_harvests
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_harvests([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        bump_harvests(pk_set or [])
+    elif action == 'pre_clear':
+        bump_harvests(list(instance.smielature.values_list('id', flat=True)))
+
+
+# ── Sync incrementale app mobile ───────────────────────────────────────────
+#
+# Ogni oggetto sincronizzato cancellato lascia un RecordEliminato con gli id
+# che ne decidevano la visibilità. Le cascate partite da un Apiario scrivono
+# solo il tombstone dell'apiario: il client elimina il contenuto da sé.
+
+def _apiario_via(model, pk, cache):
+    """apiario_id di un'Arnia/Colonia, memorizzato per tutta la cascata."""
+    if pk is None:
+        return None
+    chiave = (model, pk)
+    if chiave not in cache:
+        cache[chiave] = model.objects.filter(pk=pk).values_list('apiario_id', flat=True).first()
+    return cache[chiave]
+
+
+def _cache_cascata(origin):
+    """Dizionario condiviso da tutta la cascata di `origin` (es. la cache di
+    `_apiario_via` per i controlli di un'arnia eliminata)."""
+    cache = getattr(origin, '_sync_apiari', None)
+    if cache is None:
+        cache = {}
+        try:
+            origin._sync_apiari = cache
+        except AttributeError:
+            pass
+    return cache
+
+
+def _ambito_eliminato(instance, cache):
+    """(apiario_id, utente_id, gruppo_id) del tombstone di `instance`."""
+    if isinstance(instance, Apiario):
+        return instance.pk, instance.proprietario_id, instance.gruppo_id
+    if isinstance(instance, (Pagamento, QuotaUtente)):
+        return None, instance.utente_id, instance.gruppo_id
+    if isinstance(instance, Fioritura):
+        return instance.apiario_id, instance.creatore_id, None
+    if isinstance(instance, ControlloArnia):
+        return _apiario_via(Arnia, instance.arnia_id, cache), None, None
+    if isinstance(instance, (Regina, Melario)):
+        return _apiario_via(Colonia, instance.colonia_id, cache), None, None
+    return instance.apiario_id, None, None
+
+
+def _sync_tombstone(sender, instance, origin=None, **kwargs):
+    from .sync import SORGENTI_PER_MODEL
+    if sender is not Apiario and (
+        isinstance(origin, Apiario) or getattr(origin, 'model', None) is Apiario
+    ):
+        return
+    apiario_id, utente_id, gruppo_id = _ambito_eliminato(instance, _cache_cascata(origin))
+    RecordEliminato.objects.create(
+        modello=SORGENTI_PER_MODEL[sender].chiave,
+        oggetto_id=instance.pk,
+        apiario_id=apiario_id,
+        utente_id=utente_id,
+        gruppo_id=gruppo_id,
+    )
+
+
+def _sync_tocca(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Le relazioni M2M fanno parte del payload: aggiorna il watermark."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            type(instance).objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+        return
+    # es. colonia.trattamenti.*: cambiano i trattamenti collegati
+    if action in ('post_add', 'post_remove'):
+        ids = pk_set or []
+    elif action == 'pre_clear':
+        lato = next(f for f in sender._meta.fields if f.related_model is model)
+        altro = next(f for f in sender._meta.fields if f.related_model is type(instance))
+        ids = list(sender.objects.filter(**{altro.name: instance}).values_list(lato.attname, flat=True))
+    else:
+        return
+    if ids:
+        model.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+
+
+SYNC_MODELLI = (
+    Apiario, Arnia, ControlloArnia, Regina, Fioritura, TrattamentoSanitario,
+    Melario, Smielatura, Pagamento, QuotaUtente,
+)
+for _model in SYNC_MODELLI:
+    post_delete.connect(_sync_tombstone, sender=_model,
+                        dispatch_uid=f'sync_tombstone_{_model.__name__}')
+for _through in (
+    TrattamentoSanitario.colonie.through, TrattamentoSanitario.arnie.through,
+    Smielatura.melari.through, Smielatura.fioriture.through,
+):
+    m2m_changed.connect(_sync_tocca, sender=_through,
+                        dispatch_uid=f'sync_tocca_{_through.__name__}')
+
+
+# ── Cache apiari accessibili ───────────────────────────────────────────────
+
+_CAMPI_ACCESSO = ('proprietario_id', 'gruppo_id', 'condiviso_con_gruppo')
+_CAMPI_POSIZIONE = ('latitudine', 'longitudine')
+
+
+@receiver(pre_save, sender=Apiario)
+def apiario_pre_save_traccia(sender, instance, **kwargs):
+    """Valori salvati dei campi che invalidano accessi e indice spaziale."""
+    if instance.pk:
+        instance._campi_prima = (
+            Apiario.objects.filter(pk=instance.pk)
+            .values(*_CAMPI_ACCESSO, *_CAMPI_POSIZIONE).first()
+        )
+
+
+def _cambiati(instance, created, campi):
+    prima = getattr(instance, '_campi_prima', None)
+    return created or prima is None or any(prima[c] != getattr(instance, c) for c in campi)
+
+
+@receiver(post_save, sender=Apiario)
+def apiario_post_save_accesso(sender, instance, created, **kwargs):
+    """Invalida solo se cambia chi vede l'apiario (non a ogni modifica)."""
+    if _cambiati(instance, created, _CAMPI_ACCESSO):
+        from .accesso import invalida_accesso
+        invalida_accesso()
+
+
+@receiver(post_delete, sender=Apiario)
+@receiver(post_save, sender=MembroGruppo)
+@receiver(post_delete, sender=MembroGruppo)
+def accesso_invalida(sender, instance, **kwargs):
+    from .accesso import invalida_accesso
+    invalida_accesso()
+
+
+# ── Indice spaziale fioriture/apiari ───────────────────────────────────────
+
+@receiver(post_save, sender=Apiario)
+def apiario_post_save_geo(sender, instance, created, **kwargs):
+    if _cambiati(instance, created, _CAMPI_POSIZIONE):
+        from .geo import invalida_indice
+        invalida_indice('apiari')
+
+
+@receiver(post_delete, sender=Apiario)
+def apiario_post_delete_geo(sender, instance, **kwargs):
+    from .geo import invalida_indice
+    invalida_indice('apiari')
+
+
+@receiver(post_save, sender=Fioritura)
+@receiver(post_delete, sender=Fioritura)
+def fioritura_invalida_geo(sender, instance, **kwargs):
+    from .geo import invalida_indice
+    invalida_indice('fioriture')
+
+
+@receiver(post_save, sender=Fioritura)
+def fioritura_post_save_notifica(sender, instance, created, **kwargs):
+    """Avvisa i proprietari degli apiari vicini di una nuova fioritura pubblica."""
+    if not created or not instance.pubblica or not instance.has_coordinates():
+        return
+    notifica_fioritura_vicina_differita(instance.pk)
+
+
+# ── AnalisiTelaino → miniature (core/immagini.py) ──────────────────────────
+
+@receiver(pre_save, sender=AnalisiTelaino)
+def analisi_pre_save_traccia(sender, instance, **kwargs):
+    if instance.pk:
+        instance._immagine_prima = (
+            AnalisiTelaino.objects.filter(pk=instance.pk)
+            .values_list('immagine', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=AnalisiTelaino)
+def analisi_post_save_miniature(sender, instance, created, **kwargs):
+    """Accoda le miniature per un'immagine nuova o sostituita."""
+    if not instance.immagine:
+        return
+    if created or not instance.miniatura or getattr(instance, '_immagine_prima', None) != instance.immagine.name:
+        accoda('derivati_analisi', chiave=f'derivati_analisi:{instance.pk}', analisi_id=instance.pk)
+
+
+# ── Aggregati dashboard (core/dashboard.py) ────────────────────────────────
+
+def _controllo_invalida_dashboard(arnia_ids, origin=None):
+    """Chiamata dai receiver dell'ultimo controllo, dopo aver aggiornato la
+    fotografia: una dashboard ricalcolata prima leggerebbe quella vecchia."""
+    if isinstance(origin, Apiario) or getattr(origin, 'model', None) is Apiario:
+        return  # l'apiario non è più tra quelli accessibili: chiave diversa
+    cache = _cache_cascata(origin)
+    invalida_dashboard([_apiario_via(Arnia, pk, cache) for pk in arnia_ids])
+
+
+@receiver(post_save, sender=Smielatura)
+@receiver(post_delete, sender=Smielatura)
+def smielatura_invalida_dashboard(sender, instance, **kwargs):
+    invalida_dashboard([instance.apiario_id])
+
+
+@receiver(pre_save, sender=Arnia)
+def arnia_pre_save_traccia(sender, instance, **kwargs):
+    if instance.pk:
+        instance._apiario_prima = (
+            Arnia.objects.filter(pk=instance.pk).values_list('apiario_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Arnia)
+@receiver(post_delete, sender=Arnia)
+def arnia_invalida_dashboard(sender, instance, **kwargs):
+    """Anche l'apiario di provenienza, se l'arnia è stata spostata."""
+    invalida_dashboard([instance.apiario_id, getattr(instance, '_apiario_prima', None)])
+
+
+# ── Ultimo controllo di arnie e colonie (core/ultimo_controllo.py) ─────────
+
+@receiver(pre_save, sender=ControlloArnia)
+def controllo_pre_save_traccia(sender, instance, **kwargs):
+    if instance.pk:
+        instance._contenitori_prima = (
+            ControlloArnia.objects.filter(pk=instance.pk)
+            .values_list('arnia_id', 'colonia_id').first()
+        )
+
+
+@receiver(post_save, sender=ControlloArnia)
+def controllo_post_save_ultimo(sender, instance, **kwargs):
+    """Anche l'arnia/colonia di prima, se il controllo è stato spostato."""
+    arnia_prima, colonia_prima = getattr(instance, '_contenitori_prima', None) or (None, None)
+    aggiorna_ultimo_controllo(
+        arnia_ids=[instance.arnia_id, arnia_prima],
+        colonia_ids=[instance.colonia_id, colonia_prima],
+    )
+    _controllo_invalida_dashboard([instance.arnia_id, arnia_prima])
+
+
+@receiver(post_delete, sender=ControlloArnia)
+def controllo_post_delete_ultimo(sender, instance, origin=None, **kwargs):
+    # In una cascata (es. utente eliminato) i controlli sono già tutti
+    # cancellati: ogni arnia/colonia si ricalcola una volta sola.
+    visti = _cache_cascata(origin).setdefault('ultimo_controllo', set())
+    nuovi = {('arnia', instance.arnia_id), ('colonia', instance.colonia_id)} - visti
+    visti |= nuovi
+    aggiorna_ultimo_controllo(
+        arnia_ids=[pk for tipo, pk in nuovi if tipo == 'arnia'],
+        colonia_ids=[pk for tipo, pk in nuovi if tipo == 'colonia'],
+    )
+    _controllo_invalida_dashboard([instance.arnia_id], origin)
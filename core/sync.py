@@ -0,0 +1,382 @@
+"""Sync incrementale per l'app mobile (GET /api/v1/sync/?cursor=...).
+
+Protocollo:
+
+  * la prima chiamata passa ``cursor=`` vuoto e riceve tutto, a pagine;
+  * ogni risposta contiene ``cursor`` (opaco, firmato) da rimandare tale e
+    quale e ``has_more``: finché è true il client chiede la pagina successiva;
+  * a pagine finite, il ``cursor`` ricevuto è il punto di partenza della sync
+    successiva, che restituisce solo le righe con ``updated_at`` più recente
+    (watermark per modello) più i ``eliminati`` (tombstone
+    :class:`core.models.RecordEliminato`) avvenuti nel frattempo;
+  * ``reset: true`` chiede al client di scartare i dati locali: il cursore è
+    più vecchio della ritenzione dei tombstone e si riparte da zero.
+
+Ogni passata ha un limite superiore ``until`` fissato alla prima pagina: le
+modifiche che arrivano durante la paginazione finiscono nella passata dopo.
+Dentro un modello la paginazione è keyset su (watermark, id), quindi il costo
+di una pagina non cresce con la storia dell'account.
+
+Un apiario eliminato implica l'eliminazione di tutto ciò che contiene: per le
+righe cancellate a cascata da un apiario non si scrivono tombstone.
+
+Il cursore ricorda anche gli apiari visibili all'inizio della passata. Se nella
+passata successiva l'utente ne vede di nuovi (condivisione, ingresso in un
+gruppo) le loro righe arrivano per intero, qualunque sia il watermark; per
+quelli che non vede più arriva in ``eliminati`` il tombstone dell'apiario, che
+come sopra elimina anche il suo contenuto. Pagamenti e quote seguono solo il
+watermark.
+
+La sync completa (``?stream=ndjson|json`` senza cursore) passa invece da
+:func:`stream_ndjson` / :func:`stream_json`: i queryset vengono letti con
+``.iterator()`` e serializzati un blocco alla volta, così la memoria del worker
+non dipende dalla dimensione dell'account.
+"""
+
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .accesso import accesso_utente
+from .models import (
+    Apiario, Arnia, ControlloArnia, Regina, Fioritura, TrattamentoSanitario,
+    Melario, Smielatura, Pagamento, QuotaUtente, RecordEliminato,
+)
+from .serializers import (
+    ApiarioSerializer, ArniaSerializer, ControlloArniaDetailSerializer,
+    ReginaSerializer, FiorituraSerializer, TrattamentoSanitarioSerializer,
+    MelarioSerializer, SmielaturaSerializer, PagamentoSerializer,
+    QuotaUtenteSerializer, annota_fioriture,
+)
+
+_CURSOR_SALT = 'core.sync.cursor'
+# Margine sul limite superiore della passata: righe scritte da transazioni
+# ancora aperte con updated_at appena precedente a "adesso" non vanno perse.
+_CLOCK_MARGIN = timedelta(seconds=5)
+
+
+class CursoreNonValido(Exception):
+    pass
+
+
+@dataclass
+class Ambito:
+    """Cosa vede l'utente: calcolato una volta per richiesta."""
+    user: object
+    apiari_ids: list
+    gruppi_ids: list
+    gruppi_admin_ids: list
+
+
+@dataclass
+class Sorgente:
+    """Una collezione della sync: queryset visibile, watermark, serializer."""
+    chiave: str
+    model: type
+    serializer: type
+    queryset: Callable[[Ambito], object]
+    watermark: str = 'updated_at'
+    # Percorso dell'apiario che dà visibilità alla riga (None: non dipende dagli apiari)
+    campo_apiario: Optional[str] = None
+    select_related: tuple = ()
+    prefetch_related: tuple = ()
+
+    def righe(self, ambito):
+        qs = self.queryset(ambito)
+        if self.select_related:
+            qs = qs.select_related(*self.select_related)
+        if self.prefetch_related:
+            qs = qs.prefetch_related(*self.prefetch_related)
+        return qs
+
+
+# Stessi filtri di visibilità della sync completa (api_views.sync_data).
+SORGENTI = [
+    Sorgente(
+        'apiari', Apiario, ApiarioSerializer,
+        lambda a: Apiario.objects.filter(pk__in=a.apiari_ids),
+        campo_apiario='pk',
+        select_related=('proprietario__profilo',),
+    ),
+    Sorgente(
+        'arnie', Arnia, ArniaSerializer,
+        lambda a: Arnia.objects.filter(apiario_id__in=a.apiari_ids),
+        campo_apiario='apiario_id',
+        select_related=('apiario',),
+    ),
+    Sorgente(
+        'controlli', ControlloArnia, ControlloArniaDetailSerializer,
+        lambda a: ControlloArnia.objects.filter(arnia__apiario_id__in=a.apiari_ids),
+        campo_apiario='arnia__apiario_id',
+        select_related=('colonia__apiario', 'arnia__apiario', 'utente'),
+    ),
+    Sorgente(
+        'regine', Regina, ReginaSerializer,
+        lambda a: Regina.objects.filter(colonia__apiario_id__in=a.apiari_ids),
+        campo_apiario='colonia__apiario_id',
+        select_related=('colonia__apiario', 'colonia__arnia'),
+    ),
+    Sorgente(
+        'fioriture', Fioritura, FiorituraSerializer,
+        # Conteggi conferme annotati (nessun contesto request: confermato_da_me è False)
+        lambda a: annota_fioriture(Fioritura.objects.filter(
+            Q(apiario_id__in=a.apiari_ids) | Q(apiario__isnull=True, creatore=a.user)
+        )),
+        watermark='data_modifica',
+        campo_apiario='apiario_id',
+    ),
+    Sorgente(
+        'trattamenti', TrattamentoSanitario, TrattamentoSanitarioSerializer,
+        lambda a: TrattamentoSanitario.objects.filter(apiario_id__in=a.apiari_ids),
+        campo_apiario='apiario_id',
+        select_related=('apiario__gruppo', 'tipo_trattamento', 'utente'),
+        prefetch_related=('colonie', 'arnie'),
+    ),
+    Sorgente(
+        'melari', Melario, MelarioSerializer,
+        lambda a: Melario.objects.filter(colonia__apiario_id__in=a.apiari_ids),
+        campo_apiario='colonia__apiario_id',
+        select_related=('colonia__apiario__gruppo', 'colonia__arnia'),
+    ),
+    Sorgente(
+        'smielature', Smielatura, SmielaturaSerializer,
+        lambda a: Smielatura.objects.filter(apiario_id__in=a.apiari_ids),
+        campo_apiario='apiario_id',
+        select_related=('apiario__gruppo', 'utente'),
+        prefetch_related=('melari', 'fioriture'),
+    ),
+    Sorgente(
+        'pagamenti', Pagamento, PagamentoSerializer,
+        lambda a: Pagamento.objects.filter(Q(utente=a.user) | Q(gruppo_id__in=a.gruppi_ids)),
+        select_related=('utente', 'destinatario', 'gruppo'),
+    ),
+    Sorgente(
+        'quote', QuotaUtente, QuotaUtenteSerializer,
+        # Quote di gruppo visibili solo agli admin (come QuotaUtenteViewSet)
+        lambda a: QuotaUtente.objects.filter(Q(utente=a.user) | Q(gruppo_id__in=a.gruppi_admin_ids)),
+        select_related=('utente', 'gruppo'),
+    ),
+]
+SORGENTI_PER_MODEL = {s.model: s for s in SORGENTI}
+# Fase finale della passata, dopo tutte le sorgenti
+_FASE_ELIMINATI = len(SORGENTI)
+
+
+def ambito_utente(user):
+    accesso = accesso_utente(user)
+    return Ambito(
+        user=user,
+        apiari_ids=list(accesso.apiari_ids),
+        gruppi_ids=list(accesso.gruppi_ids),
+        gruppi_admin_ids=list(accesso.gruppi_admin_ids),
+    )
+
+
+# ── Cursore ─────────────────────────────────────────────────────────────────
+
+def _ts(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _cursore_iniziale():
+    return {
+        'since': None, 'until': None, 'fase': 0, 'dopo': None, 'reset': False,
+        'apiari': [], 'nuovi': [], 'persi': [],
+    }
+
+
+def leggi_cursore(token):
+    """Stato della sync dal cursore del client; stringa vuota = prima sync."""
+    if not token:
+        return _cursore_iniziale()
+    try:
+        stato = signing.loads(token, salt=_CURSOR_SALT)
+    except signing.BadSignature:
+        raise CursoreNonValido('Cursore di sincronizzazione non valido.')
+    if 'apiari' not in stato:
+        # Cursore senza gli apiari visibili: non si sa cosa manca al client
+        return {**_cursore_iniziale(), 'reset': bool(stato.get('since'))}
+    stato.setdefault('reset', False)
+    return stato
+
+
+def scrivi_cursore(stato):
+    return signing.dumps(stato, salt=_CURSOR_SALT, compress=True)
+
+
+def inizia_passata(stato, ambito, now=None):
+    """Fissa `until` e gli apiari visibili alla prima pagina e gestisce i
+    cursori troppo vecchi.
+
+    Confronta gli apiari della passata precedente con quelli di `ambito`:
+    ``nuovi`` vanno inviati per intero, ``persi`` come tombstone.
+    """
+    now = now or timezone.now()
+    if stato['until'] is None:
+        ritenzione = timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_DAYS', 90))
+        if stato['since'] and _ts(stato['since']) < now - ritenzione:
+            stato.update(since=None, reset=True)
+        visti, attuali = set(stato['apiari']), set(ambito.apiari_ids)
+        delta = stato['since'] is not None
+        stato.update(
+            until=(now - _CLOCK_MARGIN).isoformat(), fase=0, dopo=None,
+            apiari=sorted(attuali),
+            nuovi=sorted(attuali - visti) if delta else [],
+            persi=sorted(visti - attuali) if delta else [],
+        )
+    return stato
+
+
+def cursore_successivo(stato):
+    """Cursore per la sync successiva, a passata completata."""
+    return {**_cursore_iniziale(), 'since': stato['until'], 'apiari': stato['apiari']}
+
+
+# ── Righe di una passata ───────────────────────────────────────────────────
+
+def righe_modificate(sorgente, ambito, stato):
+    """Queryset delle righe della sorgente in (since, until], più tutte quelle
+    degli apiari diventati visibili, ordinato per keyset."""
+    wm = sorgente.watermark
+    qs = sorgente.righe(ambito).filter(**{f'{wm}__lte': _ts(stato['until'])})
+    if stato['since']:
+        modificate = Q(**{f'{wm}__gt': _ts(stato['since'])})
+        if sorgente.campo_apiario and stato['nuovi']:
+            modificate |= Q(**{f'{sorgente.campo_apiario}__in': stato['nuovi']})
+        qs = qs.filter(modificate)
+    return qs.order_by(wm, 'pk')
+
+
+def eliminati(ambito, stato):
+    """Tombstone in (since, until] visibili all'utente; nessuno alla prima sync."""
+    if not stato['since']:
+        return RecordEliminato.objects.none()
+    return RecordEliminato.objects.filter(
+        Q(apiario_id__in=ambito.apiari_ids)
+        | Q(utente_id=ambito.user.pk)
+        | Q(gruppo_id__in=ambito.gruppi_ids),
+        data_eliminazione__gt=_ts(stato['since']),
+        data_eliminazione__lte=_ts(stato['until']),
+    ).order_by('data_eliminazione', 'pk')
+
+
+def _dopo(qs, watermark, dopo):
+    """Keyset: righe successive a (valore watermark, pk) dell'ultima inviata."""
+    if not dopo:
+        return qs
+    t, pk = _ts(dopo[0]), dopo[1]
+    return qs.filter(Q(**{f'{watermark}__gt': t}) | Q(**{watermark: t, 'pk__gt': pk}))
+
+
+def sync_pagina(ambito, stato, page_size):
+    """Una pagina di al più `page_size` righe (modifiche + eliminazioni).
+
+    I tombstone degli apiari non più visibili, pochi, arrivano tutti nella
+    pagina in cui iniziano le eliminazioni, oltre a `page_size`.
+
+    Restituisce (payload, stato aggiornato, has_more).
+    """
+    payload = {s.chiave: [] for s in SORGENTI}
+    payload['eliminati'] = []
+    budget = page_size
+
+    while budget > 0 and stato['fase'] <= _FASE_ELIMINATI:
+        if stato['fase'] < _FASE_ELIMINATI:
+            sorgente = SORGENTI[stato['fase']]
+            wm = sorgente.watermark
+            qs = _dopo(righe_modificate(sorgente, ambito, stato), wm, stato['dopo'])
+        else:
+            wm = 'data_eliminazione'
+            qs = _dopo(eliminati(ambito, stato), wm, stato['dopo'])
+
+        righe = list(qs[:budget + 1])
+        piena = len(righe) > budget
+        righe = righe[:budget]
+        budget -= len(righe)
+
+        if stato['fase'] < _FASE_ELIMINATI:
+            payload[sorgente.chiave] = sorgente.serializer(righe, many=True).data
+        else:
+            persi = [] if stato['dopo'] else [{'modello': 'apiari', 'id': pk} for pk in stato['persi']]
+            payload['eliminati'] = persi + [{'modello': r.modello, 'id': r.oggetto_id} for r in righe]
+
+        if piena:
+            ultima = righe[-1]
+            stato['dopo'] = [getattr(ultima, wm).isoformat(), ultima.pk]
+            return payload, stato, True
+        stato.update(fase=stato['fase'] + 1, dopo=None)
+
+    return payload, stato, stato['fase'] <= _FASE_ELIMINATI
+
+
+# ── Sync completa in streaming ─────────────────────────────────────────────
+
+def _dumps(obj):
+    # Stesso formato compatto di rest_framework.renderers.JSONRenderer
+    return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def _blocchi(sorgente, ambito, chunk_size):
+    """Righe serializzate della sorgente, `chunk_size` alla volta."""
+    blocco = []
+    qs = sorgente.righe(ambito).order_by('pk')
+    for obj in qs.iterator(chunk_size=chunk_size):
+        blocco.append(obj)
+        if len(blocco) == chunk_size:
+            yield sorgente.serializer(blocco, many=True).data
+            blocco = []
+    if blocco:
+        yield sorgente.serializer(blocco, many=True).data
+
+
+def _intestazione(ambito, now=None):
+    """timestamp + cursore da cui far partire la prima sync incrementale.
+
+    Le righe modificate mentre lo stream è in corso ricadono nella sync
+    incrementale successiva (al più vengono inviate due volte).
+    """
+    stato = inizia_passata(leggi_cursore(''), ambito, now=now)
+    return {
+        'timestamp': stato['until'],
+        'cursor': scrivi_cursore(cursore_successivo(stato)),
+    }
+
+
+def stream_ndjson(ambito, chunk_size):
+    """Una riga JSON per oggetto: ``{"collezione": ..., "dato": {...}}``.
+
+    La prima riga è l'intestazione (``timestamp``, ``cursor``), l'ultima
+    ``{"fine": true, "totali": {...}}`` permette al client di riconoscere uno
+    stream troncato.
+    """
+    yield (_dumps(_intestazione(ambito)) + '\n').encode()
+    totali = {}
+    for sorgente in SORGENTI:
+        totali[sorgente.chiave] = 0
+        for dati in _blocchi(sorgente, ambito, chunk_size):
+            totali[sorgente.chiave] += len(dati)
+            yield ''.join(
+                _dumps({'collezione': sorgente.chiave, 'dato': d}) + '\n' for d in dati
+            ).encode()
+    yield (_dumps({'fine': True, 'totali': totali}) + '\n').encode()
+
+
+def stream_json(ambito, chunk_size):
+    """Lo stesso documento della sync completa (più ``cursor``), a pezzi."""
+    yield _dumps(_intestazione(ambito))[:-1].encode()
+    for sorgente in SORGENTI:
+        yield f',"{sorgente.chiave}":['.encode()
+        primo = True
+        for dati in _blocchi(sorgente, ambito, chunk_size):
+            pezzo = ','.join(_dumps(d) for d in dati)
+            yield (pezzo if primo else ',' + pezzo).encode()
+            primo = False
+        yield b']'
+    yield b'}'
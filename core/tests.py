@@ -0,0 +1,1520 @@
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from collections import defaultdict
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models.constants import OnConflict
+from django.db.models.query import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import numpy as np
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import (
+    accesso, ai_views, dashboard, geo, immagini, jobs, meteo_archive_utils, onnx_pool, sync,
+    ultimo_controllo,
+)
+from core.meteo_archive_utils import DailyRow, MeteoFetchError, upsert_meteo_giornaliero
+from core.ml import cache as ml_cache, dataset as ml_dataset, features, predict as ml_predict
+from core.ml.dataset import build_colonia_dataset
+from core.ml.predict import predict_colonia, predict_dataset
+from core.api_views import FiorituraViewSet, MelarioViewSet, VarroaCheckpointViewSet
+from core.models import (
+    AdminBroadcast, AnalisiTelaino, Apiario, Arnia, Colonia, ContatoreNotifiche, ControlloArnia,
+    Fioritura, FiorituraConferma, Gruppo, LavoroInCoda, Melario, MembroGruppo, MeteoGiornaliero,
+    Notifica, Smielatura, SmielaturaMelario, SnapshotPredizioneColonia, TipoTrattamento,
+    VarroaCheckpoint,
+)
+from core.notifications import crea_notifica, notifica_fioritura_vicina_job, riepilogo_notifiche
+from core.query_budget import assert_query_budget
+from core.signals import fanout_broadcast
+from core.varroa_engine import VarroaEngine
+
+
+def _utente(username):
+    return User.objects.create_user(username, password='x')
+
+
+def _apiario(proprietario, nome='A', **campi):
+    return Apiario.objects.create(nome=nome, posizione='-', proprietario=proprietario, **campi)
+
+
+def _arnia(apiario, numero=1):
+    return Arnia.objects.create(apiario=apiario, numero=numero, data_installazione=date(2024, 1, 1))
+
+
+def _client_api(utente):
+    client = APIClient()
+    client.force_authenticate(utente)
+    return client
+
+
+# ── core/ml/features.py ─────────────────────────────────────────────────────
+
+def _dataset_casuale(seed, n_controlli=120):
+    rnd = random.Random(seed)
+    inizio = date(2022, 3, 1)
+
+    def giorno():
+        return inizio + timedelta(days=rnd.randrange(900))
+
+    trattamenti = []
+    for _ in range(12):
+        d = giorno()
+        trattamenti.append({
+            'data_inizio': d,
+            'data_fine': d + timedelta(days=rnd.randrange(-3, 40)) if rnd.random() < 0.8 else None,
+        })
+    return {
+        'controlli': [
+            {'id': i, 'data': giorno(), 'telaini_covata': rnd.choice([None, 2, 4, 6, 8]),
+             'telaini_scorte': rnd.randrange(10), 'sciamatura': rnd.random() < 0.05}
+            for i in range(n_controlli)
+        ],
+        'meteo_giornaliero': [
+            {'data': inizio + timedelta(days=i), 'gdd_base10': round(rnd.uniform(0, 12), 1)}
+            for i in range(0, 900, 2)
+        ],
+        'varroa': [
+            {'data_campionamento': giorno(), 'percentuale_calcolata': round(rnd.uniform(0, 8), 2)}
+            for _ in range(30)
+        ],
+        'trattamenti': trattamenti,
+        'alimentazioni': [
+            {'data': giorno(), 'quantita_kg': round(rnd.uniform(0.5, 3), 1)} for _ in range(40)
+        ],
+        'regina': {'data_nascita': date(2021, 5, 1), 'data_introduzione': date(2021, 6, 1)},
+    }
+
+
+def _riferimento_ambiente(dataset, d):
+    """Le feature ambientali calcolate per scansione completa, come prima
+    dell'indice (riferimento per il test)."""
+    gdd = {m['data']: m['gdd_base10'] for m in dataset['meteo_giornaliero']}
+    finestra_gdd = [v for g, v in gdd.items() if d - timedelta(days=features.GDD_WINDOW_DAYS) < g <= d]
+    varroa = sorted((v['data_campionamento'], v['percentuale_calcolata']) for v in dataset['varroa'])
+    prima = [pct for g, pct in varroa if g <= d]
+    intervalli = [
+        (t['data_inizio'], t['data_fine'] or t['data_inizio']) for t in dataset['trattamenti']
+    ]
+    fine_passate = [e for _, e in intervalli if e <= d]
+    alimentazione = sorted((a['data'], a['quantita_kg']) for a in dataset['alimentazioni'])
+    return {
+        'gdd_trailing': round(sum(finestra_gdd), 1),
+        'varroa_pct_latest': prima[-1] if prima else None,
+        'under_treatment': any(s <= d <= e for s, e in intervalli),
+        'days_since_treatment': (d - max(fine_passate)).days if fine_passate else None,
+        'feeding_kg_trailing': round(sum(
+            kg for g, kg in alimentazione
+            if d - timedelta(days=features.FEEDING_WINDOW_DAYS) < g <= d
+        ), 2),
+    }
+
+
+class FeatureFrameTest(SimpleTestCase):
+    def test_indici_uguali_alla_scansione_completa(self):
+        for seed in range(5):
+            dataset = _dataset_casuale(seed)
+            righe = features.colony_feature_frame(dataset)
+            self.assertEqual(len(righe), len(dataset['controlli']))
+            for riga in righe:
+                atteso = _riferimento_ambiente(dataset, date.fromisoformat(riga['data']))
+                self.assertEqual({k: riga[k] for k in atteso}, atteso)
+
+    def test_trend_covata_dal_controllo_precedente(self):
+        dataset = {'controlli': [
+            {'id': 2, 'data': date(2024, 5, 11), 'telaini_covata': 6},
+            {'id': 1, 'data': date(2024, 5, 1), 'telaini_covata': 4},
+        ]}
+        prima, seconda = features.colony_feature_frame(dataset)
+        self.assertIsNone(prima['covata_delta'])
+        self.assertEqual(seconda['days_since_prev_control'], 10)
+        self.assertEqual(seconda['covata_delta'], 2.0)
+        self.assertAlmostEqual(seconda['covata_rate_day'], 0.2)
+
+    def test_intervallo_invertito_non_copre(self):
+        dataset = {
+            'controlli': [{'id': 1, 'data': date(2024, 5, 5)}],
+            'trattamenti': [{'data_inizio': date(2024, 5, 10), 'data_fine': date(2024, 5, 1)}],
+        }
+        riga, = features.colony_feature_frame(dataset)
+        self.assertFalse(riga['under_treatment'])
+
+    def _prefisso(self, dataset, fino_a):
+        return {**dataset, 'controlli': [c for c in dataset['controlli'] if c['data'] <= fino_a]}
+
+    def test_estensione_uguale_alla_ricostruzione(self):
+        for seed in range(5):
+            dataset = _dataset_casuale(seed)
+            fino_a = sorted(c['data'] for c in dataset['controlli'])[80]
+            righe = features.colony_feature_frame(self._prefisso(dataset, fino_a))
+            self.assertEqual(
+                features.extend_feature_frame(righe, dataset), features.colony_feature_frame(dataset))
+            self.assertLess(len(righe), len(dataset['controlli']))
+
+    def test_impronta_cambia_solo_con_input_fino_alla_data(self):
+        dataset = _dataset_casuale(0)
+        fino_a = sorted(c['data'] for c in dataset['controlli'])[80]
+        impronta = features.frame_digest(dataset, fino_a)
+        self.assertEqual(features.frame_digest(self._prefisso(dataset, fino_a), fino_a), impronta)
+        modificato = {**dataset, 'controlli': [
+            {**c, 'telaini_scorte': 99} if c['data'] == fino_a else c for c in dataset['controlli']
+        ]}
+        self.assertNotEqual(features.frame_digest(modificato, fino_a), impronta)
+
+
+class DatasetColonieTest(TestCase):
+    def setUp(self):
+        utente = _utente('u')
+        apiari = [_apiario(utente, nome='A'), _apiario(utente, nome='B')]
+        oggi = date.today()
+        self.colonie = []
+        for i in range(5):
+            apiario = apiari[i % 2]
+            arnia = _arnia(apiario, numero=i + 1)
+            colonia = Colonia.objects.create(
+                arnia=arnia, apiario=apiario, utente=utente, data_inizio=date(2024, 1, 1))
+            self.colonie.append(colonia)
+            if i == 2:
+                continue  # colonia senza controlli
+            for giorni_fa in range(i + 1):
+                _controllo(arnia, utente, colonia=colonia, data=oggi - timedelta(days=10 * giorni_fa),
+                           telaini_covata=i + giorni_fa)
+            VarroaCheckpoint.objects.create(
+                colonia=colonia, utente=utente, metodo='sugar_shake', acari_contati=i,
+                percentuale_calcolata=i / 2, data_campionamento=oggi - timedelta(days=i))
+        for apiario in apiari:
+            upsert_meteo_giornaliero(
+                apiario, [_giorno_meteo(oggi - timedelta(days=g), 20.0 + g) for g in range(3)],
+                MeteoGiornaliero.SOURCE_ARCHIVE)
+
+    def test_bulk_uguale_alla_singola_colonia_oltre_il_chunk(self):
+        colonie = Colonia.objects.select_related('apiario').filter(pk__in=[c.pk for c in self.colonie])
+        with mock.patch.object(ml_dataset, 'BULK_CHUNK_SIZE', 2):
+            bulk = ml_dataset.build_colonia_datasets(colonie)
+        self.assertEqual(set(bulk), {c.pk for c in self.colonie})
+        for colonia in self.colonie:
+            self.assertEqual(bulk[colonia.pk], build_colonia_dataset(colonia))
+        self.assertEqual(bulk[self.colonie[2].pk]['controlli'], [])
+        self.assertEqual(len(bulk[self.colonie[4].pk]['controlli']), 5)
+
+
+class SnapshotPredizioniTest(TestCase):
+    def setUp(self):
+        self.utente = _utente('u')
+        apiario = _apiario(self.utente)
+        self.arnia = _arnia(apiario)
+        self.colonia = Colonia.objects.create(
+            arnia=self.arnia, apiario=apiario, utente=self.utente, data_inizio=date(2024, 1, 1))
+        self.vecchio = self._controllo(30, telaini_covata=4)
+        self._controllo(20, telaini_covata=5)
+        ml_cache.cached_predict_colonia(self.colonia)
+
+    def _controllo(self, giorni_fa, **campi):
+        return _controllo(self.arnia, self.utente, colonia=self.colonia,
+                          data=date.today() - timedelta(days=giorni_fa), **campi)
+
+    def _ricalcolata(self):
+        with mock.patch.object(ml_cache, 'predict_dataset', wraps=predict_dataset) as calcola:
+            risultato = ml_cache.cached_predict_colonia(self.colonia)
+        self.assertEqual(risultato, predict_colonia(self.colonia))
+        return calcola.called
+
+    def test_hit_dopo_store(self):
+        self.assertFalse(self._ricalcolata())
+        risultati, timings = ml_cache.cached_predict_colonie([self.colonia])
+        self.assertEqual((len(risultati), timings['cache_hits']), (1, 1))
+
+    def test_miss_dopo_salvataggio_controllo(self):
+        self.vecchio.save()
+        self.assertTrue(self._ricalcolata())
+        self.assertFalse(self._ricalcolata())
+
+    def test_miss_dopo_upsert_meteo(self):
+        # bulk_create non manda post_save: vale il bump esplicito dell'upsert
+        upsert_meteo_giornaliero(
+            self.colonia.apiario, [_giorno_meteo(date.today() - timedelta(days=1), 22.0)],
+            MeteoGiornaliero.SOURCE_ARCHIVE)
+        self.assertTrue(self._ricalcolata())
+
+    def test_miss_dopo_modifica_smielatura(self):
+        melario = Melario.objects.create(
+            colonia=self.colonia, posizione=1, data_posizionamento=date.today() - timedelta(days=60))
+        smielatura = Smielatura.objects.create(
+            data=date.today() - timedelta(days=10), apiario=self.colonia.apiario,
+            quantita_miele=12, tipo_miele='Acacia', utente=self.utente)
+        SmielaturaMelario.objects.create(smielatura=smielatura, melario=melario, kg_miele=12)
+        self.assertTrue(self._ricalcolata())
+        self.assertFalse(self._ricalcolata())
+        smielatura.tipo_miele = 'Castagno'
+        smielatura.save()
+        self.assertTrue(self._ricalcolata())
+
+    def test_nuovo_controllo_estende_il_frame_salvato(self):
+        self._controllo(2, telaini_covata=7)
+        with mock.patch.object(ml_cache, 'colony_feature_frame') as ricostruisci:
+            risultato = ml_cache.cached_predict_colonia(self.colonia)
+            ricostruisci.assert_not_called()
+        self.assertEqual(risultato, predict_colonia(self.colonia))
+        snap = SnapshotPredizioneColonia.objects.get(colonia=self.colonia)
+        self.assertEqual(snap.righe, features.colony_feature_frame(build_colonia_dataset(self.colonia)))
+
+    def test_modifica_retrodatata_ricostruisce(self):
+        self.vecchio.telaini_covata = 1
+        self.vecchio.save()
+        self._controllo(2)
+        with mock.patch.object(
+                ml_cache, 'colony_feature_frame', wraps=features.colony_feature_frame) as ricostruisci:
+            risultato = ml_cache.cached_predict_colonia(self.colonia)
+            ricostruisci.assert_called_once()
+        self.assertEqual(risultato, predict_colonia(self.colonia))
+
+
+class PredizioniApiarioTest(TestCase):
+    def setUp(self):
+        self.utente = _utente('u')
+        self.apiario = _apiario(self.utente)
+        for numero in range(1, 4):
+            arnia = _arnia(self.apiario, numero=numero)
+            colonia = Colonia.objects.create(
+                arnia=arnia, apiario=self.apiario, utente=self.utente, data_inizio=date(2024, 1, 1))
+            for giorni_fa in (40, 25, 5):
+                _controllo(arnia, self.utente, colonia=colonia,
+                           data=date.today() - timedelta(days=giorni_fa * numero),
+                           telaini_covata=numero + giorni_fa // 10)
+        self.colonie = list(Colonia.objects.select_related('apiario').order_by('id'))
+
+    def test_pool_uguale_al_calcolo_sequenziale(self):
+        with mock.patch.object(ml_predict, 'MIN_COLONIES_FOR_POOL', 2):
+            risultati, timings = ml_predict.predict_colonie(self.colonie, workers=2)
+        self.assertEqual(timings['workers'], 2)
+        self.assertEqual(risultati, [predict_colonia(c) for c in self.colonie])
+
+    def test_endpoint_apiario(self):
+        url = reverse('api-ml-predict-apiario', args=[self.apiario.pk])
+        risposta = _client_api(self.utente).get(url)
+        self.assertEqual(risposta.status_code, 200)
+        self.assertEqual(
+            [r['colonia_id'] for r in risposta.data['colonie']], [c.pk for c in self.colonie])
+
+    def test_endpoint_apiario_di_un_altro_utente(self):
+        url = reverse('api-ml-predict-apiario', args=[self.apiario.pk])
+        self.assertEqual(_client_api(_utente('altro')).get(url).status_code, 404)
+        self.assertEqual(APIClient().get(url).status_code, 401)
+
+
+# ── core/varroa_engine.py ───────────────────────────────────────────────────
+
+def _trattamento(nome, inizio, giorni=14, efficacia=0.9, blocco=False, stato='completato'):
+    return SimpleNamespace(
+        tipo_trattamento=SimpleNamespace(nome=nome, efficacia_foretica=efficacia, efficacia_in_covata=0.2),
+        data_inizio=inizio, data_fine=inizio + timedelta(days=giorni) if giorni is not None else None,
+        metodo_applicazione='', blocco_covata_attivo=blocco, stato=stato,
+    )
+
+
+def _motore(seed, days_ahead=90):
+    rnd = random.Random(seed)
+    oggi = date.today()
+    inizio = oggi - timedelta(days=200)
+    giorni = sorted(rnd.sample(range(0, 190), 6))
+    checkpoints = [
+        SimpleNamespace(data_campionamento=inizio + timedelta(days=g),
+                        percentuale_calcolata=round(rnd.uniform(0.1, 4), 2))
+        for g in giorni
+    ]
+    ispezioni = [
+        {'data': inizio + timedelta(days=g), 'telaini_covata': rnd.choice([None, 2, 5, 8, 10])}
+        for g in sorted(rnd.sample(range(0, 260), 15))
+    ]
+    trattamenti = [
+        _trattamento(f'T{i}', inizio + timedelta(days=rnd.randrange(0, 280)),
+                     giorni=rnd.choice([None, 7, 30]), blocco=rnd.random() < 0.3,
+                     stato=rnd.choice(['completato', 'annullato', 'programmato']))
+        for i in range(5)
+    ]
+    return VarroaEngine(checkpoints, ispezioni, trattamenti, days_ahead=days_ahead)
+
+
+def _traiettoria_per_giorno(engine):
+    """La traiettoria calcolata giorno per giorno (riferimento per il test)."""
+    cps = engine.checkpoints
+    fine = engine.today + timedelta(days=engine.days_ahead)
+    eventi = engine._build_treatment_events(cps[0].data_campionamento, fine)
+    punti = []
+    for cp0, cp1 in zip(cps, cps[1:]):
+        n = (cp1.data_campionamento - cp0.data_campionamento).days
+        log0 = math.log(max(float(cp0.percentuale_calcolata), 0.001))
+        log1 = math.log(max(float(cp1.percentuale_calcolata), 0.001))
+        for k in range(n):
+            punti.append((cp0.data_campionamento + timedelta(days=k),
+                          math.exp(log0 + (k / n) * (log1 - log0)), 'checkpoint' if k == 0 else 'stima'))
+    ultimo = cps[-1]
+    pct = float(ultimo.percentuale_calcolata)
+    punti.append((ultimo.data_campionamento, pct, 'checkpoint'))
+    crescita = math.exp(engine._projection_rate(ultimo))
+    giorno = ultimo.data_campionamento + timedelta(days=1)
+    while giorno <= fine:
+        if giorno in eventi:
+            pct *= eventi[giorno]
+        pct = max(pct * crescita, 0.001)
+        punti.append((giorno, pct, 'proiezione'))
+        giorno += timedelta(days=1)
+    return [
+        {
+            'data': d.isoformat(), 'percentuale': round(p, 3), 'tipo': tipo,
+            'telaini_covata': engine.telaini_at_date(d),
+            'trattamenti_attivi': [
+                t.tipo_trattamento.nome for t in engine.trattamenti
+                if t.stato != 'annullato' and t.data_inizio <= d
+                and (t.data_fine is None or t.data_fine >= d)
+            ],
+        }
+        for d, p, tipo in punti
+    ]
+
+
+class VarroaEngineTest(SimpleTestCase):
+    def test_traiettoria_uguale_al_calcolo_per_giorno(self):
+        for seed in range(8):
+            engine = _motore(seed)
+            self.assertEqual(engine.compute_trajectory()['trajectory'], _traiettoria_per_giorno(engine))
+
+    def test_soglia_minima_nella_proiezione(self):
+        engine = _motore(1)
+        engine.trattamenti = [
+            _trattamento(f'T{i}', engine.today + timedelta(days=i), efficacia=1.0, blocco=True)
+            for i in range(1, 4)
+        ]
+        traiettoria = engine.compute_trajectory()['trajectory']
+        self.assertEqual(traiettoria, _traiettoria_per_giorno(engine))
+        self.assertIn(0.001, [p['percentuale'] for p in traiettoria if p['tipo'] == 'proiezione'])
+
+    def test_scenari_uguali_alla_proiezione_con_i_trattamenti_aggiunti(self):
+        engine = _motore(3)
+        scenari = [[], [_trattamento('Extra', engine.today + timedelta(days=10), blocco=True)]]
+        risultati = engine.simulate_schedules(scenari)
+        for scenario, risultato in zip(scenari, risultati):
+            riferimento = VarroaEngine(
+                engine.checkpoints, engine.ispezioni, list(engine.trattamenti) + scenario,
+                days_ahead=engine.days_ahead,
+            )
+            proiezione = [
+                p for p in _traiettoria_per_giorno(riferimento) if p['tipo'] == 'proiezione'
+            ]
+            self.assertEqual(risultato['percentuale_fine'], proiezione[-1]['percentuale'])
+            self.assertEqual(risultato['data_fine'], proiezione[-1]['data'])
+        self.assertLess(risultati[1]['percentuale_fine'], risultati[0]['percentuale_fine'])
+
+    def test_scenari_picco_e_soglia_rossa_come_per_giorno(self):
+        for seed in range(6):
+            engine = _motore(seed, days_ahead=150)
+            scenari = [[], [_trattamento('Extra', engine.today + timedelta(days=30))],
+                       [_trattamento('Estivo', engine.today + timedelta(days=5), blocco=True, efficacia=0.95)]]
+            for scenario, risultato in zip(scenari, engine.simulate_schedules(scenari)):
+                riferimento = VarroaEngine(
+                    engine.checkpoints, engine.ispezioni, list(engine.trattamenti) + scenario,
+                    days_ahead=engine.days_ahead,
+                )
+                proiezione = [
+                    p for p in _traiettoria_per_giorno(riferimento) if p['tipo'] == 'proiezione'
+                ]
+                sopra = [
+                    p for p in proiezione
+                    if p['percentuale'] >= engine.thresholds_for_date(date.fromisoformat(p['data']))['rosso']
+                ]
+                picco = max(proiezione, key=lambda p: p['percentuale'])
+                self.assertEqual(risultato['picco'], picco['percentuale'])
+                self.assertEqual(risultato['giorni_sopra_soglia_rossa'], len(sopra))
+                self.assertEqual(risultato['data_prima_soglia_rossa'], sopra[0]['data'] if sopra else None)
+
+    def test_scenari_senza_checkpoint(self):
+        engine = VarroaEngine([], [], [], days_ahead=30)
+        risultati = engine.simulate_schedules([[], []])
+        self.assertEqual(risultati, [VarroaEngine._empty_simulation()] * 2)
+
+
+class SimulaVarroaTest(TestCase):
+    def setUp(self):
+        self.utente = _utente('u')
+        apiario = _apiario(self.utente)
+        self.colonia = Colonia.objects.create(
+            arnia=_arnia(apiario), apiario=apiario, utente=self.utente, data_inizio=date(2024, 1, 1))
+        self.tipo = TipoTrattamento.objects.create(nome='Ossalico', principio_attivo='acido ossalico')
+        self.url = '/api/v1/varroa-checkpoints/simula/'
+
+    def _checkpoint(self):
+        VarroaCheckpoint.objects.create(
+            colonia=self.colonia, utente=self.utente, metodo='sugar_shake', acari_contati=6,
+            percentuale_calcolata=2.0, data_campionamento=date.today() - timedelta(days=3))
+
+    def _scenario(self, nome, giorni, tipo=None):
+        return {'nome': nome, 'trattamenti': [{
+            'tipo_trattamento': tipo or self.tipo.pk,
+            'data_inizio': (date.today() + timedelta(days=giorni)).isoformat(),
+            'blocco_covata': True,
+        }]}
+
+    def test_scenari_confrontati_con_la_base(self):
+        self._checkpoint()
+        risposta = _client_api(self.utente).post(self.url, {
+            'colonia_id': self.colonia.pk, 'days_ahead': 60,
+            'scenari': [self._scenario('Subito', 1), self._scenario('Tardi', 40), {'trattamenti': []}],
+        }, format='json')
+        self.assertEqual(risposta.status_code, 200)
+        dati = risposta.json()
+        self.assertEqual([s['nome'] for s in dati['scenari']], ['Subito', 'Tardi', 'Scenario 3'])
+        subito, tardi, vuoto = dati['scenari']
+        self.assertEqual(vuoto['percentuale_fine'], dati['base']['percentuale_fine'])
+        self.assertLess(subito['picco'], tardi['picco'])
+        self.assertLess(tardi['percentuale_fine'], dati['base']['percentuale_fine'])
+
+    def test_errori(self):
+        client = _client_api(self.utente)
+        payload = {'colonia_id': self.colonia.pk, 'scenari': [self._scenario('A', 1)]}
+        self.assertEqual(client.post(self.url, payload, format='json').status_code, 400)  # senza checkpoint
+        self._checkpoint()
+        inesistente = {**payload, 'scenari': [self._scenario('A', 1, tipo=self.tipo.pk + 100)]}
+        self.assertEqual(client.post(self.url, inesistente, format='json').status_code, 400)
+        troppi = {**payload, 'scenari': [self._scenario(str(i), 1) for i in range(101)]}
+        self.assertEqual(client.post(self.url, troppi, format='json').status_code, 400)
+        altro = _client_api(_utente('altro'))
+        self.assertEqual(altro.post(self.url, payload, format='json').status_code, 404)
+
+
+class TraiettorieVarroaTest(TestCase):
+    def test_apiario_id_non_numerico(self):
+        utente = _utente('u')
+        risposta = _client_api(utente).get('/api/v1/varroa-checkpoints/traiettorie/?apiario_id=abc')
+        self.assertEqual(risposta.status_code, 400)
+
+    def test_apiario_di_altri(self):
+        altro = _apiario(_utente('altro'))
+        risposta = _client_api(_utente('u')).get(
+            f'/api/v1/varroa-checkpoints/traiettorie/?apiario_id={altro.pk}')
+        self.assertEqual(risposta.status_code, 404)
+
+    def test_solo_colonie_accessibili(self):
+        utente, altro = _utente('u'), _utente('altro')
+        colonie = []
+        for proprietario in (utente, altro):
+            apiario = _apiario(proprietario)
+            colonie.append(Colonia.objects.create(
+                arnia=_arnia(apiario), apiario=apiario, utente=proprietario,
+                data_inizio=date(2024, 1, 1)))
+        ids = ','.join(str(c.pk) for c in colonie)
+        risposta = _client_api(utente).get(f'/api/v1/varroa-checkpoints/traiettorie/?colonia_ids={ids}')
+        self.assertEqual([c['colonia_id'] for c in risposta.data['colonie']], [colonie[0].pk])
+        risposta = _client_api(utente).get(
+            f'/api/v1/varroa-checkpoints/traiettorie/?apiario_id={colonie[0].apiario_id}')
+        self.assertEqual((risposta.data['apiario_id'], risposta.data['n_colonie']),
+                         (colonie[0].apiario_id, 1))
+
+
+# ── core/meteo_archive_utils.py ─────────────────────────────────────────────
+
+def _giorno_meteo(d, temp_max):
+    return DailyRow(
+        data=d, temp_min=5.0, temp_max=temp_max, temp_mean=None, precip_mm=0.0,
+        precip_hours=None, umidita_media=None, vento_medio=None, vento_raffica_max=None,
+        pressione_media=None, ore_sole=None, radiazione_mj=None, weather_code_dominante=1,
+    )
+
+
+class UpsertMeteoGiornalieroTest(TestCase):
+    def setUp(self):
+        self.apiario = _apiario(_utente('u'))
+        self.giorni = [date(2024, 6, 1) + timedelta(days=i) for i in range(3)]
+
+    def _righe(self):
+        return dict(MeteoGiornaliero.objects.filter(apiario=self.apiario)
+                    .values_list('data', 'temp_max'))
+
+    def test_upsert_con_unique_fields(self):
+        forecast = MeteoGiornaliero.SOURCE_FORECAST
+        archive = MeteoGiornaliero.SOURCE_ARCHIVE
+        upsert_meteo_giornaliero(self.apiario, [_giorno_meteo(d, 20.0) for d in self.giorni], forecast)
+        upsert_meteo_giornaliero(self.apiario, [_giorno_meteo(self.giorni[0], 25.0)], archive)
+        scritte = upsert_meteo_giornaliero(
+            self.apiario, [_giorno_meteo(d, 30.0) for d in self.giorni], forecast)
+        self.assertEqual(scritte, 2)
+        self.assertEqual(self._righe(), {self.giorni[0]: 25.0, self.giorni[1]: 30.0, self.giorni[2]: 30.0})
+        self.assertEqual(MeteoGiornaliero.objects.get(data=self.giorni[0]).source, archive)
+
+    def test_backend_senza_unique_fields(self):
+        """Come MySQL: ON DUPLICATE KEY UPDATE, senza indicare il vincolo."""
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(QuerySet, '_batched_insert', autospec=True, return_value=[]) as insert:
+            upsert_meteo_giornaliero(
+                self.apiario, [_giorno_meteo(d, 20.0) for d in self.giorni],
+                MeteoGiornaliero.SOURCE_ARCHIVE)
+        chiamata = insert.call_args.kwargs
+        self.assertEqual(chiamata['on_conflict'], OnConflict.UPDATE)
+        self.assertIsNone(chiamata['unique_fields'])
+        self.assertIn('temp_max', [f.name for f in chiamata['update_fields']])
+
+
+class ScaricoMeteoTest(TestCase):
+    def test_griglia_solo_per_archive(self):
+        utente = _utente('u')
+        vicini = [
+            _apiario(utente, nome='A', latitudine='45.1012', longitudine='9.2034'),
+            _apiario(utente, nome='B', latitudine='45.1987', longitudine='9.1421'),
+        ]
+        oggi = date.today()
+
+        def archive(punti, start, end):
+            return [[_giorno_meteo(start, 20.0)] for _ in punti]
+
+        def forecast(punti, past_days):
+            return [[_giorno_meteo(oggi, lat)] for lat, _ in punti]
+
+        with mock.patch.object(meteo_archive_utils, 'fetch_meteo_archive_multi',
+                               side_effect=archive) as fetch_archive, \
+                mock.patch.object(meteo_archive_utils, 'fetch_meteo_forecast_recent_multi',
+                                  side_effect=forecast) as fetch_forecast:
+            risultati = meteo_archive_utils.aggiorna_meteo_apiari(
+                [(a, oggi - timedelta(days=10), oggi) for a in vicini])
+
+        self.assertEqual(fetch_archive.call_args.args[0], [(45.125, 9.125)])
+        self.assertEqual(fetch_forecast.call_args.args[0], [(45.1012, 9.2034), (45.1987, 9.1421)])
+        for apiario in vicini:
+            self.assertEqual(risultati[apiario.pk], {'archive': 1, 'forecast': 1, 'skipped': False})
+            riga = MeteoGiornaliero.objects.get(apiario=apiario, data=oggi)
+            self.assertEqual(riga.temp_max, float(apiario.latitudine))
+
+
+def _risposta(status_code, payload=None, headers=None):
+    return SimpleNamespace(status_code=status_code, text='', headers=headers or {},
+                           json=lambda: payload)
+
+
+def _blocco(lat):
+    return {'daily': {'time': ['2024-06-01'], 'temperature_2m_max': [lat]}}
+
+
+class FetchMultiTest(SimpleTestCase):
+    """Divisione dei lotti solo per errori di payload, backoff su 429/5xx."""
+
+    def setUp(self):
+        for patcher in (mock.patch.object(meteo_archive_utils, '_throttle'),
+                        mock.patch.object(meteo_archive_utils, 'time')):
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        self.time = meteo_archive_utils.time
+
+    def _scarica(self, risposte, punti):
+        with mock.patch.object(meteo_archive_utils.requests, 'get', side_effect=risposte) as get:
+            blocchi = meteo_archive_utils.fetch_meteo_archive_multi(
+                punti, date(2024, 6, 1), date(2024, 6, 1))
+        return blocchi, [c.kwargs['params']['latitude'] for c in get.call_args_list]
+
+    def test_429_ritentato_senza_dividere(self):
+        punti = [(45.0, 9.0), (46.0, 9.0)]
+        blocchi, richieste = self._scarica(
+            [_risposta(429, headers={'Retry-After': '7'}), _risposta(200, [_blocco(45), _blocco(46)])],
+            punti)
+        self.assertEqual(richieste, ['45.0,46.0', '45.0,46.0'])
+        self.time.sleep.assert_called_once_with(7.0)
+        self.assertEqual([b[0].temp_max for b in blocchi], [45, 46])
+
+    def test_5xx_persistente_interrompe(self):
+        with self.settings(METEO_HTTP_RETRIES=3):
+            with self.assertRaises(MeteoFetchError):
+                self._scarica([_risposta(503)] * 3, [(45.0, 9.0), (46.0, 9.0)])
+        self.assertEqual([c.args[0] for c in self.time.sleep.call_args_list], [2.0, 4.0])
+
+    def test_400_divide_e_segnala_la_coordinata(self):
+        def get(url, params, timeout):
+            return _risposta(400) if '99.0' in params['latitude'] else _risposta(
+                200, [_blocco(float(lat)) for lat in params['latitude'].split(',')])
+
+        blocchi, richieste = self._scarica(get, [(45.0, 9.0), (99.0, 9.0), (46.0, 9.0)])
+        self.assertEqual(richieste, ['45.0,99.0,46.0', '45.0', '99.0,46.0', '99.0', '46.0'])
+        self.assertEqual(blocchi[0][0].temp_max, 45.0)
+        self.assertIsInstance(blocchi[1], MeteoFetchError)
+        self.assertEqual(blocchi[2][0].temp_max, 46.0)
+        self.time.sleep.assert_not_called()
+
+
+class ErroriMeteoApiariTest(TestCase):
+    def test_cella_fallita_come_errore(self):
+        utente = _utente('u')
+        buono = _apiario(utente, nome='A', latitudine='45.1', longitudine='9.1')
+        rifiutato = _apiario(utente, nome='B', latitudine='47.1', longitudine='9.1')
+        oggi = date.today()
+        errore = MeteoFetchError('Open-Meteo HTTP 400', lotto=True)
+
+        def archive(punti, start, end):
+            return [errore if lat > 47 else [_giorno_meteo(start, 20.0)] for lat, _ in punti]
+
+        with mock.patch.object(meteo_archive_utils, 'fetch_meteo_archive_multi', side_effect=archive), \
+                mock.patch.object(meteo_archive_utils, 'fetch_meteo_forecast_recent_multi',
+                                  side_effect=lambda punti, past_days: [[] for _ in punti]):
+            risultati = meteo_archive_utils.aggiorna_meteo_apiari(
+                [(a, oggi - timedelta(days=10), oggi) for a in (buono, rifiutato)])
+        self.assertEqual(risultati[buono.pk]['archive'], 1)
+        self.assertEqual(risultati[rifiutato.pk], {'errore': 'Open-Meteo HTTP 400'})
+
+
+# ── core/sync.py ────────────────────────────────────────────────────────────
+
+def _ambito(utente, apiari):
+    return sync.Ambito(user=utente, apiari_ids=[a.pk for a in apiari], gruppi_ids=[], gruppi_admin_ids=[])
+
+
+def _passata(ambito, token, minuti, page_size=2):
+    """Una passata completa della sync incrementale; restituisce gli id
+    ricevuti per collezione e il cursore della passata successiva."""
+    stato = sync.inizia_passata(
+        sync.leggi_cursore(token), ambito, now=timezone.now() + timedelta(minutes=minuti))
+    ricevuti = defaultdict(list)
+    while True:
+        payload, stato, has_more = sync.sync_pagina(ambito, stato, page_size)
+        for chiave, righe in payload.items():
+            ricevuti[chiave] += [
+                (r['modello'], r['id']) if chiave == 'eliminati' else r['id'] for r in righe
+            ]
+        if not has_more:
+            return ricevuti, sync.scrivi_cursore(sync.cursore_successivo(stato))
+        token = sync.scrivi_cursore(stato)
+        stato = sync.leggi_cursore(token)
+
+
+class SyncAmbitoTest(TestCase):
+    def setUp(self):
+        self.utente = _utente('u')
+        altro = _utente('altro')
+        self.mio = _apiario(self.utente, nome='Mio')
+        self.condiviso = _apiario(altro, nome='Condiviso')
+        self.arnie_mie = [_arnia(self.mio, n) for n in range(1, 4)]
+        self.arnie_condivise = [_arnia(self.condiviso, n) for n in range(1, 4)]
+
+    def test_apiario_diventato_visibile_arriva_per_intero(self):
+        ricevuti, cursore = _passata(_ambito(self.utente, [self.mio]), '', 1)
+        self.assertEqual(ricevuti['arnie'], [a.pk for a in self.arnie_mie])
+
+        ambito = _ambito(self.utente, [self.mio, self.condiviso])
+        ricevuti, cursore = _passata(ambito, cursore, 2)
+        self.assertEqual(ricevuti['apiari'], [self.condiviso.pk])
+        self.assertEqual(ricevuti['arnie'], [a.pk for a in self.arnie_condivise])
+        self.assertEqual(ricevuti['eliminati'], [])
+
+        ricevuti, _ = _passata(ambito, cursore, 3)
+        self.assertEqual(ricevuti['arnie'], [])
+
+    def test_apiario_non_più_visibile_diventa_tombstone(self):
+        _, cursore = _passata(_ambito(self.utente, [self.mio, self.condiviso]), '', 1)
+        ricevuti, cursore = _passata(_ambito(self.utente, [self.mio]), cursore, 2, page_size=1)
+        self.assertEqual(ricevuti['eliminati'], [('apiari', self.condiviso.pk)])
+        self.assertEqual(ricevuti['arnie'], [])
+
+        ricevuti, _ = _passata(_ambito(self.utente, [self.mio]), cursore, 3)
+        self.assertEqual(ricevuti['eliminati'], [])
+
+    def test_cursore_senza_apiari_riparte_da_zero(self):
+        vecchio = signing.dumps(
+            {'since': timezone.now().isoformat(), 'until': None, 'fase': 0, 'dopo': None},
+            salt='core.sync.cursor', compress=True)
+        stato = sync.leggi_cursore(vecchio)
+        self.assertTrue(stato['reset'])
+        self.assertIsNone(stato['since'])
+
+    def test_reset_solo_sulla_prima_pagina(self):
+        cache.clear()
+        Arnia.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        scaduto = sync.scrivi_cursore({
+            **sync.leggi_cursore(''), 'since': (timezone.now() - timedelta(days=400)).isoformat(),
+        })
+        client = _client_api(self.utente)
+        pagine = []
+        cursore = scaduto
+        while True:
+            dati = client.get('/api/v1/sync/', {'cursor': cursore, 'page_size': 1}).json()
+            pagine.append(dati['reset'])
+            cursore = dati['cursor']
+            if not dati['has_more']:
+                break
+        self.assertGreater(len(pagine), 2)
+        self.assertEqual(pagine, [True] + [False] * (len(pagine) - 1))
+
+
+class SyncStreamTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.utente = _utente('u')
+        apiario = _apiario(self.utente)
+        self.arnie = [_arnia(apiario, n).pk for n in range(1, 6)]
+        # Righe scritte prima dello stream (quelle recenti tornerebbero nella sync successiva)
+        ieri = timezone.now() - timedelta(days=1)
+        Apiario.objects.update(updated_at=ieri)
+        Arnia.objects.update(updated_at=ieri)
+        self.client_api = _client_api(self.utente)
+
+    def _stream(self, formato):
+        with self.settings(SYNC_STREAM_CHUNK_SIZE=2):
+            risposta = self.client_api.get('/api/v1/sync/', {'stream': formato})
+        return b''.join(risposta.streaming_content).decode()
+
+    def test_ndjson(self):
+        righe = [json.loads(r) for r in self._stream('ndjson').splitlines()]
+        intestazione, *oggetti, fine = righe
+        self.assertIn('cursor', intestazione)
+        self.assertEqual([o['dato']['id'] for o in oggetti if o['collezione'] == 'arnie'], self.arnie)
+        self.assertEqual(fine, {'fine': True, 'totali': {
+            s.chiave: sum(o['collezione'] == s.chiave for o in oggetti) for s in sync.SORGENTI
+        }})
+
+    def test_json_e_cursore_per_la_sync_successiva(self):
+        documento = json.loads(self._stream('json'))
+        self.assertEqual([a['id'] for a in documento['arnie']], self.arnie)
+        self.assertEqual(set(documento), {'timestamp', 'cursor', *(s.chiave for s in sync.SORGENTI)})
+
+        Arnia.objects.filter(pk=self.arnie[0]).update(updated_at=timezone.now() + timedelta(minutes=1))
+        ricevuti, _ = _passata(_ambito(self.utente, Apiario.objects.all()), documento['cursor'], 2)
+        self.assertEqual(ricevuti['arnie'], [self.arnie[0]])
+        self.assertEqual(ricevuti['apiari'], [])
+
+
+# ── core/accesso.py ─────────────────────────────────────────────────────────
+
+class AccessoTest(TransactionTestCase):
+    """Fuori da una transazione, dove accesso_utente può usare la cache."""
+
+    def setUp(self):
+        cache.clear()
+        proprietario = _utente('proprietario')
+        self.membro = _utente('membro')
+        gruppo = Gruppo.objects.create(nome='G', creatore=proprietario)
+        self.iscrizione = MembroGruppo.objects.create(utente=self.membro, gruppo=gruppo, ruolo='editor')
+        self.apiario = _apiario(proprietario, gruppo=gruppo, condiviso_con_gruppo=True)
+
+    def test_senza_cache_condivisa_legge_il_database(self):
+        self.assertEqual(accesso.accesso_utente(self.membro).ruolo(self.apiario.pk), 'editor')
+        # Revoca fatta da un altro processo: l'invalidazione non arriva a questo
+        with mock.patch.object(accesso.transaction, 'on_commit'):
+            self.iscrizione.delete()
+        self.assertIsNone(accesso.accesso_utente(self.membro).ruolo(self.apiario.pk))
+
+    def test_cache_condivisa_invalidata_al_commit(self):
+        with mock.patch.object(accesso, 'cache_condivisa', return_value=True):
+            accesso.accesso_utente(self.membro)
+            with self.assertNumQueries(0):
+                self.assertIn(self.apiario.pk, accesso.apiari_accessibili_ids(self.membro))
+            self.iscrizione.delete()
+            self.assertNotIn(self.apiario.pk, accesso.apiari_accessibili_ids(self.membro))
+
+    def _utente_richiesta(self):
+        """Ogni richiesta carica il proprio oggetto utente."""
+        return User(pk=self.membro.pk, username=self.membro.username)
+
+    def test_calcolato_una_volta_per_richiesta(self):
+        with self.assertNumQueries(2):
+            accesso.accesso_utente(self.membro)
+            accesso.apiari_accessibili_ids(self.membro)
+            self.assertEqual(accesso.accesso_utente(self.membro).ruolo(self.apiario.pk), 'editor')
+        with self.assertNumQueries(2):
+            accesso.accesso_utente(self._utente_richiesta())
+        self.iscrizione.delete()
+        self.assertIsNone(accesso.accesso_utente(self.membro).ruolo(self.apiario.pk))
+
+    def test_scritture_non_usano_la_cache(self):
+        def vista(request):
+            return accesso.accesso_utente(self._utente_richiesta())
+
+        middleware = accesso.AccessoScritturaMiddleware(vista)
+        with mock.patch.object(accesso, 'cache_condivisa', return_value=True):
+            accesso.accesso_utente(self.membro)
+            with self.assertNumQueries(2):
+                middleware(RequestFactory().post('/'))
+            with self.assertNumQueries(0):
+                middleware(RequestFactory().get('/'))
+
+    def test_arnie_per_apiario_id_non_numerico(self):
+        self.client.force_login(self.membro)
+        risposta = self.client.get(reverse('get_arnie_per_apiario'), {'apiario_id': 'abc'})
+        self.assertEqual(risposta.status_code, 400)
+
+
+# ── core/query_budget.py: budget dichiarati sui viewset ────────────────────
+
+class BudgetQueryTest(TestCase):
+    """Ogni azione con budget dichiarato lo rispetta, autenticazione JWT
+    compresa e con l'aggiornamento di last_login (il caso peggiore)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.utente = _utente('u')
+        altro = _utente('altro')
+        gruppo = Gruppo.objects.create(nome='G', creatore=altro)
+        MembroGruppo.objects.create(utente=cls.utente, gruppo=gruppo, ruolo='editor')
+        apiari = [
+            _apiario(cls.utente, nome='Mio', latitudine='45.0', longitudine='9.0'),
+            _apiario(altro, nome='Condiviso', gruppo=gruppo, condiviso_con_gruppo=True),
+        ]
+        oggi = date.today()
+        for apiario in apiari:
+            for n in range(1, 4):
+                arnia = _arnia(apiario, n)
+                colonia = Colonia.objects.create(
+                    arnia=arnia, apiario=apiario, utente=apiario.proprietario, data_inizio=oggi)
+                Melario.objects.create(colonia=colonia, posizione=1, data_posizionamento=oggi)
+                for giorni in (30, 10):
+                    VarroaCheckpoint.objects.create(
+                        colonia=colonia, utente=cls.utente, metodo='sugar_shake', api_campionate=300, acari_contati=5,
+                        data_campionamento=oggi - timedelta(days=giorni), percentuale_calcolata=1.5)
+            for i in range(3):
+                fioritura = Fioritura.objects.create(
+                    apiario=apiario, creatore=cls.utente, pianta=f'P{i}', pubblica=True,
+                    data_inizio=oggi - timedelta(days=5), latitudine='45.01', longitudine='9.01')
+                FiorituraConferma.objects.create(fioritura=fioritura, utente=altro, intensita=3)
+        cls.fioritura = Fioritura.objects.first()
+        cls.melario = Melario.objects.first()
+        cls.checkpoint = VarroaCheckpoint.objects.first()
+        cls.apiario = apiari[0]
+
+    def _get(self, viewset, azione, url, **params):
+        self.utente.last_login = None
+        self.utente.save(update_fields=['last_login'])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.utente)}')
+        with assert_query_budget(viewset.query_budget[azione], max_repeats=1):
+            risposta = client.get(url, params)
+        self.assertEqual(risposta.status_code, 200, risposta.content)
+
+    def test_fioriture(self):
+        base = '/api/v1/fioriture/'
+        self._get(FiorituraViewSet, 'list', base)
+        self._get(FiorituraViewSet, 'retrieve', f'{base}{self.fioritura.pk}/')
+        self._get(FiorituraViewSet, 'attive', f'{base}attive/')
+        self._get(FiorituraViewSet, 'community', f'{base}community/')
+        self._get(FiorituraViewSet, 'vicine', f'{base}vicine/', lat=45.0, lng=9.0)
+
+    def test_melari(self):
+        self._get(MelarioViewSet, 'list', '/api/v1/melari/')
+        self._get(MelarioViewSet, 'retrieve', f'/api/v1/melari/{self.melario.pk}/')
+
+    def test_varroa_checkpoints(self):
+        base = '/api/v1/varroa-checkpoints/'
+        self._get(VarroaCheckpointViewSet, 'list', base)
+        self._get(VarroaCheckpointViewSet, 'retrieve', f'{base}{self.checkpoint.pk}/')
+        self._get(VarroaCheckpointViewSet, 'traiettorie', f'{base}traiettorie/', apiario_id=self.apiario.pk)
+
+
+# ── core/geo.py ─────────────────────────────────────────────────────────────
+
+def _fioritura(creatore, lat='45.0', lon='9.0', **campi):
+    return Fioritura.objects.create(
+        creatore=creatore, pianta='Acacia', data_inizio=date.today(),
+        latitudine=lat, longitudine=lon, **campi)
+
+
+# Gli apiari con coordinate accodano il backfill meteo: fuori dalla rete
+@override_settings(JOB_ESECUZIONE_IMMEDIATA=False)
+class IndiceGeoTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        geo._indici.clear()
+        self.utente = _utente('u')
+
+    def test_fioritura_di_un_altro_processo(self):
+        self.assertEqual(geo.indice_fioriture().entro(45.0, 9.0, 5), [])
+        # Senza cache condivisa l'invalidazione di un altro processo non arriva
+        with mock.patch.object(geo.transaction, 'on_commit'):
+            fioritura = _fioritura(self.utente)
+        self.assertEqual([pk for pk, _ in geo.indice_fioriture().entro(45.0, 9.0, 5)], [fioritura.pk])
+
+    def test_indice_riusato_se_nulla_cambia(self):
+        geo.indice_apiari()
+        with mock.patch.object(geo, 'GridIndex', wraps=geo.GridIndex) as costruzioni:
+            geo.indice_apiari()
+            costruzioni.assert_not_called()
+
+    def test_notifica_legge_l_indice_fuori_dalla_transazione(self):
+        vicino = _apiario(_utente('vicino'), latitudine='45.01', longitudine='9.01')
+        _apiario(_utente('lontano'), latitudine='46.0', longitudine='9.0')
+        fioriture = [_fioritura(self.utente) for _ in range(2)]
+        geo.indice_apiari()
+        with mock.patch.object(geo, 'GridIndex', wraps=geo.GridIndex) as costruzioni:
+            for fioritura in fioriture:
+                notifica_fioritura_vicina_job(fioritura.pk)
+            costruzioni.assert_not_called()
+        self.assertEqual(
+            list(Notifica.objects.filter(tipo='fioritura_vicina').values_list('utente_id', flat=True)),
+            [vicino.proprietario_id] * 2)
+
+    def test_widget_fioriture_vicine_usa_le_distanze_dell_indice(self):
+        _apiario(self.utente, nome='Nord', latitudine='45.02', longitudine='9.0')
+        _apiario(self.utente, nome='Sud', latitudine='45.0', longitudine='9.0')
+        vicina = _fioritura(self.utente, 45.001, 9.0)
+        _fioritura(self.utente, 45.001, 9.0, data_fine=date.today() - timedelta(days=1))
+        _fioritura(self.utente, 46.0, 9.0)
+        risposta = _client_api(self.utente).get(reverse('stats-fioriture-vicine'), {'raggio_km': 5})
+        fioriture = risposta.json()['fioriture']
+        self.assertEqual([f['id'] for f in fioriture], [vicina.pk])
+        atteso = geo.distanze_km(45.02, 9.0, [45.001], [9.0])[0]
+        # Vince il primo apiario entro il raggio, con la sua distanza
+        self.assertEqual(fioriture[0]['apiario_vicino'], 'Nord')
+        self.assertEqual(fioriture[0]['distanza_km'], round(float(atteso), 2))
+
+
+# ── core/jobs.py ────────────────────────────────────────────────────────────
+
+@override_settings(JOB_ESECUZIONE_IMMEDIATA=False, JOB_BACKOFF_SECONDI=30, JOB_BACKOFF_MAX_SECONDI=3600)
+class CodaLavoriTest(TestCase):
+    def setUp(self):
+        self.chiamate = []
+        self.fallisce = False
+
+        def gestore(n):
+            if self.fallisce:
+                raise RuntimeError('gestore fallito')
+            self.chiamate.append(n)
+
+        jobs.registra('prova', concorrenza=1, max_tentativi=2)(gestore)
+        self.addCleanup(jobs._gestori.pop, 'prova')
+
+    def _scaduto(self, lavoro):
+        LavoroInCoda.objects.filter(pk=lavoro.pk).update(esegui_dopo=timezone.now() - timedelta(seconds=1))
+
+    def test_tentativo_fallito_torna_in_coda_con_backoff_poi_fallito(self):
+        self.fallisce = True
+        jobs.accoda('prova', n=1)
+        prima = timezone.now()
+        self.assertFalse(jobs.esegui(jobs.preleva(['prova'])))
+        lavoro = LavoroInCoda.objects.get()
+        self.assertEqual((lavoro.stato, lavoro.tentativi), ('in_attesa', 1))
+        self.assertGreaterEqual(lavoro.esegui_dopo, prima + timedelta(seconds=30))
+        self.assertIn('gestore fallito', lavoro.errore)
+        # Non ancora eseguibile
+        self.assertIsNone(jobs.preleva(['prova']))
+
+        self._scaduto(lavoro)
+        self.assertFalse(jobs.esegui(jobs.preleva(['prova'])))
+        lavoro.refresh_from_db()
+        self.assertEqual((lavoro.stato, lavoro.tentativi), ('fallito', 2))
+        self.assertIsNone(jobs.preleva(['prova']))
+
+    def test_ritentato_con_successo(self):
+        self.fallisce = True
+        jobs.accoda('prova', n=7)
+        jobs.esegui(jobs.preleva(['prova']))
+        self.fallisce = False
+        self._scaduto(LavoroInCoda.objects.get())
+        self.assertTrue(jobs.esegui(jobs.preleva(['prova'])))
+        lavoro = LavoroInCoda.objects.get()
+        self.assertEqual((lavoro.stato, lavoro.errore), ('completato', ''))
+        self.assertEqual(self.chiamate, [7])
+
+    def test_chiave_deduplica_i_pendenti(self):
+        primo = jobs.accoda('prova', chiave='k', n=1)
+        self.assertEqual(jobs.accoda('prova', chiave='k', n=2).pk, primo.pk)
+        self.assertEqual(LavoroInCoda.objects.count(), 1)
+
+    def test_prelievo_rispetta_la_concorrenza(self):
+        jobs.accoda('prova', n=1)
+        jobs.accoda('prova', n=2)
+        preso = jobs.preleva(['prova'], worker='w1')
+        self.assertEqual((preso.stato, preso.worker, preso.tentativi), ('in_corso', 'w1', 1))
+        # concorrenza=1: il secondo resta in attesa finché il primo è in corso
+        self.assertIsNone(jobs.preleva(['prova'], worker='w2'))
+        jobs.esegui(preso)
+        secondo = jobs.preleva(['prova'], worker='w2')
+        self.assertNotEqual(secondo.pk, preso.pk)
+
+    def test_prelievo_non_prende_un_lavoro_gia_preso(self):
+        lavoro = jobs.accoda('prova', n=1)
+        originale = QuerySet.update
+
+        def altro_worker_prima(qs, **campi):
+            # Un altro worker vince la UPDATE condizionata tra SELECT e UPDATE
+            if campi.get('stato') == 'in_corso':
+                originale(LavoroInCoda.objects.filter(pk=lavoro.pk), stato='in_corso', worker='altro')
+            return originale(qs, **campi)
+
+        with mock.patch.object(QuerySet, 'update', altro_worker_prima):
+            self.assertIsNone(jobs.preleva(['prova'], worker='w1'))
+        lavoro.refresh_from_db()
+        self.assertEqual((lavoro.worker, lavoro.tentativi), ('altro', 0))
+
+    @override_settings(JOB_ESECUZIONE_IMMEDIATA=True)
+    def test_esecuzione_immediata_in_un_thread_al_commit(self):
+        with mock.patch.object(jobs.threading, 'Thread') as thread:
+            with self.captureOnCommitCallbacks(execute=True):
+                lavoro = jobs.accoda('prova', n=3)
+                thread.assert_not_called()
+        thread.assert_called_once_with(
+            target=jobs._thread_immediato, args=(lavoro.pk,), name=f'lavoro-{lavoro.pk}', daemon=True)
+        thread.return_value.start.assert_called_once_with()
+
+        self.assertTrue(jobs.esegui_subito(lavoro.pk))
+        self.assertEqual(self.chiamate, [3])
+        self.assertEqual(LavoroInCoda.objects.get().stato, 'completato')
+
+    def test_esecuzione_immediata_fallita_resta_in_coda(self):
+        self.fallisce = True
+        lavoro = jobs.accoda('prova', n=3)
+        self.assertFalse(jobs.esegui_subito(lavoro.pk))
+        lavoro.refresh_from_db()
+        self.assertEqual((lavoro.stato, lavoro.tentativi), ('in_attesa', 1))
+        # Il backoff vale anche qui: il prossimo tentativo è del worker, più tardi
+        self.assertIsNone(jobs.esegui_subito(lavoro.pk))
+
+    @override_settings(JOB_ESECUZIONE_IMMEDIATA=True)
+    def test_esecuzione_immediata_non_riprende_un_lavoro_gia_preso(self):
+        lavoro = jobs.accoda('prova', n=3)
+        jobs.preleva(['prova'], worker='w1')
+        self.assertIsNone(jobs.esegui_subito(lavoro.pk))
+        self.assertEqual(self.chiamate, [])
+
+    def test_worker_sopravvive_a_un_errore(self):
+        esiti = [OperationalError('db irraggiungibile'), True, False]
+        with mock.patch.object(jobs, 'esegui_prossimo', side_effect=esiti), \
+                mock.patch.object(jobs.connection, 'close'), \
+                self.assertLogs('core.jobs', 'ERROR'):
+            worker = jobs.Worker(concorrenza=1, attesa=0, una_volta=True)
+            worker._ciclo(0)
+        self.assertEqual(worker.eseguiti, 1)
+
+
+# ── core/notifications.py: contatore e riepilogo ───────────────────────────
+
+class RiepilogoNotificheTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.utente = _utente('u')
+        riepilogo_notifiche(self.utente)  # crea il contatore
+        self.prima = crea_notifica(self.utente, 'sistema', 'Prima', '-')
+
+    def _riepilogo(self):
+        return riepilogo_notifiche(self.utente)
+
+    def _non_lette(self):
+        return ContatoreNotifiche.objects.get(utente=self.utente).non_lette
+
+    def test_letture_senza_toccare_notifica(self):
+        self._riepilogo()
+        with CaptureQueriesContext(connection) as query:
+            riepilogo = self._riepilogo()
+        self.assertEqual(len(query), 1)
+        self.assertNotIn(Notifica._meta.db_table, query[0]['sql'])
+        self.assertEqual((riepilogo['non_lette'], [n.pk for n in riepilogo['recenti']]), (1, [self.prima.pk]))
+
+    def test_contatore_creato_alla_prima_lettura(self):
+        ContatoreNotifiche.objects.all().delete()
+        crea_notifica(self.utente, 'sistema', 'Seconda', '-')
+        self.assertEqual(self._riepilogo()['non_lette'], 2)
+
+    def test_creazione_lettura_ed_eliminazione(self):
+        self._riepilogo()
+        seconda = crea_notifica(self.utente, 'sistema', 'Seconda', '-')
+        riepilogo = self._riepilogo()
+        self.assertEqual(riepilogo['non_lette'], 2)
+        self.assertEqual([n.pk for n in riepilogo['recenti']], [seconda.pk, self.prima.pk])
+
+        seconda.letta = True
+        seconda.save(update_fields=['letta'])
+        seconda.save()  # già letta: nessuna variazione
+        riepilogo = self._riepilogo()
+        self.assertEqual(riepilogo['non_lette'], 1)
+        self.assertTrue(riepilogo['recenti'][0].letta)
+
+        seconda.delete()
+        self.assertEqual(self._non_lette(), 1)
+        self.prima.delete()
+        self.assertEqual(self._riepilogo(), {'non_lette': 0, 'recenti': []})
+
+    def test_segna_tutte_lette(self):
+        crea_notifica(self.utente, 'sistema', 'Seconda', '-')
+        risposta = _client_api(self.utente).post('/api/v1/notifiche/mark_all_read/')
+        self.assertEqual(risposta.json()['updated'], 2)
+        self.assertEqual(self._non_lette(), 0)
+        self.assertTrue(self._riepilogo()['recenti'][0].letta)
+
+    def test_bulk_create_del_fan_out(self):
+        altro = _utente('altro')
+        broadcast = AdminBroadcast.objects.create(titolo='Avviso', body_html='<p>ciao</p>')
+        AdminBroadcast.objects.filter(pk=broadcast.pk).update(pubblicata=True)
+        fanout_broadcast(broadcast.pk)
+        self.assertEqual(self._non_lette(), 2)
+        self.assertEqual(ContatoreNotifiche.objects.filter(utente=altro).count(), 0)
+        self.assertEqual(riepilogo_notifiche(altro)['non_lette'], 1)
+        self.assertEqual(self._riepilogo()['recenti'][0].tipo, 'broadcast')
+
+
+# ── core/dashboard.py ───────────────────────────────────────────────────────
+
+def _controllo(arnia, utente, **campi):
+    campi = {'data': date.today(), 'telaini_scorte': 3, 'telaini_covata': 3, **campi}
+    return ControlloArnia.objects.create(arnia=arnia, utente=utente, **campi)
+
+
+class AggregatiDashboardTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.utente = _utente('u')
+        self.arnia = _arnia(_apiario(self.utente))
+
+    def test_senza_cache_condivisa_legge_le_modifiche_di_un_altro_processo(self):
+        self.assertEqual(dashboard.aggregati_dashboard(self.utente)['arnie_senza_regina'], 0)
+        with mock.patch.object(dashboard.transaction, 'on_commit'):
+            _controllo(self.arnia, self.utente, presenza_regina=False)
+        dati = dashboard.aggregati_dashboard(self.utente)
+        self.assertEqual((dati['arnie_senza_regina'], dati['controlli_per_mese'][-1]), (1, 1))
+
+    @mock.patch.object(dashboard, 'cache_condivisa', return_value=True)
+    def test_con_cache_condivisa_invalidata_dal_controllo(self, _):
+        dashboard.aggregati_dashboard(self.utente)
+        with mock.patch.object(dashboard, 'calcola_aggregati') as calcola:
+            dashboard.aggregati_dashboard(self.utente)
+            calcola.assert_not_called()
+        controllo = _controllo(self.arnia, self.utente, presenza_regina=False)
+        self.assertEqual(dashboard.aggregati_dashboard(self.utente)['arnie_senza_regina'], 1)
+        controllo.delete()
+        self.assertEqual(dashboard.aggregati_dashboard(self.utente)['arnie_senza_regina'], 0)
+
+    def test_invalidazione_dopo_la_fotografia_dell_ultimo_controllo(self):
+        fotografie = []
+
+        def invalida(apiari_ids):
+            fotografie.append(Arnia.objects.get(pk=self.arnia.pk).ultimo_controllo_id)
+
+        with mock.patch('core.signals.invalida_dashboard', side_effect=invalida):
+            controllo = _controllo(self.arnia, self.utente)
+            self.assertEqual(fotografie, [controllo.pk])
+            controllo.delete()
+        self.assertEqual(fotografie[1:], [None])
+
+
+# ── core/ai_views.py: post-processing YOLO ──────────────────────────────────
+
+def _yolo_riferimento(out, scale, pad_x, pad_y):
+    """Decodifica e NMS anchor per anchor, come prima della vettorizzazione."""
+    num_cls = len(ai_views._CLASS_NAMES)
+    raw = []
+    for d in range(out.shape[1]):
+        cls_scores = out[4:4 + num_cls, d]
+        best_cls = int(cls_scores.argmax())
+        max_conf = float(cls_scores[best_cls])
+        if max_conf < ai_views._CONF_THRESHOLD:
+            continue
+        cx, cy, w, h = (float(out[i, d]) for i in range(4))
+        raw.append({
+            'class_idx': best_cls,
+            'confidence': round(max_conf, 3),
+            'bbox': [(cx - w / 2 - pad_x) / scale, (cy - h / 2 - pad_y) / scale,
+                     (cx + w / 2 - pad_x) / scale, (cy + h / 2 - pad_y) / scale],
+        })
+
+    def iou(a, b):
+        inter = max(0.0, min(a[2], b[2]) - max(a[0], b[0])) * max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+        return inter / union if union > 0 else 0.0
+
+    raw.sort(key=lambda d: d['confidence'], reverse=True)
+    kept, soppressi = [], [False] * len(raw)
+    for i, di in enumerate(raw):
+        if soppressi[i]:
+            continue
+        kept.append(di)
+        for j in range(i + 1, len(raw)):
+            if not soppressi[j] and raw[j]['class_idx'] == di['class_idx'] \
+                    and iou(di['bbox'], raw[j]['bbox']) > ai_views._IOU_THRESHOLD:
+                soppressi[j] = True
+    return [(d['class_idx'], d['confidence'], d['bbox']) for d in kept]
+
+
+def _yolo_uscita(rng, anchors=300):
+    """Output sintetico [features, anchors] con box sovrapposti e confidenze
+    a pari merito dopo l'arrotondamento."""
+    num_cls = len(ai_views._CLASS_NAMES)
+    out = np.zeros((4 + num_cls + 32, anchors), dtype=np.float32)
+    out[0:2] = rng.uniform(50, 150, (2, anchors))
+    out[2:4] = rng.uniform(5, 60, (2, anchors))
+    out[4:4 + num_cls] = np.round(rng.uniform(0, 0.6, (num_cls, anchors)), 2)
+    return out
+
+
+class PostProcessingYoloTest(SimpleTestCase):
+    def test_decode_e_nms_equivalenti_al_ciclo(self):
+        rng = np.random.default_rng(7)
+        for _ in range(5):
+            out = _yolo_uscita(rng)
+            boxes, conf, cls = ai_views._decode(out, 0.5, 3.0, 80.0)
+            conf = np.array([round(c, 3) for c in conf.tolist()])
+            kept = ai_views._nms(boxes, conf, cls, ai_views._IOU_THRESHOLD)
+            self.assertEqual(
+                [(int(cls[i]), float(conf[i]), boxes[i].tolist()) for i in kept],
+                _yolo_riferimento(out, 0.5, 3.0, 80.0))
+
+    def test_nessuna_detection_sopra_soglia(self):
+        out = np.zeros((4 + len(ai_views._CLASS_NAMES) + 32, 10), dtype=np.float32)
+        boxes, conf, cls = ai_views._decode(out, 1.0, 0.0, 0.0)
+        self.assertEqual(len(ai_views._nms(boxes, conf, cls, ai_views._IOU_THRESHOLD)), 0)
+
+    def test_batch_uguale_alle_singole_immagini(self):
+        rng = np.random.default_rng(3)
+        uscite = [_yolo_uscita(rng) for _ in range(3)]
+        immagini = []
+        for dimensioni in ((640, 480), (300, 500), (640, 640)):
+            buf = io.BytesIO()
+            Image.new('RGB', dimensioni, (200, 180, 40)).save(buf, format='JPEG')
+            immagini.append(buf.getvalue())
+
+        class Sessione:
+            def __init__(self, batch):
+                self.batch, self.chiamate, self.coda = batch, 0, list(uscite)
+
+            def get_inputs(self):
+                return [SimpleNamespace(name='images', shape=[self.batch, 3, 640, 640])]
+
+            def run(self, _, ingressi):
+                self.chiamate += 1
+                n = ingressi['images'].shape[0]
+                risultato, self.coda = np.stack(self.coda[:n]), self.coda[n:]
+                return [risultato]
+
+        def esegui(sessione, dati):
+            @contextmanager
+            def presta():
+                yield sessione
+            pool = SimpleNamespace(sessione=presta)
+            with mock.patch.object(ai_views, 'pool_onnx', return_value=pool):
+                return dati()
+
+        dinamica = Sessione('batch')
+        insieme = esegui(dinamica, lambda: ai_views._run_detection_batch(immagini))
+        self.assertEqual(dinamica.chiamate, 1)
+        fissa = Sessione(1)
+        singole = esegui(fissa, lambda: [ai_views._run_detection(i) for i in immagini])
+        self.assertEqual(fissa.chiamate, 3)
+        self.assertEqual(
+            [(r['detections'], r['summary']) for r in insieme],
+            [(r['detections'], r['summary']) for r in singole])
+        self.assertTrue(any(r['detections'] for r in insieme))
+
+
+# ── core/immagini.py ────────────────────────────────────────────────────────
+
+def _jpeg(dimensioni=(800, 600), colore=(200, 180, 40)):
+    buf = io.BytesIO()
+    Image.new('RGB', dimensioni, colore).save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+class MiniatureAnalisiTest(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        impostazioni = override_settings(MEDIA_ROOT=media, ANALISI_MINIATURA_PX=320)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+        self.utente = _utente('u')
+        self.arnia = _arnia(_apiario(self.utente))
+        self.originale = _jpeg()
+        self.analisi = AnalisiTelaino(arnia=self.arnia, numero_telaino=1, facciata='A', utente=self.utente)
+        self.analisi.immagine.save('telaino.jpg', ContentFile(self.originale), save=True)
+
+    def test_miniature_con_nome_dal_contenuto(self):
+        immagini.derivati_analisi(self.analisi.pk)
+        self.analisi.refresh_from_db()
+        digest = hashlib.sha256(self.originale).hexdigest()
+        cartella = f'analisi_telaini/derivati/{digest[:2]}/{digest}'
+        self.assertEqual(self.analisi.hash_immagine, digest)
+        for campo, nome, formato in (
+                (self.analisi.miniatura, f'{cartella}_320.webp', 'WEBP'),
+                (self.analisi.miniatura_jpeg, f'{cartella}_320.jpg', 'JPEG')):
+            self.assertEqual(campo.name, nome)
+            with campo.open('rb') as f:
+                miniatura = Image.open(f)
+                self.assertEqual((miniatura.format, miniatura.size), (formato, (320, 240)))
+
+    def test_seconda_esecuzione_non_fa_nulla(self):
+        call_command('genera_miniature_analisi', stdout=io.StringIO())
+        self.analisi.refresh_from_db()
+        self.assertFalse(immagini.genera_miniature(self.analisi))
+        uscita = io.StringIO()
+        with mock.patch.object(immagini.default_storage, 'save') as salva:
+            call_command('genera_miniature_analisi', stdout=uscita)
+            call_command('genera_miniature_analisi', '--tutte', stdout=io.StringIO())
+            salva.assert_not_called()
+        self.assertIn('0 analisi elaborate', uscita.getvalue())
+
+    def test_risposte_con_url_invece_del_base64(self):
+        immagini.derivati_analisi(self.analisi.pk)
+        self.analisi.refresh_from_db()
+        risposta = _client_api(self.utente).get('/api/v1/analisi-telaini/')
+        riga, = risposta.data['results']
+        self.assertTrue(riga['miniatura'].endswith(self.analisi.miniatura.url))
+        self.assertTrue(riga['miniatura_jpeg'].endswith(self.analisi.miniatura_jpeg.url))
+
+        self.client.force_login(self.utente)
+        pagina = self.client.get(reverse('lista_analisi_telaino', args=[self.arnia.pk]))
+        self.assertContains(pagina, self.analisi.miniatura.url)
+        self.assertNotContains(pagina, 'base64')
+
+        annotata = _jpeg(colore=(10, 20, 30))
+        det = {'summary': {'bees': 3}, 'annotated_image': base64.b64encode(annotata).decode()}
+        salvata = ai_views._salva_analisi(self.utente, self.arnia, 2, 'B', '', det, self.originale)
+        self.assertNotIn('annotated_image', det)
+        self.assertEqual(det['annotated_image_url'], salvata.immagine_annotata.url)
+        self.assertIn(hashlib.sha256(annotata).hexdigest(), det['annotated_image_url'])
+
+
+# ── core/onnx_pool.py ───────────────────────────────────────────────────────
+
+class _SessioneFinta:
+    def __init__(self):
+        self.eseguite = 0
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='images', shape=['batch', 3, 'h', 'w'])]
+
+    def run(self, _, ingressi):
+        self.eseguite += 1
+        return [ingressi['images']]
+
+
+class PoolOnnxTest(SimpleTestCase):
+    def _pool(self, **opzioni):
+        pool = onnx_pool.SessionPool('modello.onnx', **opzioni)
+        pool._crea_sessione = _SessioneFinta
+        return pool
+
+    def test_rifiuta_subito_oltre_le_richieste_in_attesa(self):
+        pool = self._pool(dimensione=1, max_attesa=0)
+        with pool.sessione():
+            with self.assertRaises(onnx_pool.PoolSaturo):
+                with pool.sessione():
+                    pass
+        riepilogo = pool.metriche.riepilogo()
+        self.assertEqual((riepilogo['inferenze'], riepilogo['rifiutate']), (1, 1))
+
+    def test_timeout_in_attesa_di_una_sessione(self):
+        pool = self._pool(dimensione=1, max_attesa=1, timeout=0.05)
+        with pool.sessione():
+            with self.assertRaises(onnx_pool.PoolSaturo):
+                pool._prendi()
+        self.assertEqual((pool.metriche.rifiutate, pool._in_attesa), (1, 0))
+
+    def test_chi_aspetta_riceve_la_sessione_restituita(self):
+        pool = self._pool(dimensione=1, max_attesa=1, timeout=5)
+        ottenute = []
+        with pool.sessione() as prima:
+            attesa = threading.Thread(target=lambda: ottenute.append(pool._prendi()))
+            attesa.start()
+            while not pool._in_attesa:
+                time.sleep(0.001)
+        attesa.join()
+        self.assertEqual((ottenute, pool._create), ([prima], 1))
+        riepilogo = pool.metriche.riepilogo()
+        self.assertEqual((riepilogo['inferenze'], riepilogo['rifiutate']), (1, 0))
+        self.assertIsNotNone(riepilogo['latenza_ms_p50'])
+
+    def test_riscalda_salta_le_sessioni_in_uso(self):
+        pool = self._pool(dimensione=2, max_attesa=0)
+        with pool.sessione() as occupata:
+            pool.riscalda()
+            self.assertEqual(pool._create, 2)
+            self.assertEqual(occupata.eseguite, 0)
+        self.assertEqual(sorted(s.eseguite for s in pool._libere), [0, 1])
+        self.assertEqual(pool.metriche.rifiutate, 0)
+
+    def test_modello_condiviso_dal_file_ort(self):
+        with tempfile.TemporaryDirectory() as cartella:
+            percorso = os.path.join(cartella, 'best.onnx')
+            pool = onnx_pool.SessionPool(percorso)
+            opzioni = mock.Mock()
+            with override_settings(ONNX_SHARED_MODEL=True):
+                self.assertEqual(pool._sorgente_modello(opzioni), percorso)
+                opzioni.add_session_config_entry.assert_not_called()
+                with open(os.path.join(cartella, 'best.ort'), 'wb') as f:
+                    f.write(b'ORTM')
+                buffer = pool._sorgente_modello(opzioni)
+                self.assertIs(pool._sorgente_modello(opzioni), buffer)
+            self.assertEqual(buffer, b'ORTM')
+            opzioni.add_session_config_entry.assert_any_call(
+                'session.use_ort_model_bytes_for_initializers', '1')
+
+
+# ── core/ultimo_controllo.py ────────────────────────────────────────────────
+
+class UltimoControlloTest(TestCase):
+    def setUp(self):
+        self.utente = _utente('u')
+        apiario = _apiario(self.utente)
+        self.arnia, self.altra = _arnia(apiario), _arnia(apiario, numero=2)
+        self.colonia = Colonia.objects.create(
+            arnia=self.arnia, apiario=apiario, utente=self.utente, data_inizio=date(2024, 1, 1))
+
+    def _controllo(self, giorni_fa, arnia=None, **campi):
+        return _controllo(arnia or self.arnia, self.utente, colonia=self.colonia,
+                          data=date.today() - timedelta(days=giorni_fa), **campi)
+
+    def _fotografia(self, model, pk):
+        return model.objects.values_list('ultimo_controllo_id', 'ultimo_telaini_covata').get(pk=pk)
+
+    def test_creazione_vince_il_piu_recente(self):
+        recente = self._controllo(1, telaini_covata=6)
+        self._controllo(5, telaini_covata=2)  # inserito dopo ma più vecchio
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk), (recente.pk, 6))
+        self.assertEqual(self._fotografia(Colonia, self.colonia.pk), (recente.pk, 6))
+        # A parità di data vince l'ultimo inserito
+        pari = self._controllo(1, telaini_covata=4)
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk), (pari.pk, 4))
+
+    def test_spostamento_ricalcola_entrambe_le_arnie(self):
+        vecchio = self._controllo(5, telaini_covata=2)
+        spostato = self._controllo(1, telaini_covata=6)
+        spostato.arnia = self.altra
+        spostato.save()
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk), (vecchio.pk, 2))
+        self.assertEqual(self._fotografia(Arnia, self.altra.pk), (spostato.pk, 6))
+
+    def test_eliminazione(self):
+        vecchio = self._controllo(5, telaini_covata=2)
+        self._controllo(1, telaini_covata=6).delete()
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk), (vecchio.pk, 2))
+        vecchio.delete()
+        self.assertEqual(self._fotografia(Colonia, self.colonia.pk), (None, None))
+
+    def test_save_completo_non_sovrascrive_la_fotografia(self):
+        arnia = Arnia.objects.get(pk=self.arnia.pk)  # letta prima del controllo
+        controllo = self._controllo(1)
+        arnia.note = 'modificata'
+        arnia.save()
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk)[0], controllo.pk)
+
+    def test_ricalcola_tutti_dopo_scritture_senza_signal(self):
+        controllo = self._controllo(1, telaini_covata=6)
+        Arnia.objects.update(ultimo_controllo=None, ultimo_telaini_covata=None)
+        Colonia.objects.update(ultimo_controllo=None, ultimo_telaini_covata=None)
+        self.assertEqual(ultimo_controllo.ricalcola_tutti(blocco=1), (2, 1))
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk), (controllo.pk, 6))
+        self.assertEqual(self._fotografia(Colonia, self.colonia.pk), (controllo.pk, 6))
+
+        Arnia.objects.update(ultimo_controllo=None)
+        call_command('ricalcola_ultimo_controllo', stdout=io.StringIO())
+        self.assertEqual(self._fotografia(Arnia, self.arnia.pk)[0], controllo.pk)
@@ -0,0 +1,71 @@
+"""Ultimo controllo di ogni Arnia e Colonia, denormalizzato.
+
+Dashboard, widget di salute, contesto dell'assistente AI e gestione melari
+chiedono tutti "l'ultimo ControlloArnia di ogni arnia". Invece di una query
+per arnia, Arnia e Colonia tengono una fotografia dell'ultimo controllo
+(``ultimo_controllo`` più data, covata, scorte, regina, problemi sanitari e
+sciamatura), leggibile con lo stesso SELECT che carica le arnie.
+
+La fotografia è ricalcolata dai signal (core/signals.py) quando un controllo
+viene creato, modificato (anche spostato su un'altra arnia o colonia) o
+eliminato: un'UPDATE con subquery sull'ultimo controllo, dopo aver bloccato
+le righe (``select_for_update``) così due controlli concorrenti sulla stessa
+arnia non lasciano la fotografia del primo. Chi scrive controlli con
+``.update()`` / ``bulk_create`` chiama :func:`aggiorna_ultimo_controllo`.
+
+Per ricostruire tutto (dopo import massivi o per verifica)::
+
+    python manage.py ricalcola_ultimo_controllo
+"""
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import Arnia, Colonia, ControlloArnia
+
+# A parità di data vince il controllo inserito per ultimo
+ORDINE = ('-data', '-data_creazione', '-id')
+
+# campo denormalizzato → campo di ControlloArnia
+CAMPI = {
+    'ultimo_controllo': 'pk',
+    'ultimo_controllo_data': 'data',
+    'ultimo_telaini_covata': 'telaini_covata',
+    'ultimo_telaini_scorte': 'telaini_scorte',
+    'ultimo_presenza_regina': 'presenza_regina',
+    'ultimo_problemi_sanitari': 'problemi_sanitari',
+    'ultimo_sciamatura': 'sciamatura',
+}
+
+
+def _aggiorna(model, campo, ids):
+    ids = sorted({i for i in ids if i is not None})
+    if not ids:
+        return 0
+    ultimo = ControlloArnia.objects.filter(**{campo: OuterRef('pk')}).order_by(*ORDINE)
+    with transaction.atomic():
+        list(model.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        return model.objects.filter(pk__in=ids).update(**{
+            destinazione: Subquery(ultimo.values(sorgente)[:1])
+            for destinazione, sorgente in CAMPI.items()
+        })
+
+
+def aggiorna_ultimo_controllo(arnia_ids=(), colonia_ids=()):
+    """Ricalcola la fotografia delle arnie e colonie indicate."""
+    _aggiorna(Arnia, 'arnia', arnia_ids)
+    _aggiorna(Colonia, 'colonia', colonia_ids)
+
+
+def ricalcola_tutti(blocco=500):
+    """Ricalcola tutte le arnie e colonie, `blocco` righe per transazione.
+
+    Restituisce ``(arnie, colonie)`` aggiornate.
+    """
+    totali = []
+    for model, campo in ((Arnia, 'arnia'), (Colonia, 'colonia')):
+        ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        totali.append(sum(
+            _aggiorna(model, campo, ids[i:i + blocco]) for i in range(0, len(ids), blocco)
+        ))
+    return tuple(totali)
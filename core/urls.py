@@ -187,6 +187,8 @@ urlpatterns = [
     path('ai/chat/', ai_views.chat_ai, name='ai_chat'),
     path('ai/voice/', ai_views.voice_ai, name='ai_voice'),
     path('ai/analisi-telaino/', ai_views.analisi_telaino, name='analisi_telaino'),
+    path('ai/analisi-telaino/batch/', ai_views.analisi_telaini_batch, name='analisi_telaini_batch'),
+    path('ai/onnx-metriche/', ai_views.onnx_metriche, name='onnx_metriche'),
     path('ai/get-arnie/', ai_views.get_arnie_per_apiario, name='get_arnie_per_apiario'),
     path('ai/get-telaini/', ai_views.get_telaini_per_arnia, name='get_telaini_per_arnia'),
     path('ai/analisi-telaino/<int:analisi_id>/elimina/', ai_views.elimina_analisi_telaino, name='elimina_analisi_telaino'),
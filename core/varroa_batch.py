@@ -0,0 +1,130 @@
+"""Batch Varroa trajectories for many colonies with shared inputs.
+
+``compute_trajectories(colonie)`` loads checkpoints, inspections and treatments
+for the whole id set in three queries, groups them per colony and runs
+:class:`core.varroa_engine.VarroaEngine` on each group. Each engine gets exactly
+the inputs the single-colony endpoint would give it, so the per-colony result is
+the same as ``VarroaCheckpointViewSet.traiettoria`` (minus the serialized
+checkpoints).
+
+The engine does no I/O, so the runs can fan out over a thread or a process
+pool once the rows are in memory.
+"""
+
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+from core.models import ControlloArnia, TrattamentoSanitario, VarroaCheckpoint
+from core.varroa_engine import VarroaEngine
+
+# Below this many colonies the pool start-up costs more than it saves.
+MIN_COLONIES_FOR_POOL = 8
+POOL_KINDS = ('thread', 'process')
+
+
+def load_trajectory_inputs(colonia_ids, days_ahead=60):
+    """Engine inputs for every colony: ``{colonia_id: (checkpoints, ispezioni, trattamenti)}``.
+
+    Three queries for the whole id set. Treatments are shared between colonies
+    through the M2M table, so each colony gets its own instance of each row.
+    """
+    colonia_ids = list(colonia_ids)
+    checkpoints = defaultdict(list)
+    ispezioni = defaultdict(list)
+    trattamenti = defaultdict(list)
+
+    for cp in (VarroaCheckpoint.objects
+               .filter(colonia_id__in=colonia_ids)
+               .only('id', 'colonia_id', 'data_campionamento', 'percentuale_calcolata')
+               .order_by('colonia_id', 'data_campionamento')):
+        checkpoints[cp.colonia_id].append(cp)
+
+    for row in (ControlloArnia.objects
+                .filter(colonia_id__in=colonia_ids)
+                .values('colonia_id', 'data', 'telaini_covata')
+                .order_by('colonia_id', 'data')):
+        ispezioni[row.pop('colonia_id')].append(row)
+
+    # Same window as the single-colony endpoint; treatments ending before the
+    # first checkpoint are loaded too but never reach the engine's output.
+    through = TrattamentoSanitario.colonie.through
+    for link in (through.objects
+                 .filter(
+                     colonia_id__in=colonia_ids,
+                     trattamentosanitario__data_inizio__lte=date.today() + timedelta(days=days_ahead),
+                 )
+                 .exclude(trattamentosanitario__stato='annullato')
+                 .select_related('trattamentosanitario__tipo_trattamento')
+                 .order_by('trattamentosanitario__data_inizio', 'trattamentosanitario_id')):
+        trattamenti[link.colonia_id].append(link.trattamentosanitario)
+
+    return {
+        cid: (checkpoints[cid], ispezioni[cid], trattamenti[cid])
+        for cid in colonia_ids
+    }
+
+
+def run_engine(inputs, days_ahead=60):
+    """Trajectory for one colony's ``(checkpoints, ispezioni, trattamenti)``. No ORM access."""
+    checkpoints, ispezioni, trattamenti = inputs
+    return VarroaEngine(
+        checkpoints=checkpoints,
+        ispezioni=ispezioni,
+        trattamenti=trattamenti,
+        days_ahead=days_ahead,
+    ).compute_trajectory()
+
+
+def compute_trajectories(colonie, days_ahead=60, workers=None, pool='thread'):
+    """Run :class:`VarroaEngine` for many colonies in one pass.
+
+    Parameters
+    ----------
+    colonie : iterable of core.models.Colonia
+        Already-fetched, access-checked colonies.
+    days_ahead : int
+        Projection horizon, as in the single-colony endpoint.
+    workers : int, optional
+        Pool size for the engine runs. ``None``/``0``/``1`` runs in-process;
+        the pool is also skipped for fewer than ``MIN_COLONIES_FOR_POOL``.
+    pool : {'thread', 'process'}
+        Executor kind. Processes sidestep the GIL but pay for pickling the
+        inputs; threads only help where NumPy releases it.
+
+    Returns
+    -------
+    tuple[dict, dict]
+        ``{colonia_id: trajectory result}`` in input order and the timings in
+        milliseconds (``load_ms``, ``engine_ms``, ``total_ms``) plus the
+        effective ``workers`` count.
+    """
+    if pool not in POOL_KINDS:
+        raise ValueError(f"pool deve essere uno di {POOL_KINDS}, non {pool!r}")
+    ids = [c.id for c in colonie]
+    t_start = time.perf_counter()
+
+    inputs = load_trajectory_inputs(ids, days_ahead=days_ahead)
+    ordered = [inputs[cid] for cid in ids]
+    t_load = time.perf_counter()
+
+    use_pool = bool(workers) and workers > 1 and len(ordered) >= MIN_COLONIES_FOR_POOL
+    if use_pool:
+        executor_cls = ProcessPoolExecutor if pool == 'process' else ThreadPoolExecutor
+        chunksize = max(1, len(ordered) // (workers * 4))
+        with executor_cls(max_workers=workers) as executor:
+            results = list(executor.map(
+                run_engine, ordered, [days_ahead] * len(ordered), chunksize=chunksize,
+            ))
+    else:
+        results = [run_engine(inp, days_ahead) for inp in ordered]
+    t_engine = time.perf_counter()
+
+    timings = {
+        'load_ms': round((t_load - t_start) * 1000, 1),
+        'engine_ms': round((t_engine - t_load) * 1000, 1),
+        'total_ms': round((t_engine - t_start) * 1000, 1),
+        'workers': workers if use_pool else 1,
+    }
+    return dict(zip(ids, results)), timings
@@ -13,6 +13,11 @@ Growth:
   - Between checkpoints: log-linear interpolation (no model imposed on known data)
   - Beyond last checkpoint: exponential projection at last observed rate
 
+The trajectory is built from day-indexed NumPy arrays (brood curve,
+interpolation exponents, projection factors, treatment masks) instead of one
+lookup per day, with the same floating-point operations in the same order as a
+per-day loop.
+
 References: Martin (1994), Calis et al. (1999), De Guzman & Rinderer (1999)
 """
 
@@ -20,6 +25,8 @@ import math
 from datetime import date, timedelta
 from typing import Any, Dict, List, Optional
 
+import numpy as np
+
 
 class VarroaEngine:
     # ln(2)/21 ≈ 0.033  (population doubles in 21 days at full brood)
@@ -98,7 +105,8 @@ class VarroaEngine:
                 return thr
         return {"giallo": 2.0, "rosso": 3.0}
 
-    def _build_treatment_events(self, start: date, end: date) -> Dict[date, float]:
+    def _build_treatment_events(self, start: date, end: date,
+                                trattamenti: Optional[list] = None) -> Dict[date, float]:
         """
         Map treatment-start-dates → cumulative survival factor for projection.
 
@@ -107,9 +115,10 @@ class VarroaEngine:
         embedded in the observed % values, so events are only applied during
         the forward projection.
         Cancelled treatments (stato='annullato') are excluded.
+        ``trattamenti`` defaults to the engine's own treatments.
         """
         events: Dict[date, float] = {}
-        for t in self.trattamenti:
+        for t in (self.trattamenti if trattamenti is None else trattamenti):
             # Respect the only manual state: annullato
             if getattr(t, 'stato', None) == 'annullato':
                 continue
@@ -141,17 +150,7 @@ class VarroaEngine:
         chart_end = self.today + timedelta(days=self.days_ahead)
         treatment_events = self._build_treatment_events(first_cp.data_campionamento, chart_end)
 
-        trajectory: List[Dict[str, Any]] = []
-
-        for i, cp in enumerate(self.checkpoints):
-            if i < len(self.checkpoints) - 1:
-                self._interpolate_segment(trajectory, cp, self.checkpoints[i + 1], treatment_events)
-            else:
-                # Last checkpoint point
-                self._add_point(trajectory, cp.data_campionamento,
-                                float(cp.percentuale_calcolata), "checkpoint")
-                # Projection forward
-                self._project_forward(trajectory, cp, chart_end, treatment_events)
+        trajectory = self._trajectory_arrays(last_cp, chart_end, treatment_events)
 
         # Build treatment range list
         chart_start = first_cp.data_campionamento
@@ -177,56 +176,183 @@ class VarroaEngine:
             "statistiche":           self._compute_statistiche(),
         }
 
-    # ── Segment builders ──────────────────────────────────────────────────────
-
-    def _interpolate_segment(self, trajectory, cp0, cp1, treatment_events):
-        """Log-linear interpolation between two checkpoints (exclusive of cp1)."""
-        p0    = float(cp0.percentuale_calcolata)
-        p1    = float(cp1.percentuale_calcolata)
-        d0, d1 = cp0.data_campionamento, cp1.data_campionamento
-        n_days = (d1 - d0).days
-        if n_days <= 0:
-            return
-
-        log_p0 = math.log(max(p0, 0.001))
-        log_p1 = math.log(max(p1, 0.001))
-
-        current = d0
-        while current < d1:
-            t_frac = (current - d0).days / n_days
-            pct    = math.exp(log_p0 + t_frac * (log_p1 - log_p0))
-            tipo   = "checkpoint" if current == d0 else "stima"
-            self._add_point(trajectory, current, pct, tipo)
-            current += timedelta(days=1)
-
-    def _project_forward(self, trajectory, last_cp, end_date, treatment_events):
-        """Exponential projection from last checkpoint using observed/theoretical rate."""
-        r           = self._projection_rate(last_cp)
-        current_pct = float(last_cp.percentuale_calcolata)
-        current     = last_cp.data_campionamento + timedelta(days=1)
-
-        while current <= end_date:
-            if current in treatment_events:
-                current_pct *= treatment_events[current]
-            current_pct = max(current_pct * math.exp(r), 0.001)
-            self._add_point(trajectory, current, current_pct, "proiezione")
-            current += timedelta(days=1)
-
-    def _add_point(self, trajectory, dt: date, pct: float, tipo: str):
-        telaini = self.telaini_at_date(dt)
-        trattamenti_attivi = [
-            t.tipo_trattamento.nome for t in self.trattamenti
-            if getattr(t, 'stato', None) != 'annullato'
-            and t.data_inizio <= dt
-            and (t.data_fine is None or t.data_fine >= dt)
+    # ── What-if simulation ────────────────────────────────────────────────────
+
+    def simulate_schedules(self, schedules: list) -> List[Dict[str, Any]]:
+        """
+        Project the colony under alternative treatment schedules in one batch.
+
+        Args:
+            schedules: one list of treatments per scenario, shaped like
+                       ``trattamenti`` (tipo_trattamento, data_inizio,
+                       blocco_covata_attivo). Each is applied on top of the
+                       engine's own treatments.
+        Returns one dict per scenario, over the projection (day after the last
+        checkpoint → today + days_ahead):
+          {picco, data_picco, giorni_sopra_soglia_rossa, data_prima_soglia_rossa,
+           percentuale_fine, data_fine}
+        """
+        if not self.checkpoints or not schedules:
+            return [self._empty_simulation() for _ in schedules]
+
+        first_cp  = self.checkpoints[0]
+        last_cp   = self.checkpoints[-1]
+        chart_end = self.today + timedelta(days=self.days_ahead)
+        first_day = last_cp.data_campionamento.toordinal() + 1
+        n = chart_end.toordinal() - first_day + 1
+        if n <= 0:
+            return [self._empty_simulation() for _ in schedules]
+
+        proj_dates = [date.fromordinal(first_day + i) for i in range(n)]
+        rosso = [self.thresholds_for_date(d)["rosso"] for d in proj_dates]
+        events = [
+            self._build_treatment_events(first_cp.data_campionamento, chart_end,
+                                         list(self.trattamenti) + list(schedule))
+            for schedule in schedules
+        ]
+
+        survival = np.vstack([self._survival_row(first_day, n, ev) for ev in events])
+        curves = self._projection_curves(last_cp, survival)
+        above = curves >= np.array(rosso)
+        peak_idx = curves.argmax(axis=1)
+        first_above = np.where(above.any(axis=1), above.argmax(axis=1), -1)
+        return [
+            {
+                "picco":                     round(float(curves[s, peak_idx[s]]), 3),
+                "data_picco":                proj_dates[peak_idx[s]].isoformat(),
+                "giorni_sopra_soglia_rossa": int(n_above),
+                "data_prima_soglia_rossa":   (proj_dates[first_above[s]].isoformat()
+                                              if first_above[s] >= 0 else None),
+                "percentuale_fine":          round(float(curves[s, -1]), 3),
+                "data_fine":                 proj_dates[-1].isoformat(),
+            }
+            for s, n_above in enumerate(above.sum(axis=1).tolist())
+        ]
+
+    @staticmethod
+    def _empty_simulation() -> Dict[str, Any]:
+        return {
+            "picco": None, "data_picco": None, "giorni_sopra_soglia_rossa": 0,
+            "data_prima_soglia_rossa": None, "percentuale_fine": None, "data_fine": None,
+        }
+
+    # ── Trajectory arrays ─────────────────────────────────────────────────────
+
+    def _trajectory_arrays(self, last_cp, chart_end, treatment_events):
+        """One point per day, computed per segment on arrays."""
+        days:  List[Any]   = []   # ordinal day arrays, one per segment
+        pcts:  List[float] = []
+        tipi:  List[str]   = []
+
+        # Log-linear interpolation between checkpoints (exclusive of the next one).
+        # exp() stays on math.exp, np.exp may differ from libm by one ulp.
+        for cp0, cp1 in zip(self.checkpoints, self.checkpoints[1:]):
+            d0, d1 = cp0.data_campionamento, cp1.data_campionamento
+            n_days = (d1 - d0).days
+            if n_days <= 0:
+                continue
+            log_p0 = math.log(max(float(cp0.percentuale_calcolata), 0.001))
+            log_p1 = math.log(max(float(cp1.percentuale_calcolata), 0.001))
+            k = np.arange(n_days)
+            exponents = log_p0 + (k / n_days) * (log_p1 - log_p0)
+            days.append(d0.toordinal() + k)
+            pcts.extend(math.exp(x) for x in exponents.tolist())
+            tipi.append("checkpoint")
+            tipi.extend(["stima"] * (n_days - 1))
+
+        # Last checkpoint point
+        last_day = last_cp.data_campionamento.toordinal()
+        days.append(np.array([last_day]))
+        pcts.append(float(last_cp.percentuale_calcolata))
+        tipi.append("checkpoint")
+
+        # Projection forward
+        n_proj = chart_end.toordinal() - last_day
+        if n_proj > 0:
+            proj_days = last_day + 1 + np.arange(n_proj)
+            days.append(proj_days)
+            survival = self._survival_row(last_day + 1, n_proj, treatment_events)
+            pcts.extend(self._projection_curves(last_cp, survival[None, :])[0].tolist())
+            tipi.extend(["proiezione"] * n_proj)
+
+        all_days = np.concatenate(days)
+        telaini  = self._telaini_curve(all_days).tolist()
+        attivi   = self._active_treatment_names(all_days)
+        return [
+            {
+                "data":               date.fromordinal(d).isoformat(),
+                "percentuale":        round(pct, 3),
+                "tipo":               tipo,
+                "telaini_covata":     tel,
+                "trattamenti_attivi": names,
+            }
+            for d, pct, tipo, tel, names in zip(all_days.tolist(), pcts, tipi, telaini, attivi)
         ]
-        trajectory.append({
-            "data":               dt.isoformat(),
-            "percentuale":        round(pct, 3),
-            "tipo":               tipo,
-            "telaini_covata":     telaini,
-            "trattamenti_attivi": trattamenti_attivi,
-        })
+
+    def _survival_row(self, first_day: int, n: int, treatment_events) -> "np.ndarray":
+        """Per-day survival factors from day ``first_day`` on (1.0 without a treatment start)."""
+        survival = np.ones(n)
+        for d, factor in treatment_events.items():
+            i = d.toordinal() - first_day
+            if 0 <= i < n:
+                survival[i] = factor
+        return survival
+
+    def _projection_curves(self, last_cp, survival) -> "np.ndarray":
+        """
+        Daily projected % for each row of survival factors, as a running product.
+
+        The factors are interleaved as [survival_1, growth, survival_2, growth, ...]
+        so cumprod multiplies in the same order as a per-day loop. The 0.001
+        floor breaks the product; from a row's first floored day on the loop
+        finishes that row.
+        """
+        growth = math.exp(self._projection_rate(last_cp))
+        p0 = float(last_cp.percentuale_calcolata)
+        rows, n = survival.shape
+
+        factors = np.empty((rows, 2 * n + 1))
+        factors[:, 0] = p0
+        factors[:, 1::2] = survival
+        factors[:, 2::2] = growth
+        curves = np.cumprod(factors, axis=1)[:, 2::2]
+
+        floored = ~(curves >= 0.001)
+        for r in np.flatnonzero(floored.any(axis=1)):
+            cut = int(np.argmax(floored[r]))
+            current_pct = float(curves[r, cut - 1]) if cut else p0
+            for i in range(cut, n):
+                current_pct = max(current_pct * float(survival[r, i]) * growth, 0.001)
+                curves[r, i] = current_pct
+        return curves
+
+    def _telaini_curve(self, days):
+        """Vectorised telaini_at_date over ordinal days (ties → earlier inspection)."""
+        if not self.ispezioni:
+            return np.full(len(days), 5.0)
+        ords = np.array([i["data"].toordinal() for i in self.ispezioni])
+        values = np.array([float(i.get("telaini_covata") or 5.0) for i in self.ispezioni])
+        # One inspection per date: the first, as min() would pick it
+        ords, first = np.unique(ords, return_index=True)
+        values = values[first]
+
+        idx    = np.searchsorted(ords, days)
+        after  = np.minimum(idx, len(ords) - 1)
+        before = np.maximum(idx - 1, 0)
+        use_before = np.abs(days - ords[before]) <= np.abs(ords[after] - days)
+        return np.where(use_before, values[before], values[after])
+
+    def _active_treatment_names(self, days) -> List[List[str]]:
+        """Names of the treatments running on each day, as one mask per treatment."""
+        attivi = [t for t in self.trattamenti if getattr(t, 'stato', None) != 'annullato']
+        if not attivi:
+            return [[] for _ in range(len(days))]
+        names  = np.array([t.tipo_trattamento.nome for t in attivi], dtype=object)
+        starts = np.array([t.data_inizio.toordinal() for t in attivi])
+        ends   = np.array([t.data_fine.toordinal() if t.data_fine else date.max.toordinal()
+                           for t in attivi])
+        mask = (days >= starts[:, None]) & (days <= ends[:, None])
+        return [names[col].tolist() for col in mask.T]
 
     def _projection_rate(self, last_cp) -> float:
         """Last-observed rate or theoretical rate if only one checkpoint."""
@@ -288,7 +414,7 @@ class VarroaEngine:
             days  = (last_cp.data_campionamento - prev.data_campionamento).days
             p0    = float(prev.percentuale_calcolata)
             p1    = float(last_cp.percentuale_calcolata)
-            if days > 0 and p0 > 0:
+            if days > 0 and p0 > 0 and p1 > 0:
                 tasso = round(math.log(p1 / p0) / days, 4)
         return {
             "n_checkpoints":                     len(self.checkpoints),
@@ -39,6 +39,9 @@ from .forms import (
     ClienteForm, VenditaForm, DettaglioVenditaFormSet, InvasettamentoForm, NucleoForm, ControlloNucleoForm,
     MaturatoreForm, ContenitoreStoccaggioForm, InvasettaDaContenitoreForm,
 )
+from .accesso import accesso_utente, apiari_accessibili_ids
+from .dashboard import aggregati_dashboard, mesi_grafici
+from .notifications import aggiorna_contatori, riepilogo_notifiche
 from .decorators import (
     richiedi_proprietario_o_gruppo, richiedi_appartenenza_gruppo, 
     richiedi_ruolo_admin, richiedi_permesso_scrittura
@@ -58,91 +61,46 @@ def dashboard(request):
     if not request.user.profilo.onboarding_completato:
         return redirect('onboarding')
     # Ottieni apiari a cui l'utente ha accesso (propri o condivisi tramite gruppi)
-    apiari_propri = Apiario.objects.filter(proprietario=request.user)
-    
-    # Apiari condivisi tramite gruppi
-    gruppi_utente = Gruppo.objects.filter(membri=request.user)
-    apiari_condivisi = Apiario.objects.filter(
-        gruppo__in=gruppi_utente, 
-        condiviso_con_gruppo=True
-    ).exclude(proprietario=request.user)
-    
-    # Unisci gli apiari
-    apiari = (apiari_propri | apiari_condivisi).distinct()
+    accesso = accesso_utente(request.user)
+    apiari = Apiario.objects.filter(pk__in=accesso.apiari_ids)
     data_odierna = timezone.now().date()
     
     # Ultimi controlli effettuati (considera solo arnie a cui l'utente ha accesso)
-    arnie_accessibili = Arnia.objects.filter(apiario__in=apiari)
     ultimi_controlli = ControlloArnia.objects.filter(
-        arnia__in=arnie_accessibili
-    ).order_by('-data')[:10]
+        arnia__apiario_id__in=accesso.apiari_ids
+    ).select_related('arnia__apiario', 'utente').order_by('-data')[:10]
     
     # Fioriture attuali: legate agli apiari dell'utente + senza apiario (proprie o del gruppo)
-    utenti_gruppo = User.objects.filter(gruppi__in=gruppi_utente)
+    utenti_gruppo = MembroGruppo.objects.filter(
+        gruppo_id__in=accesso.gruppi_ids
+    ).values('utente_id')
     fioriture_attuali = Fioritura.objects.filter(
         data_inizio__lte=data_odierna
     ).filter(
         Q(data_fine__isnull=True) | Q(data_fine__gte=data_odierna)
     ).filter(
-        Q(apiario__in=apiari) |
+        Q(apiario_id__in=accesso.apiari_ids) |
         Q(apiario__isnull=True, creatore=request.user) |
         Q(apiario__isnull=True, creatore__in=utenti_gruppo) |
         Q(apiario__isnull=True, pubblica=True)
-    ).distinct()
+    ).select_related('apiario')
     
-    # Conteggio arnie totali
-    num_arnie = arnie_accessibili.count()
-
-    # Dati grafici: controlli ultimi 6 mesi
-    controlli_per_mese = []
-    mesi_labels = []
-    for i in range(5, -1, -1):
-        mese_inizio = (data_odierna.replace(day=1) - relativedelta(months=i))
-        mese_fine = (mese_inizio + relativedelta(months=1))
-        count = ControlloArnia.objects.filter(
-            arnia__in=arnie_accessibili,
-            data__gte=mese_inizio,
-            data__lt=mese_fine
-        ).count()
-        controlli_per_mese.append(count)
-        mesi_labels.append(mese_inizio.strftime('%b %Y'))
-
-    # Dati grafici: produzione miele ultimi 6 mesi
-    smielature_per_mese = []
-    for i in range(5, -1, -1):
-        mese_inizio = (data_odierna.replace(day=1) - relativedelta(months=i))
-        mese_fine = (mese_inizio + relativedelta(months=1))
-        kg = Smielatura.objects.filter(
-            apiario__in=apiari,
-            data__gte=mese_inizio,
-            data__lt=mese_fine
-        ).aggregate(tot=Sum('quantita_miele'))['tot'] or 0
-        smielature_per_mese.append(float(kg))
-
-    # Stato arnie: con/senza regina nell'ultimo controllo
-    arnie_con_problemi = 0
-    arnie_senza_regina = 0
-    for arnia in arnie_accessibili:
-        ultimo = ControlloArnia.objects.filter(arnia=arnia).order_by('-data').first()
-        if ultimo:
-            if not ultimo.presenza_regina:
-                arnie_senza_regina += 1
-            if ultimo.problemi_sanitari or ultimo.sciamatura:
-                arnie_con_problemi += 1
+    # Conteggi, grafici e stato arnie (core/dashboard.py, in cache per utente)
+    aggregati = aggregati_dashboard(request.user, data_odierna)
+    mesi_labels = [mese.strftime('%b %Y') for mese in mesi_grafici(data_odierna)]
 
     context = {
         'apiari': apiari,
         'ultimi_controlli': ultimi_controlli,
         'fioriture_attuali': fioriture_attuali,
         'data_selezionata': data_odierna,
-        'apiari_condivisi': apiari_condivisi,
-        'num_arnie': num_arnie,
+        'num_arnie': aggregati['num_arnie'],
         # Chart data (as JSON for JS)
         'chart_mesi': json.dumps(mesi_labels),
-        'chart_controlli': json.dumps(controlli_per_mese),
-        'chart_produzione': json.dumps(smielature_per_mese),
-        'arnie_senza_regina': arnie_senza_regina,
-        'arnie_con_problemi': arnie_con_problemi,
+        'chart_controlli': json.dumps(aggregati['controlli_per_mese']),
+        'chart_produzione': json.dumps(aggregati['produzione_per_mese']),
+        'arnie_senza_regina': aggregati['arnie_senza_regina'],
+        'arnie_con_problemi': aggregati['arnie_con_problemi'],
     }
 
     return render(request, 'dashboard.html', context)
@@ -322,13 +280,11 @@ def nuovo_controllo(request, arnia_id):
     else:
         # Pre-compila con gli ultimi valori registrati se disponibili
         initial_data = {}
-        ultimo_controllo = ControlloArnia.objects.filter(arnia=arnia).order_by('-data').first()
-        
-        if ultimo_controllo:
+        if arnia.ultimo_controllo_id:
             initial_data = {
-                'telaini_scorte': ultimo_controllo.telaini_scorte,
-                'telaini_covata': ultimo_controllo.telaini_covata,
-                'presenza_regina': ultimo_controllo.presenza_regina,
+                'telaini_scorte': arnia.ultimo_telaini_scorte,
+                'telaini_covata': arnia.ultimo_telaini_covata,
+                'presenza_regina': arnia.ultimo_presenza_regina,
             }
         
         form = ControlloArniaForm(initial=initial_data)
@@ -889,7 +845,9 @@ def gestione_melari_globale(request):
     total_in_smielatura = 0
 
     for apiario in apiari:
-        arnie = Arnia.objects.filter(apiario=apiario, attiva=True).order_by('numero')
+        arnie = Arnia.objects.filter(
+            apiario=apiario, attiva=True
+        ).select_related('ultimo_controllo').order_by('numero')
         arnie_data = []
         for arnia in arnie:
             melari_attivi = list(
@@ -898,11 +856,10 @@ def gestione_melari_globale(request):
                     stato__in=['posizionato', 'in_smielatura']
                 ).order_by('-posizione')
             )
-            ultimo_controllo = ControlloArnia.objects.filter(arnia=arnia).order_by('-data').first()
             arnie_data.append({
                 'arnia': arnia,
                 'melari': melari_attivi,
-                'ultimo_controllo': ultimo_controllo,
+                'ultimo_controllo': arnia.ultimo_controllo,
             })
             for m in melari_attivi:
                 if m.stato == 'posizionato':
@@ -3088,25 +3045,17 @@ def calendario_eventi_json(request):
     events = []
     
     # Apiari a cui l'utente ha accesso
-    apiari_propri = Apiario.objects.filter(proprietario=request.user)
-    gruppi_utente = Gruppo.objects.filter(membri=request.user)
-    apiari_condivisi = Apiario.objects.filter(
-        gruppo__in=gruppi_utente, 
-        condiviso_con_gruppo=True
-    ).exclude(proprietario=request.user)
+    apiari = Apiario.objects.filter(pk__in=apiari_accessibili_ids(request.user))
 
     # Filtra per gruppo se specificato
     if gruppo_id:
-        apiari_propri = apiari_propri.filter(gruppo_id=gruppo_id)
-        apiari_condivisi = apiari_condivisi.filter(gruppo_id=gruppo_id)
+        apiari = apiari.filter(gruppo_id=gruppo_id)
     
     # Filtra per apiario se specificato
     if apiario_id:
-        apiari_propri = apiari_propri.filter(id=apiario_id)
-        apiari_condivisi = apiari_condivisi.filter(id=apiario_id)
+        apiari = apiari.filter(id=apiario_id)
     
-    # Unisci gli apiari
-    apiari = list((apiari_propri | apiari_condivisi).distinct())
+    apiari = list(apiari)
     apiari_ids = [apiario.id for apiario in apiari]
     
     # ------------------- Recupero Controlli -------------------
@@ -6144,7 +6093,7 @@ def centro_notifiche(request):
         'tipo_filtro': tipo_filtro,
         'solo_non_lette': solo_non_lette,
         'tipi_disponibili': tipi_disponibili,
-        'totale_non_lette': Notifica.objects.filter(utente=request.user, letta=False).count(),
+        'totale_non_lette': riepilogo_notifiche(request.user)['non_lette'],
     }
     return render(request, 'notifiche/centro_notifiche.html', context)
 
@@ -6157,7 +6106,7 @@ def segna_notifica_letta(request, notifica_id):
         notifica.letta = True
         notifica.save()
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({'ok': True, 'non_lette': Notifica.objects.filter(utente=request.user, letta=False).count()})
+            return JsonResponse({'ok': True, 'non_lette': riepilogo_notifiche(request.user)['non_lette']})
         if notifica.link:
             return redirect(notifica.link)
         return redirect('centro_notifiche')
@@ -6168,7 +6117,8 @@ def segna_notifica_letta(request, notifica_id):
 def segna_tutte_notifiche_lette(request):
     """Segna tutte le notifiche come lette"""
     if request.method == 'POST':
-        Notifica.objects.filter(utente=request.user, letta=False).update(letta=True)
+        lette = Notifica.objects.filter(utente=request.user, letta=False).update(letta=True)
+        aggiorna_contatori({request.user.pk: -lette})
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'ok': True, 'non_lette': 0})
         messages.success(request, "Tutte le notifiche sono state segnate come lette.")
@@ -6182,7 +6132,7 @@ def elimina_notifica(request, notifica_id):
         notifica = get_object_or_404(Notifica, pk=notifica_id, utente=request.user)
         notifica.delete()
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({'ok': True, 'non_lette': Notifica.objects.filter(utente=request.user, letta=False).count()})
+            return JsonResponse({'ok': True, 'non_lette': riepilogo_notifiche(request.user)['non_lette']})
         messages.success(request, "Notifica eliminata.")
     return redirect('centro_notifiche')
 
@@ -6190,9 +6140,9 @@ def elimina_notifica(request, notifica_id):
 @login_required
 def get_notifiche_recenti(request):
     """API JSON per polling notifiche recenti (usato dal frontend)"""
-    notifiche = Notifica.objects.filter(utente=request.user).order_by('-data_creazione')[:10]
+    riepilogo = riepilogo_notifiche(request.user)
     data = []
-    for n in notifiche:
+    for n in riepilogo['recenti'][:10]:
         data.append({
             'id': n.id,
             'tipo': n.tipo,
@@ -6204,8 +6154,7 @@ def get_notifiche_recenti(request):
             'data': n.data_creazione.strftime('%d/%m/%Y %H:%M'),
             'mittente': n.mittente.get_full_name() or n.mittente.username if n.mittente else '',
         })
-    non_lette = Notifica.objects.filter(utente=request.user, letta=False).count()
-    return JsonResponse({'notifiche': data, 'non_lette': non_lette})
+    return JsonResponse({'notifiche': data, 'non_lette': riepilogo['non_lette']})
 
 
 # ============================================================
@@ -1,5 +1,4 @@
 import datetime
-import math
 
 from django.core.cache import cache
 from django.db.models import Avg, Count, F, Max, Min, Q, Sum
@@ -9,6 +8,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from core.geo import indice_fioriture
 from core.models import (
     Apiario, Arnia, Attrezzatura, CategoriaAttrezzatura,
     ControlloArnia, DettaglioVendita, Fioritura, Gruppo,
@@ -55,16 +55,6 @@ def _get_user_arnia_ids(user, apiario_id=None):
     return list(qs.values_list('id', flat=True))
 
 
-def _haversine_km(lat1, lon1, lat2, lon2):
-    """Distanza in km tra due coordinate (Haversine)."""
-    R = 6371.0
-    phi1, phi2 = math.radians(float(lat1)), math.radians(float(lat2))
-    dphi = math.radians(float(lat2) - float(lat1))
-    dlambda = math.radians(float(lon2) - float(lon1))
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-
 # ---------------------------------------------------------------------------
 # Widget catalog + Dashboard config
 # ---------------------------------------------------------------------------
@@ -121,19 +111,16 @@ class SaluteArnieView(APIView):
         arnie_attenzione = []
         arnie_critiche = []
 
+        # Ultimo controllo denormalizzato sull'arnia (core/ultimo_controllo.py)
         for arnia in arnie_qs.select_related('apiario'):
-            ultimo = ControlloArnia.objects.filter(
-                arnia=arnia, data__gte=data_soglia
-            ).order_by('-data').first()
-
             info = {
                 'id': arnia.id,
                 'numero': arnia.numero,
                 'apiario': arnia.apiario.nome,
             }
-            if not ultimo:
+            if arnia.ultimo_controllo_data is None or arnia.ultimo_controllo_data < data_soglia:
                 arnie_critiche.append(info)
-            elif not ultimo.presenza_regina or ultimo.problemi_sanitari:
+            elif not arnia.ultimo_presenza_regina or arnia.ultimo_problemi_sanitari:
                 arnie_attenzione.append(info)
             else:
                 arnie_ottime.append(info)
@@ -616,35 +603,40 @@ class FioritureVicineView(APIView):
         if apiario_id:
             apiari = apiari.filter(id=apiario_id)
 
+        # Coppie (fioritura, km) dall'indice spaziale per ogni apiario, poi il
+        # filtro "attive" in una sola query: le distanze sono già quelle
+        # calcolate dall'indice.
+        apiari = list(apiari)
+        indice = indice_fioriture()
+        vicine = [
+            (apiario, indice.entro(apiario.latitudine, apiario.longitudine, raggio_km))
+            for apiario in apiari
+        ]
         fioriture_attive = Fioritura.objects.filter(
             Q(data_fine__isnull=True) | Q(data_fine__gte=oggi),
             data_inizio__lte=oggi,
-        )
+        ).in_bulk({pk for _, coppie in vicine for pk, _ in coppie})
 
         risultati = []
         viste = set()
 
-        for apiario in apiari:
-            for f in fioriture_attive:
-                if f.id in viste:
+        for apiario, coppie in vicine:
+            for pk, distanza in coppie:
+                f = fioriture_attive.get(pk)
+                if f is None or pk in viste:
                     continue
-                distanza = _haversine_km(
-                    apiario.latitudine, apiario.longitudine,
-                    f.latitudine, f.longitudine,
-                )
-                if distanza <= raggio_km:
-                    viste.add(f.id)
-                    risultati.append({
-                        'id': f.id,
-                        'pianta': f.pianta,
-                        'distanza_km': round(distanza, 2),
-                        'lat': float(f.latitudine),
-                        'lng': float(f.longitudine),
-                        'intensita': f.intensita,
-                        'data_inizio': str(f.data_inizio),
-                        'data_fine': str(f.data_fine) if f.data_fine else None,
-                        'apiario_vicino': apiario.nome,
-                    })
+                viste.add(pk)
+                risultati.append({
+                    'id': f.id,
+                    'pianta': f.pianta,
+                    'distanza_km': round(distanza, 2),
+                    'lat': float(f.latitudine),
+                    'lng': float(f.longitudine),
+                    'intensita': f.intensita,
+                    'data_inizio': str(f.data_inizio),
+                    'data_fine': str(f.data_fine) if f.data_fine else None,
+                    'apiario_vicino': apiario.nome,
+                })
 
         risultati.sort(key=lambda x: x['distanza_km'])
         data = {'fioriture': risultati[:50]}